@@ -1,21 +1,59 @@
-import asyncio, traceback
-from dataclasses import dataclass
+import asyncio, logging, os
+from functools  import partial
+from dataclasses import dataclass, field
 from datetime    import datetime
-from time        import time
-from typing      import Any, Dict, List, Optional, Tuple, Set
+from time        import time, monotonic
+from typing      import Any, Awaitable, Dict, List, Optional, Tuple, Set
 
 from irctokens import build, Line, Hostmask
 from ircrobots import Bot as BaseBot
 from ircrobots import Server as BaseServer
+from ircrobots.interface import SendPriority, SentLine
 
 from ircstates.numerics   import *
 from ircrobots.matching   import Responses, Response, ANY, Folded, SELF
 
 from .config           import Config
 from .database         import Database
-from .utils            import (to_pretty_time, from_pretty_time, mode_batches, cs_op,
-                                SettingType, ConfigError, is_admin, try_join)
-from .database.db_bans import DBBan
+from .dispatch         import Dispatcher
+from .outbound         import OutboundQueue
+from .timers           import Snapshotter
+from .logs             import RawBuffer
+from .metrics          import (LINES_READ, LINES_SENT, COMMAND_SECONDS, POPULATE_SECONDS,
+                                READY_SECONDS)
+from .utils            import (to_pretty_time, from_pretty_time, pack_modes, pack_joins, parse_modes,
+                                cs_op, fts_query, SettingType, ConfigError, try_join)
+from .database.db_bans import DBBan, mask_key
+
+log     = logging.getLogger(__name__)
+raw_log = logging.getLogger(f"{__name__}.raw")
+
+# how many bans LIST and SEARCH show at a time
+LIST_PAGE = 10
+
+# commands whose parameters shouldn't end up in logs
+REDACT = {"PASS", "AUTHENTICATE", "OPER"}
+# keepalive and registration lines skip flood control altogether: ircrobots
+# awaits these on its read loop, and a PONG stuck behind a queue of unbans
+# gets us disconnected
+IMMEDIATE = {"PING", "PONG", "PASS", "CAP", "AUTHENTICATE", "NICK", "USER", "QUIT"}
+
+# how many channels sync their ban lists with the database at once, so
+# joining a few hundred channels doesn't have every one of them diffing
+# and writing at the same time
+SYNC_CONCURRENCY = 8
+# how long to hold off sending JOINs after the server says we're joining
+# too fast (seconds)
+JOIN_BACKOFF = 2.0
+# how long to wait for the server to list a channel's bans (seconds)
+LIST_TIMEOUT = 20.0
+LIST_NUMERICS = {RPL_BANLIST, RPL_ENDOFBANLIST, RPL_QUIETLIST, RPL_ENDOFQUIETLIST}
+# the server won't let us into these, so there's nothing to sync
+JOIN_ERRORS = {
+    ERR_NOSUCHCHANNEL, ERR_TOOMANYCHANNELS, ERR_CHANNELISFULL,
+    ERR_INVITEONLYCHAN, ERR_BANNEDFROMCHAN, ERR_BADCHANNELKEY,
+    ERR_NEEDREGGEDNICK, ERR_LINKCHANNEL
+}
 
 @dataclass
 class Caller(object):
@@ -23,6 +61,15 @@ class Caller(object):
     nick: str
     account: Optional[str]
 
+@dataclass
+class ModeList(object):
+    # how many lists haven't ended yet, and set when they all have
+    waiting: int
+    done:    "asyncio.Future[None]"
+    # (mode, mask_key(mask)) -> (mask, setter, set at), streamed straight
+    # into a set we can diff against
+    masks:   Dict[Tuple[str, str], Tuple[str, str, int]] = field(default_factory=dict)
+
 # decorator, for command usage strings
 def usage(usage_string: str):
     def usage_inner(object: Any):
@@ -46,105 +93,190 @@ class Server(BaseServer):
         super().__init__(bot, name)
         self.config   = config
         self.db       = database
+        self.auth     = config.auth
+        self.network  = config.networks[name]
+        self.dispatch = Dispatcher()
+        self.outbound = OutboundQueue(self._send_now, *self.network.throttle)
+        self.raw      = RawBuffer(config.logging.raw_buffer)
+
+        self._sync_slots = asyncio.Semaphore(SYNC_CONCURRENCY)
+        # folded channel name -> ban list sync in progress
+        self._listing: Dict[str, ModeList] = {}
+        # for time-to-ready: autojoin channels that haven't been synced yet
+        self._started  = monotonic()
+        self._unsynced: Optional[Set[str]] = None
+        # channels the server told us to try again later, and when it last did
+        self._throttled: List[str] = []
+        self._throttled_at = 0.0
 
     def set_throttle(self, rate: int, time: float):
-        # turn off throttling
+        # flood control is done by self.outbound instead
         pass
 
+    def _send_now(self, line: Line, priority: int) -> Awaitable[SentLine]:
+        return super().send(line, priority)
+
+    def _send_priority(self, line: Line) -> int:
+        if (line.command in {"MODE", "CS"} or
+                (line.command == "PRIVMSG" and
+                    self.casefold(line.params[0]) == "chanserv")):
+            return SendPriority.HIGH
+        return SendPriority.MEDIUM
+
+    def send_wait(self,
+            line:     Line,
+            priority: Optional[int] = None) -> Awaitable[SentLine]:
+
+        # resolves once the line has actually gone out, for the few callers
+        # that need to time something from then
+        if not self.registered:
+            # don't hold up registration behind flood control
+            return super().send(line, priority or SendPriority.DEFAULT)
+        elif line.command in IMMEDIATE:
+            return super().send(line, SendPriority.HIGH)
+        if priority is None:
+            priority = self._send_priority(line)
+        return self.outbound.put(line, priority)
+
+    def send(self,
+            line:     Line,
+            priority: Optional[int] = None) -> Awaitable[Optional[SentLine]]:
+
+        # resolves as soon as the line is queued. ircrobots awaits send() on
+        # its read loop (the MODE and WHO queries after each JOIN, for one)
+        # and reading must never wait on flood control
+        self.send_wait(line, priority)
+        queued = asyncio.get_running_loop().create_future()
+        queued.set_result(None)
+        return queued
+
     async def report(self, msg: str, channel: Optional[str] = None):
         if channel is not None:
             if (report_channel := await self.config.runtime.get("reportChannel")):
-                await self.send(build("PRIVMSG", [report_channel, msg]))
+                self.send(build("PRIVMSG", [report_channel, msg]), SendPriority.LOW)
         else:
             if (report_channel := await self.config.runtime.get("reportChannel")):
-                await self.send(build("PRIVMSG", [report_channel, msg]))
+                self.send(build("PRIVMSG", [report_channel, msg]), SendPriority.LOW)
 
     async def _request_comment(self, ban_id: int):
         if (ban := await self.db.bans.get_by_id(ban_id)) is not None:
             nick = ban.setter.split("!")[0]
-            chan = await self.db.channels.get(ban.channelid)
+            chan = (await self.db.channels.from_id(ban.channelid)).name
             out  = (f"Please comment on action "
                     f"#{ban.id} ({chan} +{ban.mode}{ban.mask and ' ' + ban.mask})"
                     f" (/msg {self.nickname} comment {ban.id} +1w trolling)")
-            await self.send(build("NOTICE", [nick, out]))
+            self.send(build("NOTICE", [nick, out]), SendPriority.LOW)
 
     async def _is_authorized(self, ban: DBBan, caller: Caller):
 
         # only the ban setter and known channel ops can do things
         # with bans
-        if is_admin(self.config.admins, caller.source):
+        if self.auth.is_admin(caller.source):
             return True
         elif self.casefold(ban.setter) == self.casefold(caller.source):
             return True
-        elif (caller.account is not None and
-            await self.db.chanops.is_chanop(ban.channelid, caller.account)):
+        elif await self.auth.is_chanop(ban.channelid, self._account(caller)):
             return True
         return False
 
+    def _account(self, caller: Caller) -> Optional[str]:
+        # chanop accounts are stored casefolded
+        if caller.account is not None:
+            return self.casefold(caller.account)
+        return None
+
+    def _expect_lists(self, channel: str, modes: str) -> Optional[ModeList]:
+        # the lists are picked up in line_read: with several channels
+        # syncing at once, wait_for() can read another channel's lines
+        # out from under it
+        folded = self.casefold(channel)
+        if not modes or folded in self._listing:
+            return None
+        listing = self._listing[folded] = ModeList(
+            len(modes), asyncio.get_running_loop().create_future()
+        )
+        return listing
+
     async def _populate_modes(self, channel, modes: str):
-        await self.send(build("MODE", [channel.name, f"+{modes}"]))
-
-        waiting = len(modes)
-
-        masks: Set[Tuple[str, str, str]] = set()
-        while True:
-            line = await self.wait_for(Responses({
-                RPL_BANLIST, RPL_ENDOFBANLIST,
-                RPL_QUIETLIST, RPL_ENDOFQUIETLIST
-            }, [ANY, Folded(channel.name)]))
-            if line.command in [RPL_ENDOFBANLIST, RPL_ENDOFQUIETLIST]:
-                waiting -= 1
-                if waiting == 0:
-                    break
-            else:
-                # :server 367 * #c mask set-by set-at
-                # :server 728 * q #c mask set-by set-at
-                offset = 0
-                type = "b"
-                if line.command == RPL_QUIETLIST:
-                    offset += 1
-                    type = "q"
-
-                mask   = line.params[offset+2]
-                set_by = line.params[offset+3]
-                set_at = int(line.params[offset+4])
-                masks.add((type, mask, set_by))
+        start  = monotonic()
+        folded = self.casefold(channel.name)
+        if (listing := self._expect_lists(channel.name, modes)) is not None:
+            await self.send_wait(build("MODE", [channel.name, f"+{modes}"]))
+        else:
+            # already asked for when we joined
+            listing = self._listing[folded]
+        try:
+            await asyncio.wait_for(listing.done, LIST_TIMEOUT)
+        finally:
+            self._listing.pop(folded, None)
+        masks = listing.masks
 
         old_db    = await self.db.bans.get_by_channel(channel.id, by_active=True, limit=None)
-        old_masks = {(b.mode, b.mask) for b in old_db}
-        masks_l   = {(m[0], m[1]) for m in masks}
-
-        for mode, mask in old_masks:
-            if (mode, mask) in masks:
-                continue
-            if (id := await self.db.bans.get_id(channel.id, mask)) is not None:
-                await self.db.bans.remove(id, None)
-
-        for mode, mask, setter in masks:
-            if (mode, mask) in old_masks:
-                continue
-            await self.db.bans.add(
-                channel.id,
-                setter,
-                mode,
-                mask
-            )
+        old_masks = {(b.mode, mask_key(b.mask)): b.id for b in old_db}
+
+        remove = [id for key, id in old_masks.items() if not key in masks]
+        add    = [
+            (setter, mode, mask, set_at)
+            for (mode, key), (mask, setter, set_at) in masks.items()
+            if not (mode, key) in old_masks
+        ]
+        if remove or add:
+            await self.db.bans.sync(channel.id, remove, add)
+
+        took = monotonic()-start
+        POPULATE_SECONDS.set(self.name, channel.name, value=took)
+        log.info(
+            "synced %s +%s: %d listed, %d added, %d removed in %.1fms",
+            channel.name, modes, len(masks), len(add), len(remove), took*1000,
+            extra={"network": self.name, "channel": channel.name}
+        )
+
+    def _on_list(self, line: Line):
+        if (listing := self._listing.get(self.casefold(line.params[1]))) is None:
+            return
+        elif line.command in {RPL_ENDOFBANLIST, RPL_ENDOFQUIETLIST}:
+            listing.waiting -= 1
+            if listing.waiting == 0 and not listing.done.done():
+                listing.done.set_result(None)
+        else:
+            # :server 367 * #c mask set-by set-at
+            # :server 728 * #c q mask set-by set-at
+            offset = 0
+            type = "b"
+            if line.command == RPL_QUIETLIST:
+                offset += 1
+                type = "q"
+
+            mask   = line.params[offset+2]
+            set_by = line.params[offset+3]
+            set_at = int(line.params[offset+4])
+            listing.masks[(type, mask_key(mask))] = (mask, set_by, set_at)
+
+    async def _remove_modes(self,
+            channel: str,
+            bans:    List[Tuple[str, Optional[str]]]):
+
+        ops: List[Tuple[str, str, Optional[str]]] = [
+            ("-", mode, mask) for mode, mask in bans
+        ]
 
-    async def _remove_modes(self, channel: str, modes: str, args: List[str]):
         cuser = self.channels[self.casefold(channel)].users[self.nickname_lower]
-        remove_op = False
         if not "o" in cuser.modes:
             await cs_op(self, channel)
-            remove_op = True
-        if remove_op:
-            modes += "o"
-            args.append(self.nickname)
+            ops.append(("-", "o", self.nickname))
 
-        batches = mode_batches(
-            self.isupport.modes, False, modes, args
+        batches = pack_modes(
+            self.isupport, channel, ops, len(self.hostmask().encode("utf8"))+2
         )
         for b_modes, b_args in batches:
-            await self.send(build("MODE", [channel, b_modes]+b_args))
+            self.send(build("MODE", [channel, b_modes]+b_args))
+
+    def _user_account(self, nickname: str) -> Optional[str]:
+        # ircstates has already taken the account from extended-join,
+        # account-notify or WHOX by the time we see a line
+        if (user := self.users.get(self.casefold(nickname))) is not None:
+            return user.account or None
+        return None
 
     def _time_format(self, ts: int):
         now = int(time())
@@ -186,62 +318,174 @@ class Server(BaseServer):
 
         return out
 
+    async def _batch_joins(self,
+            channels: List[str],
+            batch_n:  int = 10):
+
+        # ircrobots' autojoin, on RPL_WELCOME. that's on the read loop,
+        # so the sending is handed off to a lane
+        self._unsynced = {self.casefold(c) for c in channels}
+        self.dispatch.submit("joins", partial(self._join_channels, channels))
+
+    async def _join_channels(self, channels: List[str]):
+        # JOINs go out back to back, as many channels to a line as the
+        # server takes, without waiting on replies in between
+        for names in pack_joins(self.isupport, channels):
+            if (wait := self._throttled_at+JOIN_BACKOFF-monotonic()) > 0:
+                await asyncio.sleep(wait)
+            await self.send_wait(build("JOIN", [",".join(names)]))
+
+    async def _rejoin_throttled(self):
+        channels, self._throttled = self._throttled, []
+        await self._join_channels(channels)
+
+    def _synced(self, channel: str):
+        if not self._unsynced or not channel in self._unsynced:
+            return
+        self._unsynced.discard(channel)
+        if not self._unsynced:
+            took = monotonic()-self._started
+            READY_SECONDS.set(self.name, value=took)
+            log.info("ready: every channel synced %.1fs after connecting", took,
+                extra={"network": self.name})
+
+    async def _on_join_error(self, line: Line):
+        channel = self.casefold(line.params[1])
+        if not self._unsynced or not channel in self._unsynced:
+            return
+        elif line.command == ERR_THROTTLE:
+            # try again once the server's had a rest
+            self._throttled_at = monotonic()
+            if not self._throttled:
+                self.dispatch.submit("joins", self._rejoin_throttled)
+            self._throttled.append(line.params[1])
+        else:
+            log.warning("couldn't join %s: %s", line.params[1], line.params[-1],
+                extra={"network": self.name, "channel": line.params[1]})
+            self._synced(channel)
+
     async def line_read(self, line: Line):
+        # work is handed to per-channel and per-caller lanes so one slow
+        # channel or command doesn't hold up everything read after it
         if (line.command == "PRIVMSG" and
                 not self.is_me(line.hostmask.nickname) and
                 self.is_me(line.params[0])):
 
             cmd, _, args = line.params[1].partition(" ")
-            await self.cmd(line.hostmask, cmd, args, line.tags)
-
-        elif (line.command == "JOIN" and
-                self.is_me(line.hostmask.nickname)):
-
-            if not (channel := await self.db.channels.get(self.casefold(line.params[0]))):
-                # we only care about channels in our database
-                return
-            await self._populate_modes(channel, "bq")
+            job = partial(self.cmd, line.hostmask, cmd, args, line.tags)
+            # commands are shed rather than allowed to back up the read loop
+            if not self.dispatch.submit(f"caller {self.casefold(line.hostmask.nickname)}", job):
+                err = "I'm too busy to handle that right now, please try again later"
+                self.send(build("NOTICE", [line.hostmask.nickname, err]))
+
+        elif line.command == "JOIN":
+            if self.is_me(line.hostmask.nickname):
+                # ircrobots has just asked for the channel's list modes.
+                # listen for the answers now, not once the sync gets a slot
+                a_modes = self.isupport.chanmodes.a_modes
+                self._expect_lists(line.params[0], "".join(m for m in "bq" if m in a_modes))
+                job = partial(self._resync, line.params[0])
+            else:
+                job = partial(self._on_join, line)
+            self._submit_channel(line.params[0], job)
 
         elif (line.command == "MODE" and
                 not self.is_me(line.params[0])):
 
-            if not (channel := await self.db.channels.get(self.casefold(line.params[0]))):
+            job = partial(self._on_mode, line)
+            self._submit_channel(line.params[0], job)
+
+        elif line.command in LIST_NUMERICS and len(line.params) > 1:
+            self._on_list(line)
+
+        elif (line.command in JOIN_ERRORS or line.command == ERR_THROTTLE) and len(line.params) > 2:
+            await self._on_join_error(line)
+
+    def _submit_channel(self, channel: str, job):
+        # a channel that floods us past what its lane holds has what's
+        # queued thrown away for a resync of its lists, which catches up
+        # on everything that was dropped
+        self.dispatch.submit(
+            f"channel {self.casefold(channel)}", job,
+            partial(self._resync, channel)
+        )
+
+    async def _resync(self, name: str):
+        folded = self.casefold(name)
+        try:
+            if not (channel := await self.db.channels.get(self.name, folded)):
                 # we only care about channels in our database
                 return
-            if not channel.name in self.channels.keys():
-                # idk when this would happen but just in case
+            elif not folded in self.channels:
+                # parted (or kicked) since
                 return
+            async with self._sync_slots:
+                await self._populate_modes(channel, "bq")
+            self.db.bans.synced(channel.id)
+        finally:
+            self._listing.pop(folded, None)
+            self._synced(folded)
+
+    async def _on_join(self, line: Line):
+        if not (channel := await self.db.channels.get(self.name, self.casefold(line.params[0]))):
+            return
+        if not await self.config.runtime.get("evasionCheck", channel=channel.name, network=self.name):
+            return
+
+        account = self._user_account(line.hostmask.nickname)
+        if (bans := await self.db.bans.match(channel.id, str(line.hostmask), account)):
+            ids = ", ".join(f"#{b.id} (+{b.mode} {b.mask})" for b in bans)
+            await self.report(
+                f"possible evasion: \x02{line.hostmask}\x02 joined"
+                f" {channel.name} matching {ids}",
+                channel.name
+            )
 
-            if (line.tags is not None and
-                "account" in line.tags and
-                not await self.db.chanops.is_chanop(channel.id, self.casefold(line.tags["account"]))):
-
-                # if this is a new chanop account, save it
-                await self.db.chanops.add(channel.id, self.casefold(line.tags["account"]))
-
-            args = line.params[2:]
-            added: List[Tuple[str, str]] = []
-            removed: List[Tuple[str, str]] = []
-            adding = False
-            for c in str(line.params[1]):
-                if c == "+":
-                    adding = True
-                elif c == "-":
-                    adding = False
-                elif c in {"b", "q", "e", "I"} and len(args) > 0:
-                    if adding:
-                        added.append((c, args.pop(0)))
-                    else:
-                        removed.append((c, args.pop(0)))
+    async def _on_mode(self, line: Line):
+        if not (channel := await self.db.channels.get(self.name, self.casefold(line.params[0]))):
+            # we only care about channels in our database
+            return
+        if not channel.name in self.channels.keys():
+            # idk when this would happen but just in case
+            return
+
+        if (line.tags is not None and
+            "account" in line.tags and
+            not await self.auth.is_chanop(channel.id, self.casefold(line.tags["account"]))):
+
+            # if this is a new chanop account, save it
+            await self.db.chanops.add(channel.id, self.casefold(line.tags["account"]))
+
+        # the last of each (mode, mask) wins, so "-b+b x x" leaves x banned
+        final: Dict[Tuple[str, str], Tuple[str, str, str]] = {}
+        for sign, mode, arg in parse_modes(self.isupport, line.params[1], line.params[2:]):
+            if mode in {"b", "q", "e", "I"} and arg is not None:
+                final[(mode, mask_key(arg))] = (sign, mode, arg)
+        added   = [(mode, arg) for sign, mode, arg in final.values() if sign == "+"]
+        removed = [(mode, arg) for sign, mode, arg in final.values() if sign == "-"]
+
+        expiry = None
+        if (added and
+                (default_duration := await self.config.runtime.get("autoExpire", channel=channel.name, network=self.name)) > 0):
+            expiry = int(time())+default_duration
+
+        # queue every write before awaiting any of them so they all
+        # land in the same commit
+        ids = await asyncio.gather(*[
+            self.db.bans.add(channel.id, line.source, mode, mask, expiry)
+            for mode, mask in added
+        ])
+        removed_ids = [
+            await self.db.bans.get_id(channel.id, mode, mask)
+            for mode, mask in removed
+        ]
+        await asyncio.gather(*[
+            self.db.bans.remove(id, line.source)
+            for id in removed_ids if id is not None
+        ])
 
-            for mode, mask in added:
-                id = await self.db.bans.add(channel.id, line.source, mode, mask)
-                await self._request_comment(id)
-                if (default_duration := await self.config.runtime.get("autoExpire", channel=channel.name)) > 0:
-                    await self.db.bans.set_expiry(id, int(time())+default_duration)
-            for mode, mask in removed:
-                if (id := await self.db.bans.get_id(channel.id, mask)) is not None:
-                    await self.db.bans.remove(id, line.source)
+        for id in ids:
+            await self._request_comment(id)
 
     async def cmd(self,
             hostmask: Hostmask,
@@ -255,20 +499,29 @@ class Server(BaseServer):
             if tags is not None and "account" in tags:
                 account = tags["account"]
             caller = Caller(str(hostmask), hostmask.nickname, account)
+            log.info(
+                "%s from %s", command.upper(), caller.source,
+                extra={"network": self.name, "command": command.upper()}
+            )
             func   = getattr(self, attrib)
             outs: List[str] = []
+            start = monotonic()
             try:
                 outs.extend(await func(caller, args))
             except UsageError as e:
                 outs.append(str(e))
                 for usage in func._usage:
                     outs.append(f"usage: {command.upper()} {usage}")
+            finally:
+                COMMAND_SECONDS.observe(command, value=monotonic()-start)
 
+            # queued, not awaited: under flood control that could hold up
+            # this caller's lane for seconds after the work is done
             for out in outs:
-               await self.send(build("NOTICE", [hostmask.nickname, out]))
+                self.send(build("NOTICE", [hostmask.nickname, out]))
         else:
             err = f"\x02{command.upper()}\x02 is not a valid command"
-            await self.send(build("NOTICE", [hostmask.nickname, err]))
+            self.send(build("NOTICE", [hostmask.nickname, err]))
 
     @usage("<expr>")
     async def cmd_eval(self, caller: Caller, sargs: str) -> List[str]:
@@ -280,15 +533,13 @@ class Server(BaseServer):
         if not args:
             raise UsageError("Not enough parameters")
 
-        privileged = is_admin(self.config.admins, caller.source)
-        print(privileged)
+        privileged = self.auth.is_admin(caller.source)
         channel = None
         if args[0].startswith("#") and len(args) > 1:
             channel = self.casefold(args[0])
-            if not (c := await self.db.channels.get(channel)):
+            if not (c := await self.db.channels.get(self.name, channel)):
                 return [f"{channel} is not a valid channel name"]
-            if ((caller.account is None or
-                    not await self.db.chanops.is_chanop(c.id, caller.account)) and
+            if (not await self.auth.is_chanop(c.id, self._account(caller)) and
                     not privileged):
 
                 return ["Permission denied"]
@@ -301,13 +552,16 @@ class Server(BaseServer):
 
         try:
             if value is not None:
-                await self.config.runtime.set(key, value, channel=channel, privileged=privileged)
+                await self.config.runtime.set(key, value, channel=channel, privileged=privileged, network=self.name)
                 return ["done!"]
             else:
-                ret = await self.config.runtime.get_pretty(key, channel=channel, privileged=privileged)
+                ret = await self.config.runtime.get_pretty(key, channel=channel, privileged=privileged, network=self.name)
                 return [f"{key} = {ret}"]
         except ConfigError as e:
-            traceback.print_exc()
+            log.info(
+                "CONFIG %s by %s failed: %s", key, caller.source, e,
+                extra={"network": self.name, "channel": channel, "command": "CONFIG"}
+            )
             return [f"Error: {e}"]
 
     @usage("<id>")
@@ -338,6 +592,140 @@ class Server(BaseServer):
         else:
             return [f"#{args[0]} does not exist or you do not have permission to see it"]
 
+    @usage("<hostmask|nick> [channel]")
+    async def cmd_check(self, caller: Caller, sargs: str) -> List[str]:
+        args = sargs.split(None, 2)
+        if not args:
+            raise UsageError("Please provide a hostmask or nick")
+
+        target  = args[0]
+        account = None
+        if not "!" in target:
+            if (user := self.users.get(self.casefold(target))) is None:
+                return [f"I can't see {target}, please give a full hostmask"]
+            target  = user.hostmask()
+            account = user.account or None
+
+        if len(args) > 1:
+            if not (channel := await self.db.channels.get(self.name, self.casefold(args[1]))):
+                return [f"{args[1]} is not a valid channel name"]
+            bans = await self.db.bans.match(channel.id, target, account)
+        else:
+            bans = [
+                b for b in await self.db.bans.match_all(target, account)
+                if self.db.channels.network_of(b.channelid) == self.name
+            ]
+
+        bans = [b for b in bans if await self._is_authorized(b, caller)]
+        if not bans:
+            return [f"{target} does not match any active bans you can see"]
+
+        ret = [f"\x02{target}\x02 matches:"]
+        for ban in bans:
+            ret.append(await self._action_format(ban))
+        return ret
+
+    @usage("<channel> [active|removed] [setter=<nick|mask>] [after=<id>]")
+    async def cmd_list(self, caller: Caller, sargs: str) -> List[str]:
+        args = sargs.split()
+        if not args:
+            raise UsageError("Please provide a channel")
+        if not (channel := await self.db.channels.get(self.name, self.casefold(args[0]))):
+            return [f"{args[0]} is not a valid channel name"]
+        if (not self.auth.is_admin(caller.source) and
+                not await self.auth.is_chanop(channel.id, self._account(caller))):
+            return ["Permission denied"]
+
+        active: Optional[bool] = None
+        setter: Optional[str]  = None
+        after:  Optional[int]  = None
+        for arg in args[1:]:
+            key, _, value = arg.partition("=")
+            if   arg in {"active", "removed"}:
+                active = arg == "active"
+            elif key == "setter" and value:
+                if not "!" in value:
+                    value = f"{value}!*"
+                # LIKE's own wildcards (and its escape) are taken literally
+                for char in "\\%_":
+                    value = value.replace(char, f"\\{char}")
+                setter = value.replace("*", "%").replace("?", "_")
+            elif key == "after" and value.isdigit():
+                after = int(value)
+            else:
+                raise UsageError(f"I don't understand {arg!r}")
+
+        # one more than we show, to know whether there's another page
+        bans = await self.db.bans.get_by_channel(
+            channel.id, active, setter, LIST_PAGE+1, after
+        )
+        if not bans:
+            return ["no more bans" if after is not None else "no bans"]
+
+        page  = bans[:LIST_PAGE]
+        lines = [await self._action_format(ban) for ban in page]
+        if len(bans) > LIST_PAGE:
+            more = " ".join(
+                a for a in args if not a.startswith("after=")
+            )
+            lines.append(f"more: \x02LIST {more} after={page[-1].id}\x02")
+        else:
+            lines.append("end of list")
+
+        # a page goes out behind anything more pressing; queued in order
+        # rather than awaited one by one
+        for line in lines:
+            self.send(build("NOTICE", [caller.nick, line]), SendPriority.LOW)
+        return []
+
+    @usage("<query> [channel] [from=<n>]")
+    async def cmd_search(self, caller: Caller, sargs: str) -> List[str]:
+        args  = sargs.split()
+        start = 0
+        if args and args[-1].startswith("from="):
+            if not args[-1][5:].isdigit():
+                raise UsageError("That's not a number")
+            start = int(args.pop()[5:])
+
+        if args and args[-1][:1] in self.isupport.chantypes:
+            name = args.pop()
+            if not (channel := await self.db.channels.get(self.name, self.casefold(name))):
+                return [f"{name} is not a valid channel name"]
+            channels = [channel.id]
+        else:
+            channels = [c.id for c in await self.db.channels.list(self.name)]
+            channels += [c.id for c in await self.db.channels.list(self.name, False)]
+
+        if (query := fts_query(" ".join(args))) is None:
+            raise UsageError("Please provide something to search for")
+
+        # permissions are checked per ban, the same way as everywhere else,
+        # so pull ranked results in batches until there's a page we can show
+        page:   List[DBBan] = []
+        offset = start
+        while len(page) < LIST_PAGE:
+            batch = await self.db.bans.search(query, channels, LIST_PAGE*2, offset)
+            for ban in batch:
+                offset += 1
+                if await self._is_authorized(ban, caller):
+                    page.append(ban)
+                    if len(page) == LIST_PAGE:
+                        break
+            if len(batch) < LIST_PAGE*2:
+                break
+
+        if not page:
+            return ["no more results" if start else "no results"]
+
+        lines = [await self._action_format(ban) for ban in page]
+        if len(page) == LIST_PAGE:
+            lines.append(f"more: \x02SEARCH {sargs.rsplit(' from=', 1)[0]} from={offset}\x02")
+        else:
+            lines.append("end of results")
+        for line in lines:
+            self.send(build("NOTICE", [caller.nick, line]), SendPriority.LOW)
+        return []
+
     @usage("<id>|^ [+time] [reason]")
     async def cmd_comment(self, caller: Caller, sargs: str) -> List[str]:
         args = sargs.split(None, 3)
@@ -389,19 +777,19 @@ class Server(BaseServer):
                             return [f"#{id} would already have expired. Please set a longer duration."]
                         duration += ban.ts
                     await self.db.bans.set_expiry(id, duration)
-                    log = f"set ban expiry to \x02{datetime.utcfromtimestamp(duration).isoformat()}\x02"
-                    await self.db.comments.add(id, caller.source, caller.account, log)
+                    note = f"set ban expiry to \x02{datetime.utcfromtimestamp(duration).isoformat()}\x02"
+                    await self.db.comments.add(id, caller.source, caller.account, note)
                 if reason is not None:
                     await self.db.bans.set_reason(id, reason)
-                    log = f"set reason to \x1d{reason}\x1d"
-                    await self.db.comments.add(id, caller.source, caller.account, log)
+                    note = f"set reason to \x1d{reason}\x1d"
+                    await self.db.comments.add(id, caller.source, caller.account, note)
                 return [f"#{id} has been commented"]
             else:
                 return [f"#{id} does not exist or you do not have permission to modify it"]
 
     async def cmd_join(self, caller: Caller, sargs: str):
         args = sargs.split(None, 3)
-        if not is_admin(self.config.admins, caller.source):
+        if not self.auth.is_admin(caller.source):
             return ["Permission denied"]
         elif not args:
             raise UsageError("Please provide a channel to join")
@@ -410,7 +798,10 @@ class Server(BaseServer):
             return [f"I'm already in {args[0]}"]
 
         if await try_join(self, args[0]):
-            await self.db.channels.add(self.casefold(args[0]))
+            if (db_channel := await self.db.channels.get(self.name, self.casefold(args[0]))) is not None:
+                await self.db.channels.set_autojoin(db_channel.id, True)
+            else:
+                await self.db.channels.add(self.name, self.casefold(args[0]))
             await self.report(f"{caller.source} JOIN: \x02{args[0]}\x02")
             return [f"Successfully joined {args[0]}"]
         else:
@@ -418,7 +809,7 @@ class Server(BaseServer):
 
     async def cmd_part(self, caller: Caller, sargs: str):
         args = sargs.split(None, 3)
-        if not is_admin(self.config.admins, caller.source):
+        if not self.auth.is_admin(caller.source):
             return ["Permission denied"]
         elif not args:
             raise UsageError("Please provide a channel to part")
@@ -426,17 +817,186 @@ class Server(BaseServer):
         if not self.casefold(args[0]) in self.channels.keys():
             return [f"I'm not in {args[0]}"]
 
-        if (db_channel := await self.db.channels.get(self.casefold(args[0]))) is not None:
+        if (db_channel := await self.db.channels.get(self.name, self.casefold(args[0]))) is not None:
             await self.db.channels.set_autojoin(db_channel.id, False)
 
-        await self.send(build("PART", [args[0]]))
+        self.send(build("PART", [args[0]]))
         await self.report(f"{caller.source} PART: \x02{args[0]}\x02")
         return [f"done!"]
 
+    @usage("[count]")
+    async def cmd_lanes(self, caller: Caller, sargs: str) -> List[str]:
+        args = sargs.split(None, 1)
+        if not self.auth.is_admin(caller.source):
+            return ["Permission denied"]
+
+        count = 10
+        if args:
+            if not args[0].isdigit():
+                raise UsageError("That's not a number")
+            count = int(args[0])
+
+        lanes = sorted(
+            self.dispatch.lanes(),
+            key=lambda l: (l.depth(), l.wait_max),
+            reverse=True
+        )
+        if not lanes:
+            return ["no active lanes"]
+
+        ret: List[str] = []
+        for lane in lanes[:count]:
+            processed = max(lane.processed, 1)
+            ret.append(
+                f"\x02{lane.key}\x02: {lane.depth()} queued,"
+                f" {lane.processed} done, {lane.dropped} dropped,"
+                f" wait avg {lane.wait_total/processed*1000:.1f}ms"
+                f" max {lane.wait_max*1000:.1f}ms,"
+                f" run avg {lane.run_total/processed*1000:.1f}ms"
+                f" max {lane.run_max*1000:.1f}ms"
+            )
+        return ret
+
+    async def cmd_sendq(self, caller: Caller, sargs: str) -> List[str]:
+        if not self.auth.is_admin(caller.source):
+            return ["Permission denied"]
+
+        bucket = self.outbound.bucket
+        ret    = [f"throttle: {bucket.rate} lines/s, burst {bucket.burst}"]
+        for priority in sorted(self.outbound.stats):
+            stats = self.outbound.stats[priority]
+            sent  = max(stats.sent, 1)
+            ret.append(
+                f"\x02{SendPriority(priority).name}\x02:"
+                f" {self.outbound.depth(priority)} queued, {stats.sent} sent,"
+                f" wait avg {stats.wait_total/sent*1000:.1f}ms"
+                f" max {stats.wait_max*1000:.1f}ms"
+            )
+        return ret
+
+    @usage("[count] [total|calls|rows|p99|max]")
+    @usage("reset")
+    async def cmd_queries(self, caller: Caller, sargs: str) -> List[str]:
+        args = sargs.split(None, 1)
+        if not self.auth.is_admin(caller.source):
+            return ["Permission denied"]
+
+        profiler = self.db.profiler
+        if args and args[0].lower() == "reset":
+            profiler.reset()
+            return ["done!"]
+
+        count = 5
+        if args and args[0].isdigit():
+            count = int(args.pop(0))
+        sort = args[0].lower() if args else "total"
+        if not sort in {"total", "calls", "rows", "p99", "max"}:
+            raise UsageError(f"Can't sort by {sort}")
+
+        return profiler.report(count, sort) or ["no queries yet"]
+
+    @usage("[channel]")
+    @usage("rebuild")
+    async def cmd_stats(self, caller: Caller, sargs: str) -> List[str]:
+        args = sargs.split(None, 1)
+        if args and args[0].lower() == "rebuild":
+            if not self.auth.is_admin(caller.source):
+                return ["Permission denied"]
+            await self.db.stats.rebuild()
+            return ["done!"]
+
+        if args:
+            if not (channel := await self.db.channels.get(self.name, self.casefold(args[0]))):
+                return [f"{args[0]} is not a valid channel name"]
+            if (not self.auth.is_admin(caller.source) and
+                    not await self.auth.is_chanop(channel.id, self._account(caller))):
+                return ["Permission denied"]
+            name, ids = channel.name, [channel.id]
+        elif not self.auth.is_admin(caller.source):
+            return ["Permission denied"]
+        else:
+            channels = (
+                await self.db.channels.list(self.name, True) +
+                await self.db.channels.list(self.name, False)
+            )
+            name, ids = self.name, [c.id for c in channels]
+
+        stats = await self.db.stats.get(ids)
+        if not stats.total:
+            return [f"{name}: no bans"]
+
+        active = sum(count for _, count in stats.active)
+        modes  = ", ".join(f"{count} +{mode}" for mode, count in stats.active)
+        out    = [f"{name}: {stats.total} bans, {active} active ({modes or 'none'})"]
+        if stats.removed:
+            average = to_pretty_time(stats.removed_seconds//stats.removed) or "0s"
+            out.append(f"{stats.removed} removed, after {average} on average")
+        out.append(
+            f"{stats.reasons*100//stats.total}% have reasons,"
+            f" {stats.expiries*100//stats.total}% have expiries"
+        )
+        setters = ", ".join(
+            f"{setter.split('!', 1)[0]} ({count})" for setter, count in stats.setters
+        )
+        out.append(f"top setters: {setters}")
+        return out
+
+    async def cmd_snapshot(self, caller: Caller, sargs: str) -> List[str]:
+        if not self.auth.is_admin(caller.source):
+            return ["Permission denied"]
+        elif self.bot.snapshots is None:
+            return ["Snapshots aren't configured"]
+
+        start = monotonic()
+        path  = await self.bot.snapshots.take()
+        size  = os.path.getsize(path) + os.path.getsize(f"{path}.archive")
+        return [f"Took {path} ({size/2**20:.1f}MB) in {monotonic()-start:.2f}s"]
+
+    @usage("[count] [search]")
+    async def cmd_rawlog(self, caller: Caller, sargs: str) -> List[str]:
+        args = sargs.split(None, 1)
+        if not self.auth.is_admin(caller.source):
+            return ["Permission denied"]
+
+        count = 10
+        if args and args[0].isdigit():
+            count = int(args.pop(0))
+        search = args[0] if args else None
+
+        lines = self.raw.last(count, search)
+        if not lines:
+            return ["nothing to show"]
+        return [
+            f"{datetime.utcfromtimestamp(ts).strftime('%H:%M:%S')} {direction} {raw}"
+            for ts, direction, raw in lines
+        ]
+
+    def _raw(self, direction: str, line: Line):
+        if line.command in REDACT:
+            raw = f"{line.command} <redacted>"
+        else:
+            raw = line.format()
+        self.raw.append(direction, raw)
+        if direction == "<":
+            LINES_READ.inc(self.name, line.command)
+        else:
+            LINES_SENT.inc(self.name, line.command)
+
+        if raw_log.isEnabledFor(logging.DEBUG):
+            channel = None
+            if line.params and line.params[0][:1] in self.isupport.chantypes:
+                channel = line.params[0]
+            raw_log.debug(raw, extra={
+                "network":   self.name,
+                "direction": direction,
+                "command":   line.command,
+                "channel":   channel
+            })
+
     def line_preread(self, line: Line):
-        print(f"< {line.format()}")
+        self._raw("<", line)
     def line_presend(self, line: Line):
-        print(f"> {line.format()}")
+        self._raw(">", line)
 
 class Bot(BaseBot):
     def __init__(self,
@@ -445,6 +1005,8 @@ class Bot(BaseBot):
         super().__init__()
         self.config   = config
         self._database = database
+        # set up in __main__, if snapshots are configured
+        self.snapshots: Optional[Snapshotter] = None
 
     def create_server(self, name: str):
         return Server(self, name, self.config, self._database)
@@ -1,38 +1,95 @@
-import asyncio
+import asyncio, logging, signal
 from argparse import ArgumentParser
+from time     import monotonic
 
 from ircrobots import ConnectionParams, SASLUserPass
+from ircrobots.interface import SendPriority
 
 from .         import Bot
+from .logs     import setup as logs_setup
+from .metrics  import REGISTRY, OUTBOUND_DEPTH, serve as metrics_serve
 from .config   import Config, load as config_load
 from .database import Database
-from .timers   import check_expiry
+from .timers   import Archiver, ExpiryScheduler, Snapshotter
 
 async def main(config: Config):
+    listener = logs_setup(config.logging)
     db  = config.database
     bot = Bot(config, db)
-
-    host, port, tls      = config.server
-
-    params = ConnectionParams(
-        config.nickname,
-        host,
-        port,
-        tls,
-        username=config.username,
-        realname=config.realname,
-        password=config.password,
-        autojoin=[c.name for c in await db.channels.list()]
-    )
-    if config.sasl is not None:
-        sasl_user, sasl_pass = config.sasl
-        params.sasl = SASLUserPass(sasl_user, sasl_pass)
-    await bot.add_server(host, params)
-    await asyncio.gather(
-        bot.run(),
-        check_expiry(bot, db)
+    await db.migrate()
+    start = monotonic()
+    await db.preload()
+    logging.getLogger("bans").info(
+        "preloaded the database in %.1fms", (monotonic()-start)*1000
     )
 
+    # one scheduler for every network; it unbans through whichever
+    # connection a ban's channel belongs to
+    expiry = ExpiryScheduler(bot, db)
+    db.bans.watchers.append(expiry)
+    archiver = Archiver(db, config.runtime)
+    if config.snapshots is not None:
+        bot.snapshots = Snapshotter(db, *config.snapshots)
+
+    for network in config.networks.values():
+        host, port, tls = network.server
+
+        params = ConnectionParams(
+            network.nickname,
+            host,
+            port,
+            tls,
+            username=network.username,
+            realname=network.realname,
+            password=network.password,
+            autojoin=[c.name for c in await db.channels.list(network.name)]
+        )
+        if network.sasl is not None:
+            sasl_user, sasl_pass = network.sasl
+            params.sasl = SASLUserPass(sasl_user, sasl_pass)
+        await bot.add_server(network.name, params)
+
+    if config.metrics is not None:
+        def _outbound_depth():
+            for name, server in bot.servers.items():
+                for priority in server.outbound.stats:
+                    OUTBOUND_DEPTH.set(
+                        name, SendPriority(priority).name,
+                        value=server.outbound.depth(priority)
+                    )
+        REGISTRY.collectors.append(_outbound_depth)
+        await metrics_serve(*config.metrics)
+
+    def _dump_queries():
+        log = logging.getLogger("bans.database.profile")
+        for line in db.profiler.report(20):
+            log.info(line)
+    # `kill -USR1` dumps the query report without needing to be on IRC
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, _dump_queries)
+
+    async def _snapshot():
+        log = logging.getLogger("bans.timers")
+        try:
+            log.info("took snapshot %s", await bot.snapshots.take())
+        except Exception:
+            log.exception("taking a snapshot failed")
+    if bot.snapshots is not None:
+        # and `kill -USR2` takes a snapshot
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGUSR2, lambda: asyncio.ensure_future(_snapshot())
+        )
+
+    try:
+        await asyncio.gather(
+            bot.run(),
+            expiry.run(),
+            archiver.run(),
+            *([bot.snapshots.run()] if bot.snapshots is not None else [])
+        )
+    finally:
+        await db.close()
+        listener.stop()
+
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("config")
@@ -0,0 +1,50 @@
+import re
+
+from collections    import OrderedDict
+from typing         import List, Optional, Pattern
+
+from .database         import Database
+from .database.matcher import glob_regex
+
+# how many source -> admin verdicts to remember
+ADMIN_CACHE = 1024
+
+class Authorization(object):
+    def __init__(self,
+            admins: List[str],
+            db:     Database,
+            cache_size: int = ADMIN_CACHE):
+
+        self._db = db
+        # every admin glob folded into one alternation, so a check is a
+        # single regex match rather than a loop over globs
+        self._admins: Optional[Pattern] = None
+        if admins:
+            self._admins = re.compile(
+                "|".join(f"(?:{glob_regex(a)})" for a in admins),
+                re.DOTALL
+            )
+
+        self._cache_size = cache_size
+        self._verdicts: "OrderedDict[str, bool]" = OrderedDict()
+
+    def is_admin(self, source: str) -> bool:
+        if (verdict := self._verdicts.get(source)) is not None:
+            self._verdicts.move_to_end(source)
+            return verdict
+
+        verdict = (self._admins is not None and
+            self._admins.fullmatch(source) is not None)
+
+        self._verdicts[source] = verdict
+        if len(self._verdicts) > self._cache_size:
+            self._verdicts.popitem(last=False)
+        return verdict
+
+    async def is_chanop(self,
+            channel: int,
+            account: Optional[str]) -> bool:
+
+        if account is None:
+            return False
+        return await self._db.chanops.is_chanop(channel, account)
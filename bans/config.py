@@ -3,32 +3,49 @@ import yaml
 from dataclasses    import dataclass
 from os.path        import expanduser
 from re             import compile as re_compile
-from typing         import Dict, List, Optional, Pattern, Tuple
+from typing         import Any, Dict, List, Optional, Pattern, Tuple
 from ircrobots.glob import Glob, compile as glob_compile
 
 from .runtime    import RuntimePreferences
-from .database   import Database
+from .database   import Database, SLOW_QUERY
+from .auth       import Authorization
+from .outbound   import THROTTLE_RATE, THROTTLE_BURST
+from .logs       import LogConfig, RAW_BUFFER
+from .timers     import SNAPSHOT_KEEP
+
+# network name used for a config with a single top-level server
+DEFAULT_NETWORK = "default"
 
 @dataclass
-class Config(object):
+class NetworkConfig(object):
+    name:     str
     server:   Tuple[str, int, bool]
     nickname: str
     username: str
     realname: str
     password: Optional[str]
-    admins: List[Glob]
-    database: str
-    runtime: RuntimePreferences
+    # (lines per second, burst)
+    throttle: Tuple[float, int]
 
     sasl: Optional[Tuple[str, str]]
 
-def load(filepath: str):
-    with open(filepath) as file:
-        config_yaml = yaml.safe_load(file.read())
+@dataclass
+class Config(object):
+    networks: Dict[str, NetworkConfig]
+    admins: List[Glob]
+    database: str
+    runtime: RuntimePreferences
+    auth: Authorization
+    logging: LogConfig
+    # (host, port) to serve metrics on, if at all
+    metrics: Optional[Tuple[str, int]]
+    # (directory, seconds between scheduled snapshots or 0, how many to keep)
+    snapshots: Optional[Tuple[str, float, int]] = None
 
-    nickname = config_yaml["nickname"]
+def _load_network(name: str, network_yaml: Dict[str, Any]) -> NetworkConfig:
+    nickname = network_yaml["nickname"]
 
-    server   = config_yaml["server"]
+    server   = network_yaml["server"]
     hostname, port_s = server.split(":", 1)
     tls      = False
 
@@ -37,20 +54,82 @@ def load(filepath: str):
         port_s = port_s.lstrip("+")
     port = int(port_s)
 
-    if "sasl" in config_yaml:
-        sasl = (config_yaml["sasl"]["username"], config_yaml["sasl"]["password"])
+    throttle = network_yaml.get("throttle", {})
+
+    if "sasl" in network_yaml:
+        sasl = (network_yaml["sasl"]["username"], network_yaml["sasl"]["password"])
     else:
         sasl = None
-    db = Database(expanduser(config_yaml["database"]))
 
-    return Config(
+    return NetworkConfig(
+        name,
         (hostname, port, tls),
         nickname,
-        config_yaml.get("username", nickname),
-        config_yaml.get("realname", nickname),
-        config_yaml.get("password", None),
+        network_yaml.get("username", nickname),
+        network_yaml.get("realname", nickname),
+        network_yaml.get("password", None),
+        (
+            float(throttle.get("rate", THROTTLE_RATE)),
+            int(throttle.get("burst", THROTTLE_BURST))
+        ),
+        sasl
+    )
+
+def load(filepath: str):
+    with open(filepath) as file:
+        config_yaml = yaml.safe_load(file.read())
+
+    networks: Dict[str, NetworkConfig] = {}
+    if "networks" in config_yaml:
+        for name, network_yaml in config_yaml["networks"].items():
+            networks[name] = _load_network(name, network_yaml)
+    else:
+        # a single network configured at the top level
+        name = config_yaml.get("network", DEFAULT_NETWORK)
+        networks[name] = _load_network(name, config_yaml)
+
+    log_yaml = config_yaml.get("logging", {})
+    logging  = LogConfig(
+        log_yaml.get("level", "INFO"),
+        log_yaml.get("format", "json"),
+        bool(log_yaml.get("raw", False)),
+        int(log_yaml.get("raw_buffer", RAW_BUFFER)),
+        set(log_yaml.get("channels", [])),
+        set(log_yaml.get("commands", []))
+    )
+
+    metrics = None
+    if "metrics" in config_yaml:
+        metrics_yaml = config_yaml["metrics"]
+        metrics = (
+            metrics_yaml.get("host", "127.0.0.1"),
+            int(metrics_yaml["port"])
+        )
+
+    snapshots = None
+    if "snapshots" in config_yaml:
+        # an empty section turns them on with the defaults
+        snapshot_yaml = config_yaml["snapshots"] or {}
+        snapshots = (
+            expanduser(snapshot_yaml.get("directory", f"{config_yaml['database']}.snapshots")),
+            float(snapshot_yaml.get("interval", 0)),
+            int(snapshot_yaml.get("keep", SNAPSHOT_KEEP))
+        )
+
+    db = Database(
+        expanduser(config_yaml["database"]),
+        config_yaml.get("database_pool", 4),
+        float(config_yaml.get("database_slow_ms", SLOW_QUERY)),
+        expanduser(config_yaml.get("database_archive", "")) or None
+    )
+
+    return Config(
+        networks,
         [glob_compile(m) for m in config_yaml["admins"]],
         db,
         RuntimePreferences(db),
-        sasl
+        Authorization(config_yaml["admins"], db),
+        logging,
+        metrics,
+        snapshots
     )
@@ -1,18 +1,78 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, Iterable, Optional
+
 from .db_bans import *
 from .db_chanops import *
 from .db_comments import *
 from .db_channels import *
 from .db_config   import *
+from .db_stats    import *
+from .common      import DBPool
+from .profile     import QueryProfiler, SLOW_QUERY
+from .migrations  import migrate
+from .transfer    import export, Importer
+from .snapshot    import snapshot
+from .write_queue import WriteQueue
 
 class ConfigTables(object):
-    def __init__(self, location: str):
-        self.bot     = BotConfigTable(location)
-        self.channel = ChannelConfigTable(location)
+    def __init__(self, pool: DBPool):
+        self.bot     = BotConfigTable(pool)
+        self.channel = ChannelConfigTable(pool)
 
 class Database(object):
-    def __init__(self, location: str):
-        self.channels = ChannelsTable(location)
-        self.bans     = BansTable(location)
-        self.chanops  = ChanOpsTable(location)
-        self.comments = CommentsTable(location)
-        self.config   = ConfigTables(location)
+    def __init__(self,
+            location:  str,
+            pool_size: int   = 4,
+            slow:      float = SLOW_QUERY,
+            archive:   Optional[str] = None,
+            readonly:  bool  = False):
+
+        self.profiler = QueryProfiler(slow)
+        self._pool    = DBPool(
+            location, pool_size, self.profiler,
+            archive or f"{location}.archive", readonly
+        )
+        self._writes  = WriteQueue(self._pool)
+        self.channels = ChannelsTable(self._pool)
+        self.bans     = BansTable(self._pool, self._writes)
+        self.chanops  = ChanOpsTable(self._pool)
+        self.comments = CommentsTable(self._pool)
+        self.stats    = StatsTable(self._pool)
+        self.config   = ConfigTables(self._pool)
+
+    async def migrate(self) -> int:
+        return await migrate(self._pool)
+
+    def export(self) -> AsyncIterator[Dict[str, Any]]:
+        return export(self._pool)
+
+    async def import_(self, records: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        return await Importer(self._pool).run(records)
+
+    async def snapshot(self, path: str):
+        await snapshot(self._pool, path)
+
+    async def vacuum(self, pages: int) -> int:
+        # hand back up to `pages` free pages to the filesystem, returning
+        # how many are still free. small steps so writers aren't held up
+        async with self._pool.connection() as db:
+            cursor = await db.execute(f"PRAGMA incremental_vacuum({int(pages)})")
+            # each page is freed as a row is stepped through
+            await cursor.fetchall()
+            cursor = await db.execute("PRAGMA freelist_count")
+            return (await cursor.fetchone())[0]
+
+    async def preload(self):
+        # bulk-load everything that's served from memory, a query each, on
+        # as many connections as the pool has
+        await asyncio.gather(
+            self.channels.load(),
+            self.chanops.load(),
+            self.bans.load(),
+            self.config.bot.load(),
+            self.config.channel.load()
+        )
+
+    async def close(self):
+        await self._writes.close()
+        await self._pool.close()
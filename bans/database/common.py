@@ -1,3 +1,129 @@
+import asyncio
+from contextlib import asynccontextmanager
+from functools  import wraps
+from time       import monotonic
+from typing     import Any, AsyncIterator, Callable, List, Optional
+from urllib.parse import quote
+
+from aiosqlite  import connect as db_connect, Connection
+
+from ..metrics  import DB_SECONDS
+from .profile   import ProfiledConnection, QueryProfiler
+
+# how many prepared statements each connection keeps around
+STATEMENT_CACHE = 256
+
+# applied to every connection as it's opened
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456"
+]
+
+class DBPool(object):
+    def __init__(self,
+            location: str,
+            size:     int = 4,
+            profiler: Optional[QueryProfiler] = None,
+            archive:  Optional[str] = None,
+            readonly: bool = False):
+
+        self._location = location
+        # old removed bans are moved out to here, see BansTable.archive()
+        self._archive  = archive
+        # for reading snapshots, see snapshot.py
+        self._readonly = readonly
+        self._size     = max(1, size)
+        self.profiler  = profiler or QueryProfiler()
+
+        # created on first use, so it belongs to the running event loop
+        self._idle: Optional["asyncio.Queue[Connection]"] = None
+        self._all:  List[Connection] = []
+        self._opened = 0
+        self._closed = False
+
+    async def _open(self) -> Connection:
+        # reserve the slot before awaiting so concurrent callers can't
+        # open more connections than the pool allows
+        self._opened += 1
+        try:
+            db = await db_connect(
+                self._uri(self._location),
+                cached_statements=STATEMENT_CACHE,
+                uri=True,
+                # with the archive attached, a deferred transaction that
+                # has to upgrade to a write fails straight away rather
+                # than waiting if another connection is writing
+                isolation_level="IMMEDIATE"
+            )
+        except BaseException:
+            self._opened -= 1
+            raise
+        for pragma in PRAGMAS:
+            if not (self._readonly and "journal_mode" in pragma):
+                await db.execute(pragma)
+        if self._archive is not None:
+            await db.execute("ATTACH DATABASE ? AS archive", [self._uri(self._archive)])
+            if not self._readonly:
+                await db.execute("PRAGMA archive.journal_mode=WAL")
+        self._all.append(db)
+        return db
+
+    def _uri(self, path: str) -> str:
+        mode = self._readonly and "ro" or "rwc"
+        return f"file:{quote(path)}?mode={mode}"
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[Connection]:
+        if self._closed:
+            raise RuntimeError("database pool is closed")
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+
+        # connections are opened lazily, up to the pool size
+        if self._idle.empty() and self._opened < self._size:
+            db = await self._open()
+        else:
+            db = await self._idle.get()
+
+        try:
+            yield ProfiledConnection(self.profiler, db)
+        except BaseException:
+            # don't hand a half-finished transaction to the next caller
+            if db.in_transaction:
+                await db.rollback()
+            raise
+        finally:
+            if self._closed:
+                await db.close()
+            else:
+                self._idle.put_nowait(db)
+
+    async def close(self):
+        self._closed = True
+        while self._idle is not None and not self._idle.empty():
+            db = self._idle.get_nowait()
+            await db.close()
+        self._all.clear()
+        self._opened = 0
+
+def _timed(table: str, name: str, func: Callable[..., Any]) -> Callable[..., Any]:
+    @wraps(func)
+    async def _inner(*args, **kwargs):
+        start = monotonic()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            DB_SECONDS.observe(table, name, value=monotonic()-start)
+    return _inner
+
 class DBTable(object):
-    def __init__(self, db_location: str):
-        self._db_location = db_location
+    def __init__(self, pool: DBPool):
+        self._pool = pool
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # time every public coroutine method, per table
+        for name, func in list(vars(cls).items()):
+            if not name.startswith("_") and asyncio.iscoroutinefunction(func):
+                setattr(cls, name, _timed(cls.__name__, name, func))
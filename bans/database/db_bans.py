@@ -1,11 +1,34 @@
-from aiosqlite  import connect as db_connect
+import asyncio, string
+from sys         import intern
 from time        import time
-from typing      import List, Optional
+from typing      import Any, Dict, List, Optional, Tuple
 from dataclasses import dataclass
-from .common     import DBTable
+from .common     import DBTable, DBPool
+from .write_queue import WriteQueue
+from .matcher     import MaskSet
+
+# modes that stop a matching user from joining or speaking
+MATCH_MODES = {"b", "q"}
+# past this many matches in either table, search results are newest first
+# rather than ranked
+SEARCH_RANK_MAX = 50000
+
+# sqlite's lower() only folds ascii, and the unique index on active masks
+# is on lower(mask), so that's what two masks being the same ban means
+_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+def mask_key(mask: Optional[str]) -> str:
+    mask   = mask or ""
+    folded = mask.translate(_LOWER)
+    # most masks are lowercase already; keep the one copy rather than two
+    return mask if folded == mask else folded
 
 @dataclass
 class DBBan(object):
+    # every active ban is held in memory, so no per-object __dict__
+    __slots__ = (
+        "id", "channelid", "setter", "mode", "ts", "mask", "expiry",
+        "removed", "remover", "reason"
+    )
     id: int
     channelid: int
     setter: str
@@ -17,141 +40,376 @@ class DBBan(object):
     remover: Optional[str]
     reason: Optional[str]
 
+def _ban(row: Tuple) -> DBBan:
+    # a handful of chanops set most bans, so rows share one copy of each
+    # setter rather than the fresh string sqlite hands back every time
+    id, channel, setter, mode, ts, mask, expiry, removed, remover, reason = row
+    return DBBan(
+        id, channel, intern(setter), intern(mode), ts, mask, expiry,
+        removed, remover and intern(remover), reason
+    )
+
 class BansTable(DBTable):
+    def __init__(self,
+            pool:   DBPool,
+            writes: WriteQueue):
+
+        super().__init__(pool)
+        # mutations go through the write-behind queue so they share commits
+        self._writes = writes
+        # told about expiry changes, see timers.ExpiryScheduler
+        self.watchers: List[Any] = []
+
+        # every active ban, channel id -> (mode, mask_key(mask)) -> ban
+        self._active: Optional[Dict[int, Dict[Tuple[str, str], DBBan]]] = None
+        self._active_ids: Dict[int, DBBan] = {}
+        # channel id -> active b/q masks, for matching users against
+        self._masks: Dict[int, MaskSet] = {}
+        # adds that have been queued but not committed yet
+        self._adding: Dict[Tuple[int, str, str], "asyncio.Future[int]"] = {}
+
+    def _key(self, mode: str, mask: Optional[str]) -> Tuple[str, str]:
+        return (mode, mask_key(mask))
+
+    def _index(self, ban: DBBan):
+        key = self._key(ban.mode, ban.mask)
+        self._active.setdefault(ban.channelid, {})[key] = ban
+        self._active_ids[ban.id] = ban
+        if ban.mode in MATCH_MODES and ban.mask is not None:
+            self._masks.setdefault(ban.channelid, MaskSet()).add(ban.id, ban.mask)
+
+    def _unindex(self, id: int):
+        if (ban := self._active_ids.pop(id, None)) is not None:
+            channel = self._active.get(ban.channelid, {})
+            key     = self._key(ban.mode, ban.mask)
+            if channel.get(key) is ban:
+                del channel[key]
+            if (masks := self._masks.get(ban.channelid)) is not None:
+                masks.remove(id)
+
+    async def _load_active(self, channel: Optional[int] = None):
+        if channel is None:
+            bans = await self._get("WHERE remove_ts IS NULL", None)
+            self._active = {}
+            self._active_ids.clear()
+            self._masks.clear()
+        else:
+            bans = await self._get("WHERE channel_id = ? AND remove_ts IS NULL", None, channel)
+            for ban in self._active.pop(channel, {}).values():
+                self._active_ids.pop(ban.id, None)
+            self._masks.pop(channel, None)
+
+        for ban in sorted(bans, key=lambda b: b.id):
+            self._index(ban)
+
+    async def load(self):
+        await self._load_active()
+
+    async def _loaded(self):
+        if self._active is None:
+            await self.load()
+
     async def add(self,
             channel: int,
             setter: str,
             mode:   str,
             mask:   Optional[str] = None,
             expiry: Optional[int] = None,
-            reason: Optional[str] = None):
+            reason: Optional[str] = None) -> int:
 
-        async with db_connect(self._db_location) as db:
-            await db.execute("""
-                INSERT INTO bans
-                (channel_id, setter, mode, mask, ts, expiry_ts, reason)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, [channel, setter, mode, mask, int(time()), expiry, reason])
-            await db.commit()
+        await self._loaded()
+        key = self._key(mode, mask)
+        # there's a unique index on active (channel, mode, mask), so a mask
+        # that's already active resolves to the existing row
+        if (ban := self._active.get(channel, {}).get(key)) is not None:
+            return ban.id
+        elif (channel, *key) in self._adding:
+            return await self._adding[(channel, *key)]
 
-            cursor = await db.execute("""
-                SELECT id
-                FROM bans
-                ORDER BY id DESC
-                LIMIT 1
-            """)
-            return (await cursor.fetchone())[0]
+        ts = int(time())
+        future = self._writes.add(channel, setter, mode, mask, expiry, reason, ts)
+        self._adding[(channel, *key)] = future
+        try:
+            id = await future
+        finally:
+            del self._adding[(channel, *key)]
+
+        self._index(_ban((id, channel, setter, mode, ts, mask, expiry, None, None, reason)))
+        if expiry is not None:
+            for watcher in self.watchers:
+                watcher.schedule(id, expiry)
+        return id
 
     async def _get(self,
             where: str,
             limit: Optional[int],
-            *args: str) -> List[DBBan]:
+            *args: str,
+            table: str = "bans") -> List[DBBan]:
 
-        async with db_connect(self._db_location) as db:
+        async with self._pool.connection() as db:
             limit_str = ""
             if limit is not None:
-                limit_str = f"LIMIT {limit}"
+                # bound rather than formatted in, so every limit shares
+                # one prepared statement
+                limit_str = "LIMIT ?"
+                args     += (limit,)
 
             query = f"""
                 SELECT id, channel_id, setter, mode, ts, mask, expiry_ts, remove_ts, remover, reason
-                FROM bans
+                FROM {table}
                 {where}
                 {limit_str}
             """
 
             cursor = await db.execute(query, args)
             rows = await cursor.fetchall()
-            return [DBBan(*row) for row in rows]
+            return [_ban(row) for row in rows]
 
     async def get_by_id(self,
             id: int) -> List[DBBan]:
 
-        try:
-            return (await self._get("WHERE id = ?", 1, id))[0]
-        except IndexError:
-            return None
+        # archived bans are still there to be looked up, just slower
+        for table in ["bans", "archive.bans"]:
+            if (bans := await self._get("WHERE id = ?", 1, id, table=table)):
+                return bans[0]
+        return None
 
     async def get_by_channel(self,
             channel: int,
             by_active: Optional[bool] = None,
             by_setter: Optional[str] = None,
-            limit: Optional[int] = 10) -> List[DBBan]:
+            limit: Optional[int] = 10,
+            after: Optional[int] = None) -> List[DBBan]:
+
+        # always in id order, so `after` (the last id of the previous page)
+        # picks up exactly where that page stopped
+        if by_active == True and by_setter is None:
+            await self._loaded()
+            bans = sorted(
+                (b for b in self._active.get(channel, {}).values()
+                    if after is None or b.id > after),
+                key=lambda b: b.id
+            )
+            return bans[:limit]
 
-        args: List[str] = []
+        args: List[Any] = []
         where = "WHERE channel_id = ?"
         args.append(channel)
+        if after is not None:
+            where += " AND id > ?"
+            args.append(after)
         if by_active is not None:
             where += by_active == True and " AND remove_ts IS NULL" or " AND remove_ts IS NOT NULL"
         if by_setter is not None:
-            where += f" AND setter LIKE ?"
+            where += " AND setter LIKE ? ESCAPE '\\'"
             args.append(by_setter)
-        return await self._get(where, limit, *args)
+        return await self._get(f"{where} ORDER BY id ASC", limit, *args)
+
+    async def search(self,
+            query:    str,
+            channels: Optional[List[int]] = None,
+            limit:    int = 10,
+            offset:   int = 0) -> List[DBBan]:
+
+        chan_filter = "1"
+        chan_args: List[Any] = []
+        if channels is not None:
+            chan_filter = f"b.channel_id IN ({', '.join('?'*len(channels))})"
+            chan_args   = list(channels)
+
+        async with self._pool.connection() as db:
+            # bm25 has to score every match, which gets slow for words that
+            # are in half the database; those are shown newest first instead
+            ranked = True
+            for table in ["bans_fts", "comments_fts"]:
+                cursor = await db.execute(f"""
+                    SELECT COUNT(*) FROM {table} WHERE {table} MATCH ?
+                """, [query])
+                if (await cursor.fetchone())[0] > SEARCH_RANK_MAX:
+                    ranked = False
+
+            if ranked:
+                # a ban scores as the better of its own match (mask, reason)
+                # and its best matching comment
+                cursor = await db.execute(f"""
+                    SELECT b.id, b.channel_id, b.setter, b.mode, b.ts, b.mask,
+                        b.expiry_ts, b.remove_ts, b.remover, b.reason
+                    FROM (
+                        SELECT rowid AS ban_id, bm25(bans_fts) AS score
+                        FROM bans_fts
+                        WHERE bans_fts MATCH ?
+                        UNION ALL
+                        SELECT c.ban_id, bm25(comments_fts)
+                        FROM comments_fts
+                        JOIN comments c ON c.rowid = comments_fts.rowid
+                        WHERE comments_fts MATCH ?
+                    ) AS hits
+                    JOIN bans b ON b.id = hits.ban_id
+                    WHERE {chan_filter}
+                    GROUP BY b.id
+                    ORDER BY MIN(hits.score) ASC, b.id DESC
+                    LIMIT ? OFFSET ?
+                """, [query, query, *chan_args, limit, offset])
+            else:
+                # walks the (channel's) bans newest first, stopping once the
+                # page is full. with this many matches that's soon, and the
+                # channel filter is applied before the page is cut
+                cursor = await db.execute(f"""
+                    SELECT b.id, b.channel_id, b.setter, b.mode, b.ts, b.mask,
+                        b.expiry_ts, b.remove_ts, b.remover, b.reason
+                    FROM bans b
+                    WHERE {chan_filter} AND (
+                        EXISTS (
+                            SELECT 1 FROM bans_fts
+                            WHERE bans_fts MATCH ? AND bans_fts.rowid = b.id
+                        ) OR EXISTS (
+                            SELECT 1 FROM comments c
+                            JOIN comments_fts ON comments_fts.rowid = c.rowid
+                            WHERE c.ban_id = b.id AND comments_fts MATCH ?
+                        )
+                    )
+                    ORDER BY b.id DESC
+                    LIMIT ? OFFSET ?
+                """, [*chan_args, query, query, limit, offset])
+            return [_ban(row) for row in await cursor.fetchall()]
 
     async def get_expired(self) -> List[DBBan]:
 
-        return await self._get("WHERE expiry_ts < ? AND remove_ts IS NULL", None, int(time()))
+        return await self._get("WHERE expiry_ts <= ? AND remove_ts IS NULL", None, int(time()))
+
+    async def get_expiring(self) -> List[DBBan]:
+
+        return await self._get("WHERE expiry_ts IS NOT NULL AND remove_ts IS NULL", None)
 
     async def get_last_by_setter(self, setter: str, count: int) -> List[DBBan]:
         return await self._get("WHERE setter = ? AND remove_ts IS NULL", count, setter)
 
     async def get_id(self,
-            channel: str,
-            mask: str) -> Optional[DBBan]:
+            channel: int,
+            mode: str,
+            mask: Optional[str]) -> Optional[int]:
 
-        async with db_connect(self._db_location) as db:
-            cursor = await db.execute("""
-                SELECT id
-                FROM bans
-                WHERE remove_ts IS NULL
-                ORDER BY id DESC
-                LIMIT 1""")
-
-            res = await cursor.fetchone()
-            if len(res) > 0:
-                return res[0]
-            else:
-                return None
+        await self._loaded()
+        if (ban := self._active.get(channel, {}).get(self._key(mode, mask))) is not None:
+            return ban.id
+        return None
+
+    async def match(self,
+            channel:  int,
+            hostmask: str,
+            account:  Optional[str] = None) -> List[DBBan]:
+
+        await self._loaded()
+        if (masks := self._masks.get(channel)) is None:
+            return []
+        return [self._active_ids[id] for id in masks.match(hostmask, account)]
+
+    async def match_all(self,
+            hostmask: str,
+            account:  Optional[str] = None) -> List[DBBan]:
+
+        await self._loaded()
+        matches: List[DBBan] = []
+        for masks in self._masks.values():
+            matches.extend(self._active_ids[id] for id in masks.match(hostmask, account))
+        return matches
+
+    async def sync(self,
+            channel: int,
+            remove:  List[int],
+            add:     List[Tuple[str, str, str, int]]):
+
+        # a whole ban list reconciliation in one transaction.
+        # add is (setter, mode, mask, ts)
+        async with self._pool.connection() as db:
+            await db.executemany("""
+                UPDATE bans
+                SET remove_ts = ?, remover = NULL
+                WHERE id = ?""", [[int(time()), id] for id in remove])
+            await db.executemany("""
+                INSERT INTO bans
+                (channel_id, setter, mode, mask, ts)
+                VALUES (?, ?, ?, ?, ?)
+            """, [[channel, setter, mode, mask, ts] for setter, mode, mask, ts in add])
+            await db.commit()
+
+        # executemany() doesn't give us the new ids, so re-read the
+        # channel's active bans (one indexed query) into the index
+        if self._active is not None:
+            await self._load_active(channel)
+
+        for id in remove:
+            for watcher in self.watchers:
+                watcher.cancel(id)
+
+    def synced(self, channel: int):
+        # a channel's ban list has just been reconciled with the server's
+        for watcher in self.watchers:
+            watcher.synced(channel)
 
     async def set_reason(self,
             id: int,
             reason: str):
 
-        async with db_connect(self._db_location) as db:
-            await db.execute("""
-                UPDATE bans
-                SET reason = ?
-                WHERE id = ?""", [reason, id])
-            await db.commit()
+        await self._writes.set_reason(id, reason)
+        if (ban := self._active_ids.get(id)) is not None:
+            ban.reason = reason
 
     async def set_expiry(self,
             id: int,
             expiry: Optional[int]):
 
-        async with db_connect(self._db_location) as db:
-            await db.execute("""
-                UPDATE bans
-                SET expiry_ts = ?
-                WHERE id = ?""", [expiry, id])
-            await db.commit()
+        await self._writes.set_expiry(id, expiry)
+        if (ban := self._active_ids.get(id)) is not None:
+            ban.expiry = expiry
+        for watcher in self.watchers:
+            watcher.schedule(id, expiry)
 
-    async def set_reason(self,
-            id: int,
-            reason: str):
+    async def archive(self,
+            before: int,
+            batch:  int) -> int:
 
-        async with db_connect(self._db_location) as db:
-            await db.execute("""
-                UPDATE bans
-                SET reason = ?
-                WHERE id = ?""", [reason, id])
+        # move up to `batch` bans removed before `before`, and their
+        # comments, out to the archive database. returns how many moved
+        async with self._pool.connection() as db:
+            cursor = await db.execute("""
+                SELECT id FROM bans
+                WHERE remove_ts IS NOT NULL AND remove_ts < ?
+                -- new ids are the highest one plus one, so the highest
+                -- stays here or its id could be handed out again
+                AND id < (SELECT MAX(id) FROM bans)
+                ORDER BY remove_ts ASC
+                LIMIT ?
+            """, [before, batch])
+            ids = [row[0] for row in await cursor.fetchall()]
+            if not ids:
+                return 0
+
+            # commits across attached WAL databases aren't atomic together,
+            # so this is written to be safe to redo if we die halfway
+            marks = ", ".join("?"*len(ids))
+            await db.execute(f"""
+                INSERT OR REPLACE INTO archive.bans
+                SELECT id, channel_id, setter, mode, ts, mask, expiry_ts, remove_ts, remover, reason
+                FROM bans WHERE id IN ({marks})
+            """, ids)
+            await db.execute(f"DELETE FROM archive.comments WHERE ban_id IN ({marks})", ids)
+            await db.execute(f"""
+                INSERT INTO archive.comments
+                SELECT ban_id, by_mask, by_account, time, comment
+                FROM comments WHERE ban_id IN ({marks})
+            """, ids)
+            await db.execute(f"DELETE FROM comments WHERE ban_id IN ({marks})", ids)
+            await db.execute(f"DELETE FROM bans WHERE id IN ({marks})", ids)
             await db.commit()
+        return len(ids)
 
     async def remove(self,
             id: int,
             remover: Optional[str] = None):
 
-        async with db_connect(self._db_location) as db:
-            await db.execute("""
-                UPDATE bans
-                SET remove_ts = ?, remover = ?
-                WHERE id = ?""", [int(time()), remover, id])
-            await db.commit()
+        await self._writes.remove(id, remover)
+        if self._active is not None:
+            self._unindex(id)
+        for watcher in self.watchers:
+            watcher.cancel(id)
@@ -1,83 +1,103 @@
-from aiosqlite  import connect as db_connect
 from dataclasses import dataclass
-from typing      import List, Optional
-from .common     import DBTable
+from sys         import intern
+from typing      import Dict, List, Optional, Tuple
+from .common     import DBTable, DBPool
 
 @dataclass
 class DBChannel(object):
+    __slots__ = ("id", "name", "autojoin", "network")
     id: int
     name: str
     autojoin: bool
+    network: str
 
 class ChannelsTable(DBTable):
+    def __init__(self, pool: DBPool):
+        super().__init__(pool)
+        # every channel row is kept in memory once loaded; writes go to the
+        # database and the cache together, so reads never need the database
+        self._by_id:   Optional[Dict[int, DBChannel]] = None
+        self._by_name: Optional[Dict[Tuple[str, str], DBChannel]] = None
+
+    async def load(self):
+        async with self._pool.connection() as db:
+            cursor = await db.execute("""
+                SELECT id, name, autojoin, network
+                FROM channels
+                ORDER BY id ASC""")
+            rows = await cursor.fetchall()
+
+        by_id:   Dict[int, DBChannel] = {}
+        by_name: Dict[Tuple[str, str], DBChannel] = {}
+        for id, name, autojoin, network in rows:
+            # every channel on a network shares its name
+            channel = DBChannel(id, name, autojoin, intern(network))
+            by_id[channel.id] = channel
+            by_name[(channel.network, channel.name)] = channel
+        self._by_id   = by_id
+        self._by_name = by_name
+
+    async def _loaded(self):
+        if self._by_id is None:
+            await self.load()
+
     async def add(self,
-            name: str) -> int:
+            network: str,
+            name:    str) -> int:
 
-        async with db_connect(self._db_location) as db:
-            await db.execute("""
+        await self._loaded()
+        async with self._pool.connection() as db:
+            cursor = await db.execute("""
                 INSERT INTO channels
-                (name, autojoin)
-                VALUES (?, 1)
-            """, [name])
+                (name, autojoin, network)
+                VALUES (?, 1, ?)
+            """, [name, network])
             await db.commit()
 
-            cursor = await db.execute("""
-                SELECT id
-                FROM channels
-                ORDER BY id DESC
-                LIMIT 1
-            """)
-            return (await cursor.fetchone())[0]
+        channel = DBChannel(cursor.lastrowid, name, True, network)
+        self._by_id[channel.id] = channel
+        self._by_name[(network, channel.name)] = channel
+        return channel.id
 
     async def get(self,
-            name: str) -> Optional[DBChannel]:
+            network: str,
+            name:    str) -> Optional[DBChannel]:
 
-        async with db_connect(self._db_location) as db:
-            cursor = await db.execute("""
-                SELECT id, name, autojoin
-                FROM channels
-                WHERE name = ?
-                LIMIT 1""", [name])
-
-            res = await cursor.fetchone()
-            if res:
-                return DBChannel(*res)
-            else:
-                return None
+        await self._loaded()
+        return self._by_name.get((network, name))
 
     async def from_id(self, id: int) -> Optional[DBChannel]:
-        async with db_connect(self._db_location) as db:
-            cursor = await db.execute("""
-                SELECT id, name, autojoin
-                FROM channels
-                WHERE id = ?
-                LIMIT 1""", [id])
+        await self._loaded()
+        return self._by_id.get(id)
 
-            res = await cursor.fetchone()
-            if len(res) > 0:
-                return DBChannel(*res)
-            else:
-                return None
+    def network_of(self, id: int) -> Optional[str]:
+        # only answers once the cache is loaded
+        if self._by_id is not None and (channel := self._by_id.get(id)) is not None:
+            return channel.network
+        return None
 
-    async def list(self, join: bool = True) -> Optional[List[DBChannel]]:
+    async def list(self,
+            network: str,
+            join:    bool = True) -> Optional[List[DBChannel]]:
 
-        async with db_connect(self._db_location) as db:
-            cursor = await db.execute("""
-                SELECT id, name, autojoin
-                FROM channels
-                WHERE autojoin = ?""", [int(join)])
-
-            res = await cursor.fetchall()
-            return [DBChannel(*row) for row in res]
+        await self._loaded()
+        return [
+            c for c in self._by_id.values()
+            if c.network == network and bool(c.autojoin) == join
+        ]
 
     async def set_autojoin(self,
             id: int,
             join: bool):
 
-        async with db_connect(self._db_location) as db:
+        await self._loaded()
+        async with self._pool.connection() as db:
             await db.execute("""
                 UPDATE channels
                 SET autojoin = ?
                 WHERE id = ?
             """, [join, id])
             await db.commit()
+
+        if (channel := self._by_id.get(id)) is not None:
+            channel.autojoin = join
@@ -1,34 +1,47 @@
-from aiosqlite  import connect as db_connect
 from time        import time
-from typing      import List, Optional, Tuple
-from .common     import DBTable
+from typing      import Dict, List, Optional, Set, Tuple
+from .common     import DBTable, DBPool
 
 class ChanOpsTable(DBTable):
+    def __init__(self, pool: DBPool):
+        super().__init__(pool)
+        # channel id -> chanop accounts, kept in step with add() and remove()
+        self._cache: Optional[Dict[int, Set[str]]] = None
+
+    async def load(self):
+        async with self._pool.connection() as db:
+            cursor = await db.execute("""
+                SELECT channel_id, account
+                FROM chanops
+            """)
+            rows = await cursor.fetchall()
+
+        cache: Dict[int, Set[str]] = {}
+        for channel, account in rows:
+            cache.setdefault(channel, set()).add(account)
+        self._cache = cache
+
     async def add(self,
             channel: int,
             account: str):
 
-        async with db_connect(self._db_location) as db:
-            await db.execute("""
+        async with self._pool.connection() as db:
+            cursor = await db.execute("""
                 INSERT INTO chanops
                 (channel_id, account)
                 VALUES (?, ?)
             """, [channel, account])
             await db.commit()
 
-            cursor = await db.execute("""
-                SELECT id
-                FROM chanops
-                ORDER BY id DESC
-                LIMIT 1
-            """)
-            return (await cursor.fetchone())[0]
+        if self._cache is not None:
+            self._cache.setdefault(channel, set()).add(account)
+        return cursor.lastrowid
 
     async def remove(self,
             channel: int,
             account: str):
 
-        async with db_connect(self._db_location) as db:
+        async with self._pool.connection() as db:
             await db.execute("""
                 DELETE FROM chanops
                 WHERE channel_id = ?
@@ -36,13 +49,10 @@ class ChanOpsTable(DBTable):
             """, [channel, account])
             await db.commit()
 
+        if self._cache is not None:
+            self._cache.get(channel, set()).discard(account)
+
     async def is_chanop(self, channel: int, account: str) -> bool:
-        query = """
-            SELECT id
-            FROM chanops
-            WHERE channel_id = ?
-            AND account = ?
-        """
-        async with db_connect(self._db_location) as db:
-            cursor = await db.execute(query, [channel, account])
-            return bool(await cursor.fetchall())
+        if self._cache is None:
+            await self.load()
+        return account in self._cache.get(channel, ())
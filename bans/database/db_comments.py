@@ -1,4 +1,4 @@
-from aiosqlite  import connect as db_connect
+from sys         import intern
 from time        import time
 from dataclasses import dataclass
 from typing      import List, Optional
@@ -6,6 +6,7 @@ from .common     import DBTable
 
 @dataclass
 class DBComment(object):
+    __slots__ = ("by_mask", "by_account", "ts", "comment")
     by_mask: str
     by_account: Optional[str]
     ts: int
@@ -18,7 +19,7 @@ class CommentsTable(DBTable):
             by_account: Optional[str],
             comment: str):
 
-        async with db_connect(self._db_location) as db:
+        async with self._pool.connection() as db:
             await db.execute("""
                 INSERT INTO comments
                 (ban_id, by_mask, by_account, time, comment)
@@ -27,11 +28,20 @@ class CommentsTable(DBTable):
             await db.commit()
 
     async def get(self, id: int) -> List[DBComment]:
-        async with db_connect(self._db_location) as db:
+        async with self._pool.connection() as db:
+            # a ban's comments are archived along with it
             cursor = await db.execute("""
                 SELECT by_mask, by_account, time, comment
                 FROM comments
                 WHERE ban_id = ?
+                UNION ALL
+                SELECT by_mask, by_account, time, comment
+                FROM archive.comments
+                WHERE ban_id = ?
                 ORDER BY time ASC
-            """, [id])
-            return [DBComment(*row) for row in await cursor.fetchall()]
+            """, [id, id])
+            # the same few people comment on most bans
+            return [
+                DBComment(intern(by_mask), by_account and intern(by_account), ts, comment)
+                for by_mask, by_account, ts, comment in await cursor.fetchall()
+            ]
@@ -1,8 +1,7 @@
 import json
-from aiosqlite  import connect as db_connect
 from dataclasses import dataclass
-from typing      import List, Optional, Any
-from .common     import DBTable
+from typing      import Dict, List, Optional, Any, Tuple
+from .common     import DBTable, DBPool
 
 @dataclass
 class ConfigItem(object):
@@ -13,84 +12,115 @@ class ChannelConfigItem(ConfigItem):
     channel: int
 
 class BotConfigTable(DBTable):
-    async def get(self,
-            key: str):
+    def __init__(self, pool: DBPool):
+        super().__init__(pool)
+        # decoded values, kept in step with every set() and delete()
+        self._cache: Optional[Dict[str, Any]] = None
 
-        async with db_connect(self._db_location) as db:
+    async def load(self):
+        async with self._pool.connection() as db:
             cursor = await db.execute("""
-                SELECT value
+                SELECT key, value
                 FROM bot_config
-                WHERE key = ?
-            """, [key])
+            """)
+            rows = await cursor.fetchall()
+        self._cache = {key: json.loads(value) for key, value in rows}
 
-            res = await cursor.fetchone()
-            if res:
-                return json.loads(res[0])
+    async def get(self,
+            key: str):
+
+        if self._cache is None:
+            await self.load()
+        return self._cache.get(key)
 
     async def set(self,
             key: str,
             value: Any):
 
-        async with db_connect(self._db_location) as db:
+        encoded = json.dumps(value)
+        async with self._pool.connection() as db:
             await db.execute("""
                 INSERT OR REPLACE
                 INTO bot_config
                 (key, value)
                 VALUES
                 (?, ?)
-            """, [key, json.dumps(value)])
+            """, [key, encoded])
             await db.commit()
 
+        if self._cache is not None:
+            # cache what a fresh load would give back
+            self._cache[key] = json.loads(encoded)
+
     async def delete(self,
             key: str):
 
-        async with db_connect(self._db_location) as db:
+        async with self._pool.connection() as db:
             await db.execute("""
                 DELETE FROM bot_config
                 WHERE key = ?
             """, [key])
             await db.commit()
 
+        if self._cache is not None:
+            self._cache.pop(key, None)
+
 class ChannelConfigTable(DBTable):
-    async def get(self,
-            channel_id: int,
-            key: str):
+    def __init__(self, pool: DBPool):
+        super().__init__(pool)
+        # (channel_id, key) -> decoded value
+        self._cache: Optional[Dict[Tuple[int, str], Any]] = None
 
-        async with db_connect(self._db_location) as db:
+    async def load(self):
+        async with self._pool.connection() as db:
             cursor = await db.execute("""
-                SELECT value
+                SELECT channel_id, key, value
                 FROM channel_config
-                WHERE channel_id = ?
-                AND key = ?
-            """, [channel_id, key])
+            """)
+            rows = await cursor.fetchall()
+        self._cache = {
+            (channel_id, key): json.loads(value)
+            for channel_id, key, value in rows
+        }
+
+    async def get(self,
+            channel_id: int,
+            key: str):
 
-            res = await cursor.fetchone()
-            if res:
-                return json.loads(res[0])
+        if self._cache is None:
+            await self.load()
+        return self._cache.get((channel_id, key))
 
     async def set(self,
             channel_id: int,
             key: str,
             value: Any):
 
-        async with db_connect(self._db_location) as db:
+        encoded = json.dumps(value)
+        async with self._pool.connection() as db:
             await db.execute("""
                 INSERT OR REPLACE
                 INTO channel_config
                 (channel_id, key, value)
                 VALUES
                 (?, ?, ?)
-            """, [channel_id, key, json.dumps(value)])
+            """, [channel_id, key, encoded])
             await db.commit()
 
+        if self._cache is not None:
+            self._cache[(channel_id, key)] = json.loads(encoded)
+
     async def delete(self,
             channel_id: int,
             key: str):
 
-        async with db_connect(self._db_location) as db:
+        async with self._pool.connection() as db:
             await db.execute("""
                 DELETE FROM channel_config
                 WHERE channel_id = ?
                 AND key = ?
             """, [channel_id, key])
             await db.commit()
+
+        if self._cache is not None:
+            self._cache.pop((channel_id, key), None)
@@ -0,0 +1,73 @@
+from dataclasses import dataclass, field
+from typing      import List, Tuple
+from .common     import DBTable
+from .migrations import STATS_REBUILD
+
+# how many of the busiest setters to show
+TOP_SETTERS = 5
+
+@dataclass
+class DBStats(object):
+    total: int = 0
+    removed: int = 0
+    removed_seconds: int = 0
+    reasons: int = 0
+    expiries: int = 0
+    # mode -> how many are active
+    active: List[Tuple[str, int]] = field(default_factory=list)
+    # (setter, bans), most first
+    setters: List[Tuple[str, int]] = field(default_factory=list)
+
+# every number here is kept up to date by triggers as bans are written (see
+# migration 9), so reading them is a few primary key lookups however many
+# bans there are
+class StatsTable(DBTable):
+    async def get(self, channels: List[int]) -> DBStats:
+        marks = ", ".join("?"*len(channels))
+        async with self._pool.connection() as db:
+            cursor = await db.execute(f"""
+                SELECT SUM(total), SUM(removed), SUM(removed_seconds),
+                    SUM(reasons), SUM(expiries)
+                FROM channel_stats
+                WHERE channel_id IN ({marks})
+            """, channels)
+            row = await cursor.fetchone()
+            if row[0] is None:
+                return DBStats()
+            stats = DBStats(*row)
+
+            cursor = await db.execute(f"""
+                SELECT mode, SUM(active)
+                FROM mode_stats
+                WHERE channel_id IN ({marks})
+                GROUP BY mode
+                HAVING SUM(active) > 0
+                ORDER BY mode ASC
+            """, channels)
+            stats.active = list(await cursor.fetchall())
+
+            if len(channels) == 1:
+                # straight off the (channel_id, bans) index
+                cursor = await db.execute("""
+                    SELECT setter, bans
+                    FROM setter_stats
+                    WHERE channel_id = ?
+                    ORDER BY bans DESC
+                    LIMIT ?
+                """, [*channels, TOP_SETTERS])
+            else:
+                cursor = await db.execute(f"""
+                    SELECT setter, SUM(bans)
+                    FROM setter_stats
+                    WHERE channel_id IN ({marks})
+                    GROUP BY setter
+                    ORDER BY SUM(bans) DESC
+                    LIMIT ?
+                """, [*channels, TOP_SETTERS])
+            stats.setters = list(await cursor.fetchall())
+        return stats
+
+    async def rebuild(self):
+        # for if the running totals are ever suspected of drifting
+        async with self._pool.connection() as db:
+            await db.executescript(f"BEGIN; {STATS_REBUILD} COMMIT;")
@@ -0,0 +1,177 @@
+import re
+
+from typing            import Dict, Iterable, List, Optional, Pattern, Set, Tuple
+from ircrobots.glob    import collapse
+from ircstates.casemap import casefold, CaseMap
+
+# how many characters of a literal prefix/suffix to bucket by
+BUCKET_LEN = 6
+
+def fold(s: str) -> str:
+    folded = casefold(CaseMap.RFC1459, s)
+    # most masks are lowercase already; keep the one copy rather than two
+    return s if folded == s else folded
+
+def glob_regex(pattern: str) -> str:
+    out = ""
+    for c in collapse(pattern):
+        if   c == "*":
+            out += ".*"
+        elif c == "?":
+            out += "."
+        else:
+            out += re.escape(c)
+    return out
+
+def _glob_compile(pattern: str) -> Pattern:
+    return re.compile(glob_regex(pattern), re.DOTALL)
+
+def _is_literal(pattern: str) -> bool:
+    return not ("*" in pattern or "?" in pattern)
+
+def _literal_suffix(pattern: str) -> str:
+    for i in range(len(pattern)-1, -1, -1):
+        if pattern[i] in "*?":
+            return pattern[i+1:]
+    return pattern
+
+def _literal_prefix(pattern: str) -> str:
+    for i, c in enumerate(pattern):
+        if c in "*?":
+            return pattern[:i]
+    return pattern
+
+def _anchor(mask: str) -> Tuple[str, str]:
+    # pick the most selective literal part of nick!user@host to bucket by
+    nick, _, userhost = mask.partition("!")
+    _, at, host       = userhost.rpartition("@")
+    if not at:
+        return ("generic", "")
+
+    if _is_literal(host):
+        return ("host", host)
+    elif _is_literal(nick):
+        return ("nick", nick)
+
+    suffix = _literal_suffix(host)
+    prefix = _literal_prefix(host)
+    npre   = _literal_prefix(nick)
+    best   = max(len(suffix), len(prefix), len(npre))
+    if   best == 0:
+        return ("generic", "")
+    elif best == len(suffix):
+        return ("host_suffix", suffix[-BUCKET_LEN:])
+    elif best == len(prefix):
+        return ("host_prefix", prefix[:BUCKET_LEN])
+    else:
+        return ("nick_prefix", npre[:BUCKET_LEN])
+
+# the active b/q masks of one channel, bucketed by a literal part of the
+# mask so a lookup only runs full matches against masks that could match.
+# $a/$a:account/$~a extbans are matched against the account
+class MaskSet(object):
+    def __init__(self):
+        # anchor -> {id: folded mask}
+        self._buckets: Dict[Tuple[str, str], Dict[int, str]] = {}
+        # masks are compiled the first time a lookup needs them, so loading
+        # tens of thousands of bans stays cheap
+        self._compiled: Dict[int, Pattern] = {}
+        self._accounts: Dict[str, Set[int]] = {}
+        self._account_globs: Dict[int, Pattern] = {}
+        # $a (any account) and $~a (no account)
+        self._any_account: Set[int] = set()
+        self._no_account:  Set[int] = set()
+
+        self._where: Dict[int, Tuple[str, str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def add(self, id: int, mask: str):
+        mask = fold(mask)
+
+        if mask.startswith("$"):
+            if   mask == "$a":
+                self._any_account.add(id)
+                self._where[id] = ("any", "")
+            elif mask == "$~a":
+                self._no_account.add(id)
+                self._where[id] = ("none", "")
+            elif mask.startswith("$a:"):
+                account = mask[3:]
+                if _is_literal(account):
+                    self._accounts.setdefault(account, set()).add(id)
+                    self._where[id] = ("account", account)
+                else:
+                    self._account_globs[id] = _glob_compile(account)
+                    self._where[id] = ("account_glob", "")
+            # other extbans can't be matched from a hostmask alone
+            return
+
+        anchor = _anchor(mask)
+        self._buckets.setdefault(anchor, {})[id] = mask
+        self._where[id] = anchor
+
+    def remove(self, id: int):
+        if (where := self._where.pop(id, None)) is None:
+            return
+        kind, key = where
+
+        if   kind == "any":
+            self._any_account.discard(id)
+        elif kind == "none":
+            self._no_account.discard(id)
+        elif kind == "account":
+            self._accounts[key].discard(id)
+            if not self._accounts[key]:
+                del self._accounts[key]
+        elif kind == "account_glob":
+            del self._account_globs[id]
+        else:
+            del self._buckets[where][id]
+            if not self._buckets[where]:
+                del self._buckets[where]
+            self._compiled.pop(id, None)
+
+    def _candidates(self,
+            nick: str,
+            host: str) -> Iterable[Dict[int, str]]:
+
+        keys = [("host", host), ("nick", nick), ("generic", "")]
+        for i in range(1, BUCKET_LEN+1):
+            if i <= len(host):
+                keys.append(("host_suffix", host[-i:]))
+                keys.append(("host_prefix", host[:i]))
+            if i <= len(nick):
+                keys.append(("nick_prefix", nick[:i]))
+
+        for key in keys:
+            if (bucket := self._buckets.get(key)) is not None:
+                yield bucket
+
+    def match(self,
+            hostmask: str,
+            account:  Optional[str] = None) -> List[int]:
+
+        hostmask = fold(hostmask)
+        nick     = hostmask.partition("!")[0]
+        host     = hostmask.rpartition("@")[2]
+
+        matches: Set[int] = set()
+        for bucket in self._candidates(nick, host):
+            for id, mask in bucket.items():
+                if (pattern := self._compiled.get(id)) is None:
+                    pattern = self._compiled[id] = _glob_compile(mask)
+                if pattern.fullmatch(hostmask):
+                    matches.add(id)
+
+        if account is None:
+            matches |= self._no_account
+        else:
+            account = fold(account)
+            matches |= self._any_account
+            matches |= self._accounts.get(account, set())
+            for id, pattern in self._account_globs.items():
+                if pattern.fullmatch(account):
+                    matches.add(id)
+        return sorted(matches)
@@ -0,0 +1,355 @@
+from typing  import List, Tuple
+from .common import DBPool
+
+# fills the *_stats tables from scratch, from every ban there is. bans that
+# were cut short being archived can be in both databases, and count once
+STATS_REBUILD = """
+    DELETE FROM channel_stats;
+    DELETE FROM mode_stats;
+    DELETE FROM setter_stats;
+
+    WITH every AS (
+        SELECT channel_id, setter, ts, remove_ts, reason, expiry_ts FROM bans
+        UNION ALL
+        SELECT channel_id, setter, ts, remove_ts, reason, expiry_ts FROM archive.bans
+        WHERE id NOT IN (SELECT id FROM bans)
+    )
+    INSERT INTO channel_stats
+    (channel_id, total, removed, removed_seconds, reasons, expiries)
+    SELECT channel_id, COUNT(*), COUNT(remove_ts),
+        SUM(COALESCE(remove_ts - ts, 0)), COUNT(reason), COUNT(expiry_ts)
+    FROM every
+    GROUP BY channel_id;
+
+    -- archived bans are all removed, so only the live ones can be active
+    INSERT INTO mode_stats (channel_id, mode, active)
+    SELECT channel_id, mode, SUM(remove_ts IS NULL)
+    FROM bans
+    GROUP BY channel_id, mode;
+
+    WITH every AS (
+        SELECT channel_id, setter FROM bans
+        UNION ALL
+        SELECT channel_id, setter FROM archive.bans
+        WHERE id NOT IN (SELECT id FROM bans)
+    )
+    INSERT INTO setter_stats (channel_id, setter, bans)
+    SELECT channel_id, setter, COUNT(*)
+    FROM every
+    GROUP BY channel_id, setter;
+"""
+
+# (version, sql) pairs, applied in order. never edit a migration that has
+# shipped, add a new one instead
+MIGRATIONS: List[Tuple[int, str]] = [
+    (1, """
+        CREATE TABLE IF NOT EXISTS channels (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            autojoin BOOLEAN NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS bans (
+            id INTEGER PRIMARY KEY,
+            channel_id INTEGER NOT NULL,
+            setter TEXT NOT NULL,
+            mode VARCHAR(1),
+            ts INTEGER NOT NULL,
+            mask TEXT,
+            expiry_ts INTEGER,
+            remove_ts INTEGER,
+            remover   TEXT,
+            reason    TEXT,
+            FOREIGN KEY (channel_id)
+                REFERENCES channels(id)
+                ON DELETE CASCADE
+        );
+        CREATE TABLE IF NOT EXISTS chanops (
+            id INTEGER PRIMARY KEY,
+            channel_id INTEGER NOT NULL,
+            account TEXT NOT NULL,
+            FOREIGN KEY (channel_id)
+                REFERENCES channels(id)
+                ON DELETE CASCADE
+        );
+        CREATE TABLE IF NOT EXISTS comments (
+            ban_id INTEGER NOT NULL,
+            by_mask TEXT NOT NULL,
+            by_account TEXT,
+            time INTEGER NOT NULL,
+            comment TEXT NOT NULL,
+            FOREIGN KEY (ban_id)
+                REFERENCES bans(id)
+                ON DELETE CASCADE
+        );
+        CREATE TABLE IF NOT EXISTS bot_config (
+            key TEXT,
+            value TEXT,
+            PRIMARY KEY (key)
+        );
+        CREATE TABLE IF NOT EXISTS channel_config (
+            channel_id INTEGER NOT NULL,
+            key TEXT,
+            value TEXT,
+            PRIMARY KEY (channel_id, key),
+            FOREIGN KEY (channel_id)
+                REFERENCES channels(id)
+                ON DELETE CASCADE
+        );
+    """),
+    (2, """
+        -- ChannelsTable.get
+        CREATE INDEX IF NOT EXISTS channels_name
+            ON channels (name);
+        -- BansTable.get_by_channel, active and removed
+        CREATE INDEX IF NOT EXISTS bans_channel
+            ON bans (channel_id, remove_ts, id);
+        -- BansTable.get_id
+        CREATE INDEX IF NOT EXISTS bans_active_mask
+            ON bans (channel_id, mask)
+            WHERE remove_ts IS NULL;
+        -- BansTable.get_expired
+        CREATE INDEX IF NOT EXISTS bans_active_expiry
+            ON bans (expiry_ts)
+            WHERE remove_ts IS NULL AND expiry_ts IS NOT NULL;
+        -- BansTable.get_last_by_setter
+        CREATE INDEX IF NOT EXISTS bans_active_setter
+            ON bans (setter)
+            WHERE remove_ts IS NULL;
+        -- ChanOpsTable.is_chanop
+        CREATE INDEX IF NOT EXISTS chanops_channel_account
+            ON chanops (channel_id, account);
+        -- CommentsTable.get
+        CREATE INDEX IF NOT EXISTS comments_ban
+            ON comments (ban_id, time);
+    """),
+    (3, """
+        -- BansTable.get_id used to close the newest active ban of any
+        -- channel, so stale duplicates may be left active. keep the newest
+        -- of each before enforcing uniqueness
+        UPDATE bans
+        SET remove_ts = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE remove_ts IS NULL
+        AND id NOT IN (
+            SELECT MAX(id)
+            FROM bans
+            WHERE remove_ts IS NULL
+            GROUP BY channel_id, mode, lower(mask)
+        );
+        DROP INDEX IF EXISTS bans_active_mask;
+        CREATE UNIQUE INDEX IF NOT EXISTS bans_active_mask
+            ON bans (channel_id, mode, lower(mask))
+            WHERE remove_ts IS NULL;
+    """),
+    (4, """
+        -- channels (and through them bans, chanops and channel config)
+        -- belong to a network. existing rows go to the default network
+        ALTER TABLE channels ADD COLUMN network TEXT NOT NULL DEFAULT 'default';
+        DROP INDEX IF EXISTS channels_name;
+        CREATE INDEX IF NOT EXISTS channels_network_name
+            ON channels (network, name);
+    """),
+    (5, """
+        -- a channel's whole history in id order, for paging through it
+        -- with "id > ?" instead of OFFSET
+        CREATE INDEX IF NOT EXISTS bans_channel_history
+            ON bans (channel_id, id);
+    """),
+    (6, """
+        -- full text search over ban masks and reasons, and comments. both
+        -- are external content tables kept up to date by triggers
+        CREATE VIRTUAL TABLE IF NOT EXISTS bans_fts USING fts5(
+            mask, reason, content='bans', content_rowid='id'
+        );
+        CREATE TRIGGER IF NOT EXISTS bans_fts_insert AFTER INSERT ON bans BEGIN
+            INSERT INTO bans_fts (rowid, mask, reason)
+            VALUES (new.id, new.mask, new.reason);
+        END;
+        CREATE TRIGGER IF NOT EXISTS bans_fts_delete AFTER DELETE ON bans BEGIN
+            INSERT INTO bans_fts (bans_fts, rowid, mask, reason)
+            VALUES ('delete', old.id, old.mask, old.reason);
+        END;
+        CREATE TRIGGER IF NOT EXISTS bans_fts_update AFTER UPDATE OF mask, reason ON bans BEGIN
+            INSERT INTO bans_fts (bans_fts, rowid, mask, reason)
+            VALUES ('delete', old.id, old.mask, old.reason);
+            INSERT INTO bans_fts (rowid, mask, reason)
+            VALUES (new.id, new.mask, new.reason);
+        END;
+        INSERT INTO bans_fts (bans_fts) VALUES ('rebuild');
+
+        CREATE VIRTUAL TABLE IF NOT EXISTS comments_fts USING fts5(
+            comment, content='comments', content_rowid='rowid'
+        );
+        CREATE TRIGGER IF NOT EXISTS comments_fts_insert AFTER INSERT ON comments BEGIN
+            INSERT INTO comments_fts (rowid, comment)
+            VALUES (new.rowid, new.comment);
+        END;
+        CREATE TRIGGER IF NOT EXISTS comments_fts_delete AFTER DELETE ON comments BEGIN
+            INSERT INTO comments_fts (comments_fts, rowid, comment)
+            VALUES ('delete', old.rowid, old.comment);
+        END;
+        CREATE TRIGGER IF NOT EXISTS comments_fts_update AFTER UPDATE OF comment ON comments BEGIN
+            INSERT INTO comments_fts (comments_fts, rowid, comment)
+            VALUES ('delete', old.rowid, old.comment);
+            INSERT INTO comments_fts (rowid, comment)
+            VALUES (new.rowid, new.comment);
+        END;
+        INSERT INTO comments_fts (comments_fts) VALUES ('rebuild');
+    """),
+    (7, """
+        CREATE INDEX IF NOT EXISTS bans_removed
+        ON bans(remove_ts) WHERE remove_ts IS NOT NULL;
+    """),
+    (8, """
+        -- how far through each export an import has committed, and what
+        -- the export's channel and ban ids became here, see transfer.py
+        CREATE TABLE IF NOT EXISTS imports (
+            source TEXT PRIMARY KEY,
+            position INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS import_map (
+            source TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            old_id INTEGER NOT NULL,
+            new_id INTEGER NOT NULL,
+            PRIMARY KEY (source, kind, old_id)
+        );
+    """),
+    (9, """
+        -- running per-channel totals for StatsTable, kept up to date by
+        -- triggers so every way bans are written counts. archiving
+        -- deletes bans but isn't undone here; these cover all history
+        CREATE TABLE IF NOT EXISTS channel_stats (
+            channel_id INTEGER PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0,
+            removed INTEGER NOT NULL DEFAULT 0,
+            -- sum of remove_ts - ts over removed bans
+            removed_seconds INTEGER NOT NULL DEFAULT 0,
+            reasons INTEGER NOT NULL DEFAULT 0,
+            expiries INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS mode_stats (
+            channel_id INTEGER NOT NULL,
+            mode VARCHAR(1) NOT NULL,
+            active INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (channel_id, mode)
+        );
+        CREATE TABLE IF NOT EXISTS setter_stats (
+            channel_id INTEGER NOT NULL,
+            setter TEXT NOT NULL,
+            bans INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (channel_id, setter)
+        );
+        -- StatsTable.get's top setters
+        CREATE INDEX IF NOT EXISTS setter_stats_bans
+            ON setter_stats (channel_id, bans);
+
+        CREATE TRIGGER IF NOT EXISTS bans_stats_insert AFTER INSERT ON bans BEGIN
+            INSERT INTO channel_stats
+            (channel_id, total, removed, removed_seconds, reasons, expiries)
+            VALUES (
+                new.channel_id, 1,
+                new.remove_ts IS NOT NULL,
+                COALESCE(new.remove_ts - new.ts, 0),
+                new.reason IS NOT NULL,
+                new.expiry_ts IS NOT NULL
+            )
+            ON CONFLICT (channel_id) DO UPDATE SET
+                total           = total + 1,
+                removed         = removed + excluded.removed,
+                removed_seconds = removed_seconds + excluded.removed_seconds,
+                reasons         = reasons + excluded.reasons,
+                expiries        = expiries + excluded.expiries;
+            INSERT INTO mode_stats (channel_id, mode, active)
+            VALUES (new.channel_id, new.mode, new.remove_ts IS NULL)
+            ON CONFLICT (channel_id, mode) DO UPDATE SET
+                active = active + excluded.active;
+            INSERT INTO setter_stats (channel_id, setter, bans)
+            VALUES (new.channel_id, new.setter, 1)
+            ON CONFLICT (channel_id, setter) DO UPDATE SET
+                bans = bans + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS bans_stats_update
+        AFTER UPDATE OF remove_ts, reason, expiry_ts ON bans BEGIN
+            UPDATE channel_stats SET
+                removed = removed
+                    + (new.remove_ts IS NOT NULL) - (old.remove_ts IS NOT NULL),
+                removed_seconds = removed_seconds
+                    + COALESCE(new.remove_ts - new.ts, 0)
+                    - COALESCE(old.remove_ts - old.ts, 0),
+                reasons = reasons
+                    + (new.reason IS NOT NULL) - (old.reason IS NOT NULL),
+                expiries = expiries
+                    + (new.expiry_ts IS NOT NULL) - (old.expiry_ts IS NOT NULL)
+            WHERE channel_id = new.channel_id;
+            UPDATE mode_stats SET
+                active = active
+                    + (new.remove_ts IS NULL) - (old.remove_ts IS NULL)
+            WHERE channel_id = new.channel_id AND mode = new.mode;
+        END;
+    """ + STATS_REBUILD),
+]
+
+# the archive is its own file with no history to migrate, so it's just
+# created if it isn't there yet. rows keep their ids from the main database
+ARCHIVE = """
+    CREATE TABLE IF NOT EXISTS archive.bans (
+        id INTEGER PRIMARY KEY,
+        channel_id INTEGER NOT NULL,
+        setter TEXT NOT NULL,
+        mode VARCHAR(1),
+        ts INTEGER NOT NULL,
+        mask TEXT,
+        expiry_ts INTEGER,
+        remove_ts INTEGER,
+        remover   TEXT,
+        reason    TEXT
+    );
+    CREATE TABLE IF NOT EXISTS archive.comments (
+        ban_id INTEGER NOT NULL,
+        by_mask TEXT NOT NULL,
+        by_account TEXT,
+        time INTEGER NOT NULL,
+        comment TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS archive.comments_ban_id ON comments(ban_id);
+"""
+
+async def migrate(pool: DBPool) -> int:
+    async with pool.connection() as db:
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER NOT NULL
+            )
+        """)
+        await db.commit()
+
+        cursor  = await db.execute("SELECT MAX(version) FROM schema_version")
+        current = (await cursor.fetchone())[0] or 0
+
+        # before migrations, so they can refer to it
+        await db.executescript(f"BEGIN; {ARCHIVE} COMMIT;")
+
+        for version, sql in MIGRATIONS:
+            if version <= current:
+                continue
+            # executescript() commits anything pending first, so the
+            # migration and its version bump land in one transaction
+            await db.executescript(f"""
+                BEGIN;
+                {sql}
+                INSERT INTO schema_version (version) VALUES ({version});
+                COMMIT;
+            """)
+            current = version
+
+        # archiving frees pages that incremental_vacuum can hand back, but
+        # only once auto_vacuum is on, which takes one full VACUUM to set
+        cursor = await db.execute("PRAGMA auto_vacuum")
+        if (await cursor.fetchone())[0] != 2:
+            await db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            await db.execute("VACUUM")
+            # VACUUM can renumber rowids of tables without an INTEGER
+            # PRIMARY KEY, which comments_fts is keyed on
+            await db.execute("INSERT INTO comments_fts (comments_fts) VALUES ('rebuild')")
+            await db.commit()
+        return current
@@ -0,0 +1,194 @@
+import logging, re
+
+from collections import deque
+from time        import monotonic
+from typing      import Any, Deque, Dict, Iterable, List, Optional
+
+from aiosqlite   import Connection, Cursor
+
+log = logging.getLogger(__name__)
+
+# queries slower than this (milliseconds) are logged with their query plan
+SLOW_QUERY = 100.0
+# how many timings per statement to keep for percentiles
+SAMPLES    = 1000
+
+RE_STRING  = re.compile(r"'(?:[^']|'')*'")
+RE_NUMBER  = re.compile(r"\b\d+(?:\.\d+)?\b")
+RE_INLIST  = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+RE_SPACE   = re.compile(r"\s+")
+
+def normalise(sql: str) -> str:
+    # queries that only differ by literals or whitespace count as one
+    sql = RE_STRING.sub("?", sql)
+    sql = RE_NUMBER.sub("?", sql)
+    sql = RE_INLIST.sub("(...)", sql)
+    return RE_SPACE.sub(" ", sql).strip()
+
+def _returns_rows(sql: str) -> bool:
+    head = sql.lstrip()[:6].upper()
+    return head in {"SELECT", "WITH ", "PRAGMA"} or "RETURNING" in sql.upper()
+
+class QueryStats(object):
+    def __init__(self, sql: str):
+        self.sql   = sql
+        self.calls = 0
+        self.rows  = 0
+        self.total = 0.0
+        self.max   = 0.0
+        self.samples: Deque[float] = deque(maxlen=SAMPLES)
+
+    def percentile(self, pct: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered)-1, int(len(ordered)*pct/100))]
+
+class QueryProfiler(object):
+    def __init__(self, slow: float = SLOW_QUERY):
+        # milliseconds
+        self.slow = slow
+        self._stats: Dict[str, QueryStats] = {}
+        # raw sql -> normalised, so we only normalise each query text once
+        self._keys:  Dict[str, str] = {}
+
+    def _key(self, sql: str) -> str:
+        if (key := self._keys.get(sql)) is None:
+            key = self._keys[sql] = normalise(sql)
+        return key
+
+    def record(self, sql: str, seconds: float, rows: int) -> bool:
+        key = self._key(sql)
+        if (stats := self._stats.get(key)) is None:
+            stats = self._stats[key] = QueryStats(key)
+        stats.calls += 1
+        stats.rows  += rows
+        stats.total += seconds
+        stats.max    = max(stats.max, seconds)
+        stats.samples.append(seconds)
+        return seconds*1000 >= self.slow
+
+    async def slow_query(self,
+            db:      Optional[Connection],
+            sql:     str,
+            args:    Iterable[Any],
+            seconds: float):
+
+        plan: List[str] = []
+        if db is not None:
+            try:
+                cursor = await db.execute(f"EXPLAIN QUERY PLAN {sql}", args)
+                plan   = [row[-1] for row in await cursor.fetchall()]
+            except Exception:
+                # not everything can be explained (PRAGMA, DDL)
+                pass
+        log.warning(
+            "slow query (%.1fms): %s | plan: %s",
+            seconds*1000, self._key(sql), "; ".join(plan) or "n/a"
+        )
+
+    def top(self,
+            count: int = 10,
+            sort:  str = "total") -> List[QueryStats]:
+        keys = {
+            "total": lambda s: s.total,
+            "calls": lambda s: s.calls,
+            "rows":  lambda s: s.rows,
+            "p99":   lambda s: s.percentile(99),
+            "max":   lambda s: s.max
+        }
+        return sorted(self._stats.values(), key=keys[sort], reverse=True)[:count]
+
+    def report(self,
+            count: int = 10,
+            sort:  str = "total") -> List[str]:
+        out: List[str] = []
+        for stats in self.top(count, sort):
+            out.append(
+                f"{stats.calls} calls, {stats.total*1000:.1f}ms total,"
+                f" p50 {stats.percentile(50)*1000:.2f}ms"
+                f" p99 {stats.percentile(99)*1000:.2f}ms,"
+                f" {stats.rows} rows: {stats.sql[:200]}"
+            )
+        return out
+
+    def reset(self):
+        self._stats.clear()
+
+class ProfiledCursor(object):
+    def __init__(self,
+            profiler: QueryProfiler,
+            db:       Connection,
+            cursor:   Cursor,
+            sql:      str,
+            args:     Iterable[Any],
+            start:    float):
+        self._profiler = profiler
+        self._db       = db
+        self._cursor   = cursor
+        self._sql      = sql
+        self._args     = args
+        self._start    = start
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    async def _done(self, rows: int):
+        # only the first fetch is timed and counted
+        if self._start < 0:
+            return
+        seconds, self._start = monotonic()-self._start, -1.0
+        if self._profiler.record(self._sql, seconds, rows):
+            await self._profiler.slow_query(self._db, self._sql, self._args, seconds)
+
+    async def fetchall(self) -> Iterable[Any]:
+        rows = await self._cursor.fetchall()
+        await self._done(len(rows))
+        return rows
+
+    async def fetchone(self) -> Optional[Any]:
+        row = await self._cursor.fetchone()
+        await self._done(int(row is not None))
+        return row
+
+    async def fetchmany(self, size: Optional[int] = None) -> Iterable[Any]:
+        rows = await self._cursor.fetchmany(size)
+        await self._done(len(rows))
+        return rows
+
+class ProfiledConnection(object):
+    def __init__(self,
+            profiler: QueryProfiler,
+            db:       Connection):
+        self._profiler = profiler
+        self._db       = db
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._db, name)
+
+    async def execute(self,
+            sql:  str,
+            args: Iterable[Any] = ()) -> Any:
+
+        start  = monotonic()
+        cursor = await self._db.execute(sql, args)
+        if _returns_rows(sql):
+            # timed through to the fetch, so we also know the row count
+            return ProfiledCursor(self._profiler, self._db, cursor, sql, args, start)
+
+        seconds = monotonic()-start
+        if self._profiler.record(sql, seconds, max(cursor.rowcount, 0)):
+            await self._profiler.slow_query(self._db, sql, args, seconds)
+        return cursor
+
+    async def executemany(self,
+            sql:  str,
+            args: Iterable[Iterable[Any]]) -> Any:
+
+        start  = monotonic()
+        cursor = await self._db.executemany(sql, args)
+        seconds = monotonic()-start
+        if self._profiler.record(sql, seconds, max(cursor.rowcount, 0)):
+            # there's no single set of args to explain this with
+            await self._profiler.slow_query(None, sql, (), seconds)
+        return cursor
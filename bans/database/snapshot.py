@@ -0,0 +1,46 @@
+import os
+
+from aiosqlite import connect as db_connect
+
+from .common   import DBPool
+
+# pages copied per backup step, and how long to let go of the database for
+# between steps (seconds)
+SNAPSHOT_PAGES = 256
+SNAPSHOT_SLEEP = 0.005
+
+async def snapshot(
+        pool:  DBPool,
+        path:  str,
+        pages: int   = SNAPSHOT_PAGES,
+        sleep: float = SNAPSHOT_SLEEP):
+
+    # copies the database, and its archive to `path`.archive, with sqlite's
+    # online backup api. the copy runs on the connection's own thread a few
+    # pages at a time, so the event loop (and everything writing in the
+    # meantime) carries on as normal
+    async with pool.connection() as db:
+        # a read transaction pins what the backup sees. without one, every
+        # write from another connection would start the backup over
+        await db.execute("BEGIN")
+        try:
+            targets = [("main", path), ("archive", f"{path}.archive")]
+            for name, _ in targets:
+                cursor = await db.execute(f"SELECT COUNT(*) FROM {name}.sqlite_master")
+                await cursor.fetchall()
+
+            # written to the side and moved into place after, so there's
+            # never a half-finished snapshot where a finished one should be
+            for name, target_path in targets:
+                target = await db_connect(f"{target_path}.partial")
+                try:
+                    await db.backup(target, pages=pages, sleep=sleep, name=name)
+                    # one self-contained file, not a database plus a -wal
+                    await target.execute("PRAGMA journal_mode=DELETE")
+                finally:
+                    await target.close()
+        finally:
+            await db.rollback()
+
+    for _, target_path in targets:
+        os.replace(f"{target_path}.partial", target_path)
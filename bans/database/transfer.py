@@ -0,0 +1,262 @@
+from time   import time
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+from uuid   import uuid4
+
+from .common import DBPool
+
+# rows read from a cursor at a time, and records imported per transaction
+BATCH = 1000
+
+# every kind of record, in the order they're exported (and so imported):
+# anything a record refers to comes out before it
+FIELDS: Dict[str, List[str]] = {
+    "export":  ["source", "time"],
+    "channel": ["id", "network", "name", "autojoin"],
+    "chanop":  ["channel_id", "account"],
+    # channel_id is None for bot config. value is json, as it's stored
+    "config":  ["channel_id", "key", "value"],
+    "ban":     [
+        "id", "channel_id", "setter", "mode", "ts", "mask",
+        "expiry_ts", "remove_ts", "remover", "reason"
+    ],
+    "comment": ["ban_id", "by_mask", "by_account", "time", "comment"]
+}
+
+_BAN     = "id, channel_id, setter, mode, ts, mask, expiry_ts, remove_ts, remover, reason"
+_COMMENT = "ban_id, by_mask, by_account, time, comment"
+QUERIES = {
+    "channel": "SELECT id, network, name, autojoin FROM channels",
+    "chanop":  "SELECT channel_id, account FROM chanops",
+    "config":  """
+        SELECT NULL, key, value FROM bot_config
+        UNION ALL
+        SELECT channel_id, key, value FROM channel_config
+    """,
+    # archived history goes too
+    "ban":     f"SELECT {_BAN} FROM bans UNION ALL SELECT {_BAN} FROM archive.bans",
+    "comment": f"SELECT {_COMMENT} FROM comments UNION ALL SELECT {_COMMENT} FROM archive.comments"
+}
+
+async def export(pool: DBPool) -> AsyncIterator[Dict[str, Any]]:
+    # rows are read off the cursors a batch at a time and handed on as
+    # they come, so memory doesn't grow with the size of the database
+    yield {"kind": "export", "source": uuid4().hex, "time": int(time())}
+
+    async with pool.connection() as db:
+        # one read transaction, so every table comes from the same snapshot
+        await db.execute("BEGIN")
+        try:
+            for kind, query in QUERIES.items():
+                cursor = await db.execute(query)
+                while (rows := await cursor.fetchmany(BATCH)):
+                    for row in rows:
+                        yield {"kind": kind, **dict(zip(FIELDS[kind], row))}
+        finally:
+            await db.rollback()
+
+class Importer(object):
+    # loads what export() produced. ids are remapped, so it can go into a
+    # database that already has its own channels and bans. each batch
+    # commits along with how far through the export we are, so running
+    # the same export again carries on after the last committed batch
+    def __init__(self,
+            pool:  DBPool,
+            batch: int = BATCH):
+
+        self._pool  = pool
+        self._batch = batch
+        self.source: Optional[str] = None
+        self.counts: Dict[str, int] = {}
+
+        # exported channel id -> ours. there aren't many channels, unlike
+        # bans, which are only mapped through the import_map table
+        self._channels: Dict[int, int] = {}
+        self._position = 0
+        self._done     = 0
+
+    async def _start(self, source: str):
+        self.source = source
+        async with self._pool.connection() as db:
+            cursor = await db.execute(
+                "SELECT position FROM imports WHERE source = ?", [source]
+            )
+            if (row := await cursor.fetchone()) is not None:
+                self._done = row[0]
+            cursor = await db.execute("""
+                SELECT old_id, new_id FROM import_map
+                WHERE source = ? AND kind = 'channel'
+            """, [source])
+            self._channels = dict(await cursor.fetchall())
+
+    async def run(self, records: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        pending: List[Dict[str, Any]] = []
+        for record in records:
+            if record["kind"] == "export":
+                await self._start(record["source"])
+                continue
+            elif self.source is None:
+                raise ValueError("not an export (no header record)")
+            elif not record["kind"] in FIELDS:
+                raise ValueError(f"unknown record kind {record['kind']!r}")
+
+            if pending and (len(pending) >= self._batch or
+                    record["kind"] != pending[0]["kind"]):
+                await self._flush(pending)
+                pending = []
+
+            self._position += 1
+            if self._position > self._done:
+                pending.append(record)
+            # else it was committed by an earlier, interrupted run
+
+        if pending:
+            await self._flush(pending)
+        return self.counts
+
+    async def _flush(self, records: List[Dict[str, Any]]):
+        # self._position is the last of `records`
+        kind = records[0]["kind"]
+        async with self._pool.connection() as db:
+            # take the write lock up front; ban ids are handed out below
+            await db.execute("BEGIN IMMEDIATE")
+            count = await getattr(self, f"_import_{kind}")(db, records)
+            await db.execute("""
+                INSERT OR REPLACE INTO imports (source, position)
+                VALUES (?, ?)
+            """, [self.source, self._position])
+            await db.commit()
+        self.counts[kind] = self.counts.get(kind, 0) + count
+
+    async def _map(self,
+            db:   Any,
+            kind: str,
+            ids:  List[Any]):
+        await db.executemany("""
+            INSERT OR REPLACE INTO import_map (source, kind, old_id, new_id)
+            VALUES (?, ?, ?, ?)
+        """, [[self.source, kind, old, new] for old, new in ids])
+
+    async def _import_channel(self, db: Any, records: List[Dict[str, Any]]) -> int:
+        mapped: List[Any] = []
+        for record in records:
+            cursor = await db.execute("""
+                SELECT id FROM channels WHERE network = ? AND name = ?
+            """, [record["network"], record["name"]])
+            if (row := await cursor.fetchone()) is not None:
+                id = row[0]
+            else:
+                cursor = await db.execute("""
+                    INSERT INTO channels (network, name, autojoin)
+                    VALUES (?, ?, ?)
+                """, [record["network"], record["name"], record["autojoin"]])
+                id = cursor.lastrowid
+            mapped.append((record["id"], id))
+
+        await self._map(db, "channel", mapped)
+        self._channels.update(mapped)
+        return len(mapped)
+
+    async def _import_chanop(self, db: Any, records: List[Dict[str, Any]]) -> int:
+        rows = [
+            [self._channels[r["channel_id"]], r["account"]]*2
+            for r in records if r["channel_id"] in self._channels
+        ]
+        await db.executemany("""
+            INSERT INTO chanops (channel_id, account)
+            SELECT ?, ?
+            WHERE NOT EXISTS (
+                SELECT 1 FROM chanops WHERE channel_id = ? AND account = ?
+            )
+        """, rows)
+        return len(rows)
+
+    async def _import_config(self, db: Any, records: List[Dict[str, Any]]) -> int:
+        # settings already made here win over imported ones
+        bot = [[r["key"], r["value"]] for r in records if r["channel_id"] is None]
+        channel = [
+            [self._channels[r["channel_id"]], r["key"], r["value"]]
+            for r in records if r["channel_id"] in self._channels
+        ]
+        await db.executemany("""
+            INSERT OR IGNORE INTO bot_config (key, value) VALUES (?, ?)
+        """, bot)
+        await db.executemany("""
+            INSERT OR IGNORE INTO channel_config (channel_id, key, value)
+            VALUES (?, ?, ?)
+        """, channel)
+        return len(bot)+len(channel)
+
+    async def _import_ban(self, db: Any, records: List[Dict[str, Any]]) -> int:
+        # the same ban can be in both databases if archiving was cut short
+        records = list({
+            r["id"]: r for r in records if r["channel_id"] in self._channels
+        }.values())
+        if not records:
+            return 0
+        # and the two copies needn't be in the same batch
+        marks  = ", ".join("?"*len(records))
+        cursor = await db.execute(f"""
+            SELECT old_id FROM import_map
+            WHERE source = ? AND kind = 'ban' AND old_id IN ({marks})
+        """, [self.source, *(r["id"] for r in records)])
+        mapped  = {row[0] for row in await cursor.fetchall()}
+        records = [r for r in records if not r["id"] in mapped]
+        if not records:
+            return 0
+
+        # executemany() won't tell us the ids it made, so we pick them.
+        # archived ids count too, so they're never handed out again
+        cursor = await db.execute("""
+            SELECT MAX(id) FROM (
+                SELECT MAX(id) AS id FROM bans
+                UNION ALL
+                SELECT MAX(id) FROM archive.bans
+            )
+        """)
+        next_id = ((await cursor.fetchone())[0] or 0) + 1
+        ids     = {r["id"]: next_id+i for i, r in enumerate(records)}
+
+        # a ban that's active here already is left be (there can only be
+        # one active ban per mask) and the imported one maps onto it
+        await db.executemany(f"""
+            INSERT OR IGNORE INTO bans ({_BAN})
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [
+            [ids[r["id"]], self._channels[r["channel_id"]],
+                *(r[f] for f in FIELDS["ban"][2:])]
+            for r in records
+        ])
+        marks  = ", ".join("?"*len(records))
+        cursor = await db.execute(
+            f"SELECT id FROM bans WHERE id IN ({marks})", list(ids.values())
+        )
+        inserted = {row[0] for row in await cursor.fetchall()}
+        for record in records:
+            if not ids[record["id"]] in inserted:
+                cursor = await db.execute("""
+                    SELECT id FROM bans
+                    WHERE channel_id = ? AND mode = ? AND lower(mask) = lower(?)
+                    AND remove_ts IS NULL
+                """, [self._channels[record["channel_id"]], record["mode"], record["mask"]])
+                ids[record["id"]] = (await cursor.fetchone())[0]
+
+        await self._map(db, "ban", list(ids.items()))
+        return len(inserted)
+
+    async def _import_comment(self, db: Any, records: List[Dict[str, Any]]) -> int:
+        old_ids = list({r["ban_id"] for r in records})
+        marks   = ", ".join("?"*len(old_ids))
+        cursor  = await db.execute(f"""
+            SELECT old_id, new_id FROM import_map
+            WHERE source = ? AND kind = 'ban' AND old_id IN ({marks})
+        """, [self.source, *old_ids])
+        bans = dict(await cursor.fetchall())
+
+        rows = [
+            [bans[r["ban_id"]], *(r[f] for f in FIELDS["comment"][1:])]
+            for r in records if r["ban_id"] in bans
+        ]
+        await db.executemany(f"""
+            INSERT INTO comments ({_COMMENT}) VALUES (?, ?, ?, ?, ?)
+        """, rows)
+        return len(rows)
@@ -0,0 +1,138 @@
+import asyncio
+from sqlite3     import IntegrityError
+from time        import time
+from typing      import Any, List, Optional, Tuple
+from .common     import DBPool
+
+# how long a write may sit in the queue before it's flushed (seconds)
+FLUSH_INTERVAL = 0.05
+# flush straight away once this many writes are queued
+FLUSH_SIZE     = 200
+
+# collects ban mutations from many callers and commits them together, one
+# transaction per flush. each write returns a future that resolves once its
+# transaction has been committed
+class WriteQueue(object):
+    def __init__(self,
+            pool:     DBPool,
+            interval: float = FLUSH_INTERVAL,
+            size:     int   = FLUSH_SIZE):
+
+        self._pool     = pool
+        self._interval = interval
+        self._size     = size
+
+        self._pending: List[Tuple[str, List[Any], "asyncio.Future[Any]"]] = []
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def _put(self, query: str, args: List[Any]) -> "asyncio.Future[Any]":
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((query, args, future))
+
+        if self._full is None:
+            self._full = asyncio.Event()
+        if len(self._pending) >= self._size:
+            self._full.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return future
+
+    async def _run(self):
+        try:
+            while self._pending:
+                if len(self._pending) < self._size:
+                    try:
+                        await asyncio.wait_for(self._full.wait(), self._interval)
+                    except asyncio.TimeoutError:
+                        pass
+                await self.flush()
+        finally:
+            self._task = None
+
+    async def flush(self):
+        batch         = self._pending
+        self._pending = []
+        if self._full is not None:
+            self._full.clear()
+        if not batch:
+            return
+
+        results: List[Any] = []
+        try:
+            async with self._pool.connection() as db:
+                for query, args, _ in batch:
+                    try:
+                        cursor = await db.execute(query, args)
+                    except IntegrityError as e:
+                        # one bad row (e.g. a duplicate active mask) fails
+                        # on its own rather than taking the batch with it
+                        results.append(e)
+                    else:
+                        results.append(cursor.lastrowid)
+                await db.commit()
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, _, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                elif isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    async def close(self):
+        # drain everything that's still queued, without waiting out the
+        # flush interval
+        if self._task is not None:
+            if self._full is not None:
+                self._full.set()
+            await self._task
+        await self.flush()
+
+    def add(self,
+            channel: int,
+            setter:  str,
+            mode:    str,
+            mask:    Optional[str] = None,
+            expiry:  Optional[int] = None,
+            reason:  Optional[str] = None,
+            ts:      Optional[int] = None) -> "asyncio.Future[int]":
+
+        if ts is None:
+            ts = int(time())
+        return self._put("""
+            INSERT INTO bans
+            (channel_id, setter, mode, mask, ts, expiry_ts, reason)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [channel, setter, mode, mask, ts, expiry, reason])
+
+    def remove(self,
+            id:      int,
+            remover: Optional[str] = None) -> "asyncio.Future[Any]":
+
+        return self._put("""
+            UPDATE bans
+            SET remove_ts = ?, remover = ?
+            WHERE id = ?""", [int(time()), remover, id])
+
+    def set_expiry(self,
+            id:     int,
+            expiry: Optional[int]) -> "asyncio.Future[Any]":
+
+        return self._put("""
+            UPDATE bans
+            SET expiry_ts = ?
+            WHERE id = ?""", [expiry, id])
+
+    def set_reason(self,
+            id:     int,
+            reason: str) -> "asyncio.Future[Any]":
+
+        return self._put("""
+            UPDATE bans
+            SET reason = ?
+            WHERE id = ?""", [reason, id])
@@ -0,0 +1,116 @@
+import asyncio, logging
+
+from time   import monotonic
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# how many jobs a lane holds before new ones are shed (or coalesced)
+LANE_SIZE  = 100
+# how many jobs all the lanes hold between them, so lots of lanes filling
+# at once can't queue without bound either
+TOTAL_SIZE = 5000
+# how long an empty lane is kept around before it's torn down (seconds)
+LANE_IDLE = 60.0
+
+Job = Callable[[], Awaitable[None]]
+
+class Lane(object):
+    def __init__(self, key: str, size: int):
+        self.key   = key
+        self.queue: "asyncio.Queue[Tuple[float, Job]]" = asyncio.Queue(size)
+        self.task: Optional["asyncio.Task[None]"] = None
+
+        self.processed = 0
+        self.dropped   = 0
+        # time spent queued and running, in seconds
+        self.wait_total = 0.0
+        self.wait_max   = 0.0
+        self.run_total  = 0.0
+        self.run_max    = 0.0
+
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+# runs jobs in per-key lanes: jobs with the same key (a channel, a caller)
+# run one at a time in the order they were submitted, while different keys
+# run concurrently
+class Dispatcher(object):
+    def __init__(self,
+            size:  int   = LANE_SIZE,
+            total: int   = TOTAL_SIZE,
+            idle:  float = LANE_IDLE):
+
+        self._size  = size
+        self._total = total
+        self._idle  = idle
+        self._lanes: Dict[str, Lane] = {}
+        # jobs queued across every lane
+        self._queued = 0
+
+    def _lane(self, key: str) -> Lane:
+        if (lane := self._lanes.get(key)) is None:
+            lane = self._lanes[key] = Lane(key, self._size)
+        if lane.task is None:
+            lane.task = asyncio.create_task(self._run(lane))
+        return lane
+
+    async def _run(self, lane: Lane):
+        try:
+            while True:
+                try:
+                    queued, job = await asyncio.wait_for(lane.queue.get(), self._idle)
+                except asyncio.TimeoutError:
+                    if lane.queue.empty():
+                        del self._lanes[lane.key]
+                        return
+                    continue
+                self._queued -= 1
+
+                start = monotonic()
+                try:
+                    await job()
+                except Exception:
+                    log.exception("job in lane %s failed", lane.key)
+                end = monotonic()
+
+                lane.processed  += 1
+                lane.wait_total += start-queued
+                lane.wait_max    = max(lane.wait_max, start-queued)
+                lane.run_total  += end-start
+                lane.run_max     = max(lane.run_max, end-start)
+        finally:
+            lane.task = None
+
+    def submit(self,
+            key:      str,
+            job:      Job,
+            overflow: Optional[Job] = None) -> bool:
+
+        # never waits, so whatever is feeding us (the read loop) is never
+        # held up. when the lane or the dispatcher is full the job is shed,
+        # or, given an `overflow` job that stands in for everything queued
+        # (e.g. resyncing a channel), the lane is coalesced down to that
+        lane = self._lane(key)
+        if lane.queue.full() or self._queued >= self._total:
+            if overflow is None:
+                lane.dropped += 1
+                return False
+
+            dropped = 1
+            while not lane.queue.empty():
+                lane.queue.get_nowait()
+                self._queued -= 1
+                dropped      += 1
+            lane.dropped += dropped
+            log.warning("no room in lane %s, coalesced %d jobs", key, dropped)
+            lane.queue.put_nowait((monotonic(), overflow))
+            self._queued += 1
+            return False
+
+        lane.queue.put_nowait((monotonic(), job))
+        self._queued += 1
+        return True
+
+    def lanes(self) -> List[Lane]:
+        return list(self._lanes.values())
@@ -0,0 +1,114 @@
+import json, logging, queue, sys
+
+from collections      import deque
+from dataclasses      import dataclass, field
+from logging.handlers import QueueHandler, QueueListener
+from time             import time
+from typing           import Deque, List, Optional, Set, Tuple
+
+# how many raw lines (either direction) to keep in memory for RAWLOG
+RAW_BUFFER = 1000
+
+# extra fields we attach to records and write out when present
+FIELDS = ("network", "channel", "command", "direction")
+
+@dataclass
+class LogConfig(object):
+    level:    str  = "INFO"
+    # "json" for one object per line, "text" for something human readable
+    format:   str  = "json"
+    # log every raw line read and sent. the ring buffer is kept regardless
+    raw:      bool = False
+    raw_buffer: int = RAW_BUFFER
+    # only log records about these channels/commands; empty means all of them
+    channels: Set[str] = field(default_factory=set)
+    commands: Set[str] = field(default_factory=set)
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts":     round(record.created, 3),
+            "level":  record.levelname,
+            "logger": record.name,
+            "msg":    record.getMessage()
+        }
+        for key in FIELDS:
+            if (value := getattr(record, key, None)) is not None:
+                out[key] = value
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out)
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # like QueueHandler.prepare, but keep the traceback out of the
+        # message so it can have its own field
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg  = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class FieldFilter(logging.Filter):
+    def __init__(self,
+            channels: Set[str],
+            commands: Set[str]):
+        super().__init__()
+        self._channels = {c.lower() for c in channels}
+        self._commands = {c.upper() for c in commands}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        channel = getattr(record, "channel", None)
+        if self._channels and channel is not None:
+            if not channel.lower() in self._channels:
+                return False
+        command = getattr(record, "command", None)
+        if self._commands and command is not None:
+            if not command.upper() in self._commands:
+                return False
+        return True
+
+class RawBuffer(object):
+    def __init__(self, size: int = RAW_BUFFER):
+        self._lines: Deque[Tuple[float, str, str]] = deque(maxlen=size)
+
+    def append(self, direction: str, line: str):
+        self._lines.append((time(), direction, line))
+
+    def last(self,
+            count:  int,
+            search: Optional[str] = None) -> List[Tuple[float, str, str]]:
+        lines = list(self._lines)
+        if search is not None:
+            search = search.lower()
+            lines  = [l for l in lines if search in l[2].lower()]
+        return lines[-count:]
+
+def setup(config: LogConfig) -> QueueListener:
+    # records are only put on a queue on the event loop; formatting and
+    # writing to stdout happen on the listener's own thread
+    handler = logging.StreamHandler(sys.stdout)
+    if config.format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(
+            "%(asctime)s %(levelname)s %(name)s: %(message)s"
+        ))
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(FieldFilter(config.channels, config.commands))
+
+    root = logging.getLogger("bans")
+    root.setLevel(config.level.upper())
+    root.addHandler(queue_handler)
+    root.propagate = False
+
+    raw = logging.getLogger("bans.raw")
+    raw.setLevel(logging.DEBUG if config.raw else logging.CRITICAL+1)
+
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    return listener
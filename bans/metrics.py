@@ -0,0 +1,189 @@
+import asyncio, logging
+
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# seconds
+BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+Labels = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Tuple[str, ...], values: Labels, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric(object):
+    type = "untyped"
+
+    def __init__(self,
+            name:   str,
+            help:   str,
+            labels: Tuple[str, ...] = ()):
+        self.name   = name
+        self.help   = help
+        self.labels = labels
+
+    def _render(self) -> List[str]:
+        raise NotImplementedError()
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type}",
+            *self._render()
+        ]
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0)+amount
+
+    def _render(self) -> List[str]:
+        return [
+            f"{self.name}{_labels(self.labels, k)} {_number(v)}"
+            for k, v in self._values.items()
+        ]
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, *labels: str, value: float):
+        self._values[labels] = value
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self,
+            name:    str,
+            help:    str,
+            labels:  Tuple[str, ...] = (),
+            buckets: Tuple[float, ...] = BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # labels -> (per-bucket counts with a final +Inf slot, sum, count)
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, *labels: str, value: float):
+        if (entry := self._values.get(labels)) is None:
+            entry = self._values[labels] = ([0]*(len(self.buckets)+1), [0.0])
+        counts, total = entry
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def _render(self) -> List[str]:
+        out: List[str] = []
+        for labels, (counts, total) in self._values.items():
+            running = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                running += count
+                le = _labels(self.labels, labels, f'le="{_number(bound)}"')
+                out.append(f"{self.name}_bucket{le} {running}")
+            out.append(f"{self.name}_sum{_labels(self.labels, labels)} {_number(total[0])}")
+            out.append(f"{self.name}_count{_labels(self.labels, labels)} {running}")
+        return out
+
+class Registry(object):
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        # called before every scrape, to fill in gauges that are cheaper to
+        # read on demand than to keep up to date
+        self.collectors: List[Callable[[], None]] = []
+
+    def add(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception:
+                log.exception("metrics collector failed")
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+LINES_READ = REGISTRY.add(Counter(
+    "bans_lines_read_total", "IRC lines read", ("network", "command")
+))
+LINES_SENT = REGISTRY.add(Counter(
+    "bans_lines_sent_total", "IRC lines sent", ("network", "command")
+))
+COMMAND_SECONDS = REGISTRY.add(Histogram(
+    "bans_command_seconds", "time spent handling a command", ("command",)
+))
+DB_SECONDS = REGISTRY.add(Histogram(
+    "bans_db_seconds", "time spent in a database table method", ("table", "method")
+))
+EXPIRY_LAG = REGISTRY.add(Histogram(
+    "bans_expiry_lag_seconds", "time between a ban's expiry and its unban being sent",
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 3600.0)
+))
+POPULATE_SECONDS = REGISTRY.add(Gauge(
+    "bans_populate_seconds", "how long the last ban list sync took", ("network", "channel")
+))
+READY_SECONDS = REGISTRY.add(Gauge(
+    "bans_ready_seconds", "time from connecting until every autojoin channel was synced",
+    ("network",)
+))
+OUTBOUND_DEPTH = REGISTRY.add(Gauge(
+    "bans_outbound_depth", "lines waiting to be sent", ("network", "priority")
+))
+
+async def _handle(
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter):
+    try:
+        request = await asyncio.wait_for(reader.readline(), 5.0)
+        # drain the headers, we don't need any of them
+        while (await asyncio.wait_for(reader.readline(), 5.0)).strip():
+            pass
+
+        method, path, *_ = request.decode("ascii", "replace").split(" ") + ["", ""]
+        if method == "GET" and path.split("?", 1)[0] in {"/", "/metrics"}:
+            status = "200 OK"
+            body   = REGISTRY.render().encode("utf8")
+        else:
+            status = "404 Not Found"
+            body   = b"not found\n"
+
+        writer.write((
+            f"HTTP/1.0 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode("ascii") + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(host: str, port: int) -> asyncio.AbstractServer:
+    server = await asyncio.start_server(_handle, host, port)
+    log.info("serving metrics on %s:%d", host, port)
+    return server
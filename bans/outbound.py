@@ -0,0 +1,115 @@
+import asyncio, logging
+
+from collections import deque
+from time        import monotonic
+from typing      import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from irctokens           import Line
+from ircrobots.interface import SendPriority
+
+log = logging.getLogger(__name__)
+
+# default flood control: a burst of 5 lines, then 2 lines a second
+THROTTLE_RATE  = 2.0
+THROTTLE_BURST = 5
+
+class TokenBucket(object):
+    def __init__(self, rate: float, burst: int):
+        self.rate   = rate
+        self.burst  = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last   = monotonic()
+
+    def _refill(self):
+        now = monotonic()
+        self._tokens = min(self.burst, self._tokens + (now-self._last)*self.rate)
+        self._last   = now
+
+    async def take(self):
+        while True:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1-self._tokens)/self.rate)
+
+class PriorityStats(object):
+    def __init__(self):
+        self.sent       = 0
+        self.wait_total = 0.0
+        self.wait_max   = 0.0
+
+# lines wait in a FIFO per priority and are handed to the connection one at a
+# time, highest priority first, as the token bucket allows
+class OutboundQueue(object):
+    def __init__(self,
+            send:  Callable[[Line, int], Awaitable[Any]],
+            rate:  float = THROTTLE_RATE,
+            burst: int   = THROTTLE_BURST):
+
+        self._send   = send
+        self.bucket  = TokenBucket(rate, burst)
+        self._queues: Dict[int, Deque[Tuple[float, Line, "asyncio.Future[Any]"]]] = {
+            int(p): deque() for p in {SendPriority.HIGH, SendPriority.MEDIUM, SendPriority.LOW}
+        }
+        self.stats: Dict[int, PriorityStats] = {p: PriorityStats() for p in self._queues}
+
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def depth(self, priority: Optional[int] = None) -> int:
+        if priority is not None:
+            return len(self._queues[priority])
+        return sum(len(q) for q in self._queues.values())
+
+    def put(self, line: Line, priority: int) -> "asyncio.Future[Any]":
+        if not priority in self._queues:
+            # bucket anything unusual with the nearest lane
+            priority = min(self._queues, key=lambda p: abs(p-priority))
+
+        future = asyncio.get_running_loop().create_future()
+        # most callers don't wait to see a line go out, and a failed send
+        # has already been logged
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._queues[priority].append((monotonic(), line, future))
+
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        self._wake.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._pump())
+        return future
+
+    def _next(self) -> Optional[Tuple[int, float, Line, "asyncio.Future[Any]"]]:
+        for priority in sorted(self._queues):
+            if self._queues[priority]:
+                return (priority, *self._queues[priority].popleft())
+        return None
+
+    async def _pump(self):
+        while True:
+            if not self.depth():
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+
+            await self.bucket.take()
+            # pick after waiting for a token, so anything more urgent that
+            # turned up in the meantime goes first
+            priority, queued, line, future = self._next()
+
+            stats = self.stats[priority]
+            wait  = monotonic()-queued
+            stats.sent       += 1
+            stats.wait_total += wait
+            stats.wait_max    = max(stats.wait_max, wait)
+
+            try:
+                sent = await self._send(line, priority)
+            except Exception as e:
+                log.exception("sending %r failed", line.format())
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(sent)
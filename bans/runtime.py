@@ -106,17 +106,21 @@ class RuntimePreferences(object):
         self.settings: Dict[str, Any] = {
             "reportChannel": SettingString(None, type=SettingType.ANY|SettingType.RESTRICTED),
             "autoExpire": SettingInt(0, type=SettingType.CHANNEL),
+            "evasionCheck": SettingBool(False, type=SettingType.CHANNEL),
             "reportOn": SettingEnum(
                 {},
                 {"new", "exp", "rem"},
                 type=SettingType.CHANNEL
             ),
+            # days after removal that a ban is moved to the archive, 0 never
+            "archiveAfter": SettingInt(0, type=SettingType.GLOBAL|SettingType.RESTRICTED),
         }
 
     async def get(self,
             key: str,
             channel: Optional[str] = None,
-            privileged: Optional[bool] = True):
+            privileged: Optional[bool] = True,
+            network: Optional[str] = None):
 
         if not key in self.settings.keys():
             raise ConfigError(f"{key} is not a valid preference")
@@ -132,7 +136,7 @@ class RuntimePreferences(object):
                 raise ConfigError(f"{key} is not valid in the global context")
             if (ret := await self.db.config.bot.get(key)) is not None:
                 return ret
-        elif (channel := await self.db.channels.get(channel)) is not None:
+        elif (channel := await self.db.channels.get(network, channel)) is not None:
             if not self.settings[key].type & SettingType.CHANNEL:
                 raise ConfigError(f"{key} is not valid in the channel context")
             if (ret := await self.db.config.channel.get(channel.id, key)) is not None:
@@ -143,16 +147,18 @@ class RuntimePreferences(object):
     async def get_pretty(self,
             key: str,
             channel: Optional[str] = None,
-            privileged: Optional[bool] = True):
+            privileged: Optional[bool] = True,
+            network: Optional[str] = None):
 
-        ret = await self.get(key, channel, privileged)
+        ret = await self.get(key, channel, privileged, network)
         return self.settings[key].pretty_print(ret)
 
     async def set(self,
             key: str,
             value: Any,
             channel: Optional[str] = None,
-            privileged: Optional[bool] = True):
+            privileged: Optional[bool] = True,
+            network: Optional[str] = None):
 
         if not key in self.settings.keys():
             raise ConfigError(f"{key} is not a valid preference")
@@ -163,7 +169,7 @@ class RuntimePreferences(object):
             raise ConfigError(f"{key} is restricted and cannot be managed by non-privileged users.")
 
         try:
-            validated = self.settings[key].parse(await self.get(key, channel=channel, privileged=privileged), value)
+            validated = self.settings[key].parse(await self.get(key, channel=channel, privileged=privileged, network=network), value)
         except Exception as e:
             raise ConfigError(f"Invalid value data: {e}")
 
@@ -171,7 +177,7 @@ class RuntimePreferences(object):
             if not self.settings[key].type & SettingType.GLOBAL:
                 raise ConfigError(f"{key} is not valid in the global context")
             await self.db.config.bot.set(key, validated)
-        elif (channel := await self.db.channels.get(channel)) is not None:
+        elif (channel := await self.db.channels.get(network, channel)) is not None:
             if not self.settings[key].type & SettingType.CHANNEL:
                 raise ConfigError(f"{key} is not valid in the channel context")
             serialized = self.settings[key].serialize(validated)
@@ -179,12 +185,13 @@ class RuntimePreferences(object):
 
     async def unset(self,
             key: str,
-            channel: Optional[str] = None):
+            channel: Optional[str] = None,
+            network: Optional[str] = None):
 
         if not key in self.settings.keys():
             raise ConfigError(f"{key} is not a valid preference")
 
         if not channel:
             await self.db.config.bot.delete(key)
-        elif (channel := await self.db.channels.get(channel)) is not None:
+        elif (channel := await self.db.channels.get(network, channel)) is not None:
             await self.db.config.channel.delete(channel.id, key)
@@ -1,40 +1,276 @@
-import asyncio
+import asyncio, heapq, logging, os
 
+from functools import partial
 from ircrobots import Bot
-from time      import time
+from time      import strftime, time
+from typing    import Dict, List, Optional, Set, Tuple
 
-from .database import Database
+from .database         import Database
+from .database.db_bans import DBBan
+from .metrics          import EXPIRY_LAG
+from .runtime          import RuntimePreferences
 
-async def check_expiry(bot: Bot, db: Database):
-    while True:
-        now  = int(time())
-        wait = 10.0
+log = logging.getLogger(__name__)
 
-        if not bot.servers:
-            await asyncio.sleep(wait)
-            continue
+# how long to wait for an unban to be echoed back before sending it again
+UNBAN_RETRY = 30.0
 
-        server = list(bot.servers.values())[0]
+# how often to look for removed bans old enough to archive (seconds)
+ARCHIVE_INTERVAL = 3600.0
+# bans moved per transaction
+ARCHIVE_BATCH    = 500
+# pages handed back to the filesystem per incremental vacuum step
+VACUUM_PAGES     = 1000
+# vacuum steps per pass; whatever's left is picked up by the next pass
+VACUUM_STEPS     = 50
+# how long to leave the database to everything else between archive
+# batches and vacuum steps (seconds)
+ARCHIVE_PAUSE    = 0.1
 
-        expired = await db.bans.get_expired()
-        expired_groups = {}
+# how many scheduled or requested snapshots to keep around
+SNAPSHOT_KEEP    = 5
+
+class ExpiryScheduler(object):
+    def __init__(self,
+            bot:   Bot,
+            db:    Database,
+            retry: float = UNBAN_RETRY):
+
+        self._bot   = bot
+        self._db    = db
+        self._retry = retry
+
+        # (expiry_ts, ban id). entries are invalidated lazily: one only
+        # counts if it still matches self._expiries
+        self._heap:     List[Tuple[int, int]] = []
+        self._expiries: Dict[int, int] = {}
+        # ban id -> when to send its unban again if it hasn't been echoed
+        self._inflight: Dict[int, float] = {}
+        # channels with overdue bans we couldn't lift because we weren't in
+        # them, and whether one of them has since been synced
+        self._unjoined: Set[int] = set()
+        self._catch_up = False
+
+        self._wake: Optional[asyncio.Event] = None
+
+    def _notify(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    def schedule(self, id: int, expiry: Optional[int]):
+        if expiry is None:
+            self.cancel(id)
+            return
+
+        self._expiries[id] = expiry
+        self._inflight.pop(id, None)
+        heapq.heappush(self._heap, (expiry, id))
+        self._notify()
+
+    def cancel(self, id: int):
+        self._expiries.pop(id, None)
+        self._inflight.pop(id, None)
+
+    def synced(self, channel: int):
+        # we're in the channel and its list is up to date, so anything that
+        # went overdue before we got there can be lifted now rather than
+        # when it's next retried
+        if channel in self._unjoined:
+            self._unjoined.discard(channel)
+            self._catch_up = True
+            self._notify()
+
+    def _next_deadline(self) -> Optional[float]:
+        while self._heap:
+            expiry, id = self._heap[0]
+            if self._expiries.get(id) == expiry:
+                break
+            heapq.heappop(self._heap)
+
+        deadlines: List[float] = list(self._inflight.values())
+        if self._heap:
+            deadlines.append(self._heap[0][0])
+        return min(deadlines, default=None)
+
+    def _pop_due(self, now: float) -> bool:
+        due = False
+        while self._heap and self._heap[0][0] <= now:
+            expiry, id = heapq.heappop(self._heap)
+            if self._expiries.get(id) == expiry:
+                del self._expiries[id]
+                due = True
+        for id, retry in self._inflight.items():
+            if retry <= now:
+                due = True
+        return due
+
+    async def _load(self):
+        for ban in await self._db.bans.get_expiring():
+            self._expiries[ban.id] = ban.expiry
+            self._heap.append((ban.expiry, ban.id))
+        heapq.heapify(self._heap)
+
+    async def _expire(self, now: float):
+        # one indexed query per wake-up. this also picks up, as one grouped
+        # pass, everything that went overdue while we were offline
+        expired = [
+            b for b in await self._db.bans.get_expired()
+            if self._inflight.get(b.id, 0) <= now
+        ]
+        # retries don't count towards expiry lag
+        first = {b.id for b in expired if not b.id in self._inflight}
+        # unbans that timed out are either retried below or no longer need it
+        for id, retry in list(self._inflight.items()):
+            if retry <= now:
+                del self._inflight[id]
         for ban in expired:
-            if not ban.channelid in expired_groups:
-                expired_groups[ban.channelid] = []
+            # remember we've asked, until the unban is echoed back
+            self._inflight[ban.id] = now + self._retry
 
-            expired_groups[ban.channelid].append(ban)
+        expired_groups: Dict[int, list] = {}
+        for ban in expired:
+            expired_groups.setdefault(ban.channelid, []).append(ban)
 
         for channelid, bans in expired_groups.items():
-            channel = (await db.channels.from_id(channelid)).name
-            if not channel in server.channels:
+            channel = await self._db.channels.from_id(channelid)
+            # each channel is unbanned through its own network's connection
+            server  = self._bot.servers.get(channel.network)
+            if server is None or not channel.name in server.channels:
+                # picked up again once we've joined and synced it
+                for ban in bans:
+                    del self._inflight[ban.id]
+                self._unjoined.add(channelid)
                 continue
 
-            args = []
-            modes = ""
-            for ban in bans:
-                modes += ban.mode
-                if ban.mask is not None:
-                    args.append(ban.mask)
+            # in the channel's lane on that network, so a slow network (or
+            # channel) doesn't hold up the rest. one that's too busy to take
+            # it is retried along with unbans that were never echoed
+            job = partial(self._unban, server, channel.name, bans, first)
+            server.dispatch.submit(f"channel {server.casefold(channel.name)}", job)
+
+    async def _unban(self, server, channel: str, bans: List[DBBan], first: Set[int]):
+        await server._remove_modes(channel, [(b.mode, b.mask) for b in bans])
+        sent = time()
+        for ban in bans:
+            if ban.id in first:
+                EXPIRY_LAG.observe(value=sent-ban.expiry)
+
+    async def run(self):
+        self._wake = asyncio.Event()
+        await self._load()
+
+        while True:
+            now = time()
+            if self._pop_due(now) or self._catch_up:
+                self._catch_up = False
+                try:
+                    await self._expire(now)
+                except Exception:
+                    log.exception("expiring bans failed")
+
+            timeout = None
+            if (deadline := self._next_deadline()) is not None:
+                timeout = max(0.0, deadline-time())
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+class Archiver(object):
+    # moves bans removed more than `archiveAfter` days ago out to the
+    # archive database, then shrinks the main one
+    def __init__(self,
+            db:       Database,
+            runtime:  RuntimePreferences,
+            interval: float = ARCHIVE_INTERVAL,
+            batch:    int   = ARCHIVE_BATCH,
+            pause:    float = ARCHIVE_PAUSE):
+
+        self._db       = db
+        self._runtime  = runtime
+        self._interval = interval
+        self._batch    = batch
+        self._pause    = pause
+
+    async def archive(self) -> int:
+        if not (days := await self._runtime.get("archiveAfter")):
+            return 0
+
+        before = int(time()) - int(days)*86400
+        moved  = 0
+        # a batch at a time, letting everything else at the database
+        # in between
+        while (count := await self._db.bans.archive(before, self._batch)):
+            moved += count
+            await asyncio.sleep(self._pause)
+        for _ in range(VACUUM_STEPS):
+            if not await self._db.vacuum(VACUUM_PAGES):
+                break
+            await asyncio.sleep(self._pause)
+        return moved
+
+    async def run(self):
+        while True:
+            try:
+                if (moved := await self.archive()):
+                    log.info("archived %d removed bans", moved)
+            except Exception:
+                log.exception("archiving bans failed")
+            await asyncio.sleep(self._interval)
+
+class Snapshotter(object):
+    # consistent copies of the live database, taken while it's in use.
+    # the newest is also there to run heavy reads against, see reports()
+    def __init__(self,
+            db:        Database,
+            directory: str,
+            interval:  float = 0.0,
+            keep:      int   = SNAPSHOT_KEEP):
+
+        self._db       = db
+        self.directory = directory
+        # seconds, 0 for only on request
+        self._interval = interval
+        self._keep     = max(1, keep)
+        self._lock     = asyncio.Lock()
+
+    def list(self) -> List[str]:
+        # oldest first; the names sort by when they were taken
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            os.path.join(self.directory, f) for f in os.listdir(self.directory)
+            if f.startswith("bans-") and f.endswith(".db")
+        )
+
+    async def take(self) -> str:
+        # one at a time, there's no use in two copying the same pages
+        async with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, strftime("bans-%Y%m%d-%H%M%S.db"))
+            await self._db.snapshot(path)
+
+            for old in self.list()[:-self._keep]:
+                for file in [old, f"{old}.archive"]:
+                    try:
+                        os.remove(file)
+                    except FileNotFoundError:
+                        pass
+            return path
+
+    def reports(self) -> Optional[Database]:
+        # the newest snapshot, read-only, for queries that would otherwise
+        # hold up the live database. close it when done
+        if (snapshots := self.list()):
+            return Database(snapshots[-1], readonly=True)
+        return None
 
-            await server._remove_modes(channel, modes, args)
-        await asyncio.sleep(wait)
+    async def run(self):
+        while self._interval > 0:
+            await asyncio.sleep(self._interval)
+            try:
+                path = await self.take()
+                log.info("took snapshot %s", path)
+            except Exception:
+                log.exception("taking a snapshot failed")
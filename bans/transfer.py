@@ -0,0 +1,110 @@
+import asyncio, csv, json, sys
+from argparse import ArgumentParser
+from typing   import Any, Dict, Iterable, IO, List
+
+from .config   import load as config_load
+from .database import Database
+from .database.transfer import FIELDS
+from .timers   import Snapshotter
+
+# moves ban data between instances, or out for offline analysis:
+#   python -m bans.transfer export config.yaml [--format csv] [-o file] [--snapshot]
+#   python -m bans.transfer import config.yaml file
+# an import that's interrupted carries on where it stopped if run again.
+# a running bot won't see imported data until it's restarted
+
+FORMATS = ["jsonl", "csv"]
+# csv is one table with a column for every field of every kind; a
+# record only fills in its own
+COLUMNS: List[str] = ["kind"]
+for _fields in FIELDS.values():
+    COLUMNS.extend(f for f in _fields if not f in COLUMNS)
+# csv has no types, so these are turned back into numbers on import
+INTEGERS = {
+    "id", "autojoin", "channel_id", "ts", "expiry_ts", "remove_ts",
+    "ban_id", "time"
+}
+
+async def export(db: Database, out: IO[str], format: str) -> int:
+    count = 0
+    if format == "csv":
+        writer = csv.DictWriter(out, COLUMNS)
+        writer.writeheader()
+        async for record in db.export():
+            writer.writerow(record)
+            count += 1
+    else:
+        async for record in db.export():
+            out.write(json.dumps(record, separators=(",", ":")) + "\n")
+            count += 1
+    return count
+
+def _read_csv(file: IO[str]) -> Iterable[Dict[str, Any]]:
+    for row in csv.DictReader(file):
+        record: Dict[str, Any] = {"kind": row["kind"]}
+        for field in FIELDS.get(row["kind"], []):
+            value = row.get(field) or None
+            if value is not None and field in INTEGERS:
+                value = int(value)
+            record[field] = value
+        yield record
+
+def _read_jsonl(file: IO[str]) -> Iterable[Dict[str, Any]]:
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+async def main():
+    parser = ArgumentParser(prog="python -m bans.transfer")
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("config")
+    parser.add_argument("file", nargs="?", default="-")
+    parser.add_argument("-o", "--output", help="export to this file, not stdout")
+    parser.add_argument("--format", choices=FORMATS,
+        help="default: from the file extension, else jsonl")
+    parser.add_argument("--snapshot", action="store_true",
+        help="export from a new snapshot rather than the live database")
+    args = parser.parse_args()
+
+    path   = args.output or args.file
+    format = args.format or (path.endswith(".csv") and "csv" or "jsonl")
+
+    config = config_load(args.config)
+    if args.snapshot and config.snapshots is None:
+        parser.error("--snapshot needs a snapshots section in the config")
+    db     = config.database
+    await db.migrate()
+    try:
+        if args.action == "export":
+            source = db
+            if args.snapshot:
+                # a long export holds a read transaction open the whole
+                # time, which stops the live database's wal being reset
+                snapshots = Snapshotter(db, *config.snapshots)
+                await snapshots.take()
+                source = snapshots.reports()
+
+            out = sys.stdout if path == "-" else open(path, "w", newline="")
+            try:
+                count = await export(source, out, format)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+                if source is not db:
+                    await source.close()
+            print(f"exported {count} records", file=sys.stderr)
+        else:
+            file = sys.stdin if path == "-" else open(path, newline="")
+            try:
+                read   = _read_csv if format == "csv" else _read_jsonl
+                counts = await db.import_(read(file))
+            finally:
+                if file is not sys.stdin:
+                    file.close()
+            for kind, count in counts.items():
+                print(f"imported {count} {kind} records", file=sys.stderr)
+    finally:
+        await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -23,40 +23,145 @@ class SettingType(IntFlag):
     ANY        = GLOBAL|CHANNEL
 
 async def cs_op(server: Server, channel: str) -> bool:
-    await server.send(build(
+    # start waiting before we ask, or a quick enough reply is read (and
+    # missed) before we're looking for it
+    waiter = asyncio.ensure_future(server.wait_for(Response(
+        "MODE", [Folded(channel), "+o", SELF], source=CHANSERV
+    ), timeout=2))
+    await asyncio.sleep(0)
+    await server.send_wait(build(
         "CS", ["OP", channel]
     ))
     try:
-        await server.wait_for(Response(
-            "MODE", [Folded(channel), "+o", SELF], source=CHANSERV
-        ), timeout=2)
+        await waiter
     except asyncio.TimeoutError:
         return False
     else:
         return True
 
-def is_admin(admins, mask) -> bool:
-    for admin_mask in admins:
-        if admin_mask.match(mask):
-            return True
+# servers relay MODE lines with our hostmask prefixed, and the whole thing
+# (CRLF included) has to fit in this
+LINE_MAX = 512
+
+def _takes_arg(isupport, sign: str, mode: str) -> bool:
+    chanmodes = isupport.chanmodes
+    if (mode in isupport.prefix.modes or
+            mode in chanmodes.a_modes or
+            mode in chanmodes.b_modes):
+        return True
+    elif mode in chanmodes.c_modes:
+        return sign == "+"
     return False
 
-def mode_batches(
-        chunk_n: int,
-        add:     bool,
-        modes:   str,
-        args:    List[str]
-        ) -> Iterable[Tuple[str, List[str]]]:
+def parse_modes(
+        isupport,
+        modes:    str,
+        args:     List[str]
+        ) -> List[Tuple[str, str, Optional[str]]]:
+
+    args = list(args)
+    sign = "+"
+    out: List[Tuple[str, str, Optional[str]]] = []
+    for c in modes:
+        if c in {"+", "-"}:
+            sign = c
+        elif _takes_arg(isupport, sign, c):
+            out.append((sign, c, args.pop(0) if args else None))
+        else:
+            out.append((sign, c, None))
+    return out
+
+def pack_modes(
+        isupport,
+        channel:    str,
+        ops:        List[Tuple[str, str, Optional[str]]],
+        prefix_len: int = 0
+        ) -> List[Tuple[str, List[str]]]:
+
+    # as few MODE lines as possible for (sign, mode, arg) ops, respecting
+    # ISUPPORT MODES, CHANMODES and the line length limit. `prefix_len` is
+    # the relayed ":nick!user@host " prefix, in bytes
+    max_args = isupport.modes if isupport.modes > 0 else len(ops)
+    # ":prefix MODE #channel " and CRLF, plus a byte in case the last
+    # argument needs a ":"
+    base = prefix_len + len(f"MODE {channel} \r\n".encode("utf8")) + 1
+
+    batches: List[Tuple[str, List[str]]] = []
+    modes = ""
+    args: List[str] = []
+    sign: Optional[str] = None
+    length = base
+
+    for op_sign, mode, arg in ops:
+        takes_arg = _takes_arg(isupport, op_sign, mode)
+        if takes_arg and arg is None:
+            raise ValueError(f"{op_sign}{mode} needs a parameter")
+
+        arg_len = len(arg.encode("utf8"))+1 if takes_arg else 0
+        if modes and (
+                (takes_arg and len(args) >= max_args) or
+                length + (op_sign != sign) + 1 + arg_len > LINE_MAX):
+            batches.append((modes, args))
+            modes  = ""
+            args   = []
+            sign   = None
+            length = base
 
-    mod = "+" if add else "-"
-    for i in range(0, len(modes), chunk_n):
-        cur_slice = slice(i, i+chunk_n)
-        cur_modes = modes[cur_slice]
-        cur_args  =  args[cur_slice]
-        yield f"{mod}{modes[cur_slice]}", args[cur_slice]
+        if op_sign != sign:
+            modes  += op_sign
+            sign    = op_sign
+            length += 1
+        modes  += mode
+        length += 1
+        if takes_arg:
+            args.append(arg)
+            length += arg_len
+
+    if modes:
+        batches.append((modes, args))
+    return batches
+
+def targmax(isupport, command: str) -> int:
+    # TARGMAX=JOIN:,PRIVMSG:4 - 0 for no limit, as is a missing or empty one
+    for item in (isupport.raw.get("TARGMAX") or "").split(","):
+        name, _, limit = item.partition(":")
+        if name.upper() == command and limit.isdigit():
+            return int(limit)
+    return 0
+
+def pack_joins(
+        isupport,
+        channels: List[str]
+        ) -> List[List[str]]:
+
+    # as few JOIN lines as possible, respecting ISUPPORT TARGMAX and the
+    # line length limit
+    max_targets = targmax(isupport, "JOIN") or len(channels)
+    base = len("JOIN \r\n".encode("utf8"))
+
+    batches: List[List[str]] = []
+    names:   List[str] = []
+    length = base
+    for channel in channels:
+        chan_len = len(channel.encode("utf8"))
+        if names and (
+                len(names) >= max_targets or
+                length + 1 + chan_len > LINE_MAX):
+            batches.append(names)
+            names  = []
+            length = base
+
+        # a comma between each
+        length += chan_len + bool(names)
+        names.append(channel)
+
+    if names:
+        batches.append(names)
+    return batches
 
 async def try_join(server: Server, channel: str) -> bool:
-    await server.send(build("JOIN", [channel]))
+    # the timeout below counts from when the JOIN is sent, not queued
+    await server.send_wait(build("JOIN", [channel]))
     try:
         while True:
             line = await server.wait_for({
@@ -128,3 +233,14 @@ def find_unescaped(s: str, c: Set[str]) -> List[int]:
             indexes.append(i)
         i += 1
     return indexes
+
+def fts_query(s: str) -> Optional[str]:
+    # every word becomes a quoted FTS5 phrase, so nothing typed can be taken
+    # as query syntax. a trailing * is kept as a prefix search
+    terms: List[str] = []
+    for word in s.split():
+        prefix = word.endswith("*")
+        word   = word.rstrip("*").replace('"', "")
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms) or None
@@ -0,0 +1 @@
+# drives the real bot against a fake ircd; see `python -m benchmarks --help`
@@ -0,0 +1,48 @@
+import asyncio, logging, sys
+from argparse import ArgumentParser
+from os.path  import dirname, join
+
+from .report    import compare, load, save
+from .scenarios import SCENARIOS
+
+BASELINE  = join(dirname(__file__), "baseline.json")
+# how much worse than the baseline a rate or latency can get before it counts
+TOLERANCE = 0.25
+
+async def main(names, scale: float):
+    results = []
+    for name in names:
+        print(f"running {name}...", file=sys.stderr)
+        results.append(await SCENARIOS[name](scale))
+    return results
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("scenarios", nargs="*", choices=[[], *SCENARIOS],
+        help="scenarios to run (default: all of them)")
+    parser.add_argument("--scale", type=float, default=1.0,
+        help="multiply every scenario's size by this")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save", action="store_true",
+        help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    # every scenario tears its connection down mid-flight; asyncio's
+    # complaints about that aren't interesting
+    logging.getLogger("asyncio").setLevel(logging.CRITICAL)
+
+    names   = args.scenarios or list(SCENARIOS)
+    results = asyncio.run(main(names, args.scale))
+
+    baseline = load(args.baseline)
+    if baseline is None:
+        print(f"no baseline at {args.baseline}; run with --save to make one")
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save:
+        save(args.baseline, results)
+        print(f"saved baseline to {args.baseline}")
+    elif regressions:
+        print(f"regressed: {', '.join(regressions)}")
+        sys.exit(1)
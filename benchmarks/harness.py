@@ -0,0 +1,123 @@
+import asyncio, os, shutil, tempfile
+
+from time   import monotonic
+from typing import Dict, List, Optional, Tuple
+
+from asyncio_throttle import Throttler
+from irctokens        import Line
+from ircrobots        import ConnectionParams, SASLUserPass
+
+from bans          import Bot, Server
+from bans.auth     import Authorization
+from bans.config   import Config, NetworkConfig
+from bans.database import Database
+from bans.logs     import LogConfig
+from bans.runtime  import RuntimePreferences
+from bans.timers   import ExpiryScheduler
+
+from .ircd import FakeIRCd
+
+NETWORK  = "bench"
+NICKNAME = "bans"
+# anyone from here is an admin, so commands aren't all refused
+ADMIN    = "*!*@admin.bench"
+# flood control would make every scenario about the throttle, so it's
+# opened right up unless a scenario asks otherwise
+THROTTLE = (100000.0, 10000)
+
+class BenchServer(Server):
+    # records when the bot finishes work we can't see from the wire
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # ircrobots' own limiter sits under ours at 100 lines a second, so
+        # it'd be the bottleneck for scenarios that open ours right up
+        rate = max(100, int(self.network.throttle[0]))
+        self.throttle = Throttler(rate_limit=rate, period=1)
+
+    async def _populate_modes(self, channel, modes: str):
+        await super()._populate_modes(channel, modes)
+        self.bot.synced[channel.name] = monotonic()
+
+    async def _on_mode(self, line: Line):
+        await super()._on_mode(line)
+        self.bot.moded.append((monotonic(), line))
+
+class BenchBot(Bot):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.synced: Dict[str, float] = {}
+        self.moded:  List[Tuple[float, Line]] = []
+
+    def create_server(self, name: str):
+        return BenchServer(self, name, self.config, self._database)
+
+class Harness(object):
+    def __init__(self, throttle: Tuple[float, int] = THROTTLE):
+        self.throttle = throttle
+        self.ircd     = FakeIRCd()
+        self._dir     = tempfile.mkdtemp(prefix="bans-bench-")
+        self.db       = Database(os.path.join(self._dir, "bans.db"))
+
+        self.bot:    Optional[BenchBot] = None
+        self.server: Optional[BenchServer] = None
+        self.expiry: Optional[ExpiryScheduler] = None
+        self._tasks: List["asyncio.Task[None]"] = []
+
+    async def setup(self):
+        await self.db.migrate()
+        await self.db.preload()
+
+    async def connect(self, timeout: float = 30.0):
+        port   = await self.ircd.start()
+        config = Config(
+            {NETWORK: NetworkConfig(
+                NETWORK, ("127.0.0.1", port, False),
+                NICKNAME, NICKNAME, NICKNAME, None,
+                self.throttle, ("bans", "hunter2")
+            )},
+            [],
+            self.db,
+            RuntimePreferences(self.db),
+            Authorization([ADMIN], self.db),
+            LogConfig(level="WARNING"),
+            None
+        )
+
+        self.bot    = BenchBot(config, self.db)
+        self.expiry = ExpiryScheduler(self.bot, self.db)
+        self.db.bans.watchers.append(self.expiry)
+
+        # tls=None rather than False, which newer ircrobots won't take
+        params = ConnectionParams(
+            NICKNAME, "127.0.0.1", port, None,
+            autojoin=[c.name for c in await self.db.channels.list(NETWORK)]
+        )
+        params.sasl = SASLUserPass("bans", "hunter2")
+        self.server = await self.bot.add_server(NETWORK, params)
+        self._tasks = [
+            asyncio.create_task(self.bot.run()),
+            asyncio.create_task(self.expiry.run())
+        ]
+        await asyncio.wait_for(self.ircd.ready.wait(), timeout)
+
+    async def until(self, check, timeout: float, interval: float = 0.001):
+        # poll for something the bot does that isn't worth a hook
+        deadline = monotonic()+timeout
+        while not check():
+            if monotonic() > deadline:
+                raise asyncio.TimeoutError()
+            await asyncio.sleep(interval)
+
+    async def close(self):
+        # hang up first so the bot's read loop isn't left waiting on us
+        await self.ircd.stop()
+        tasks = list(self._tasks)
+        if self.server is not None:
+            tasks.extend(l.task for l in self.server.dispatch.lanes() if l.task is not None)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks, timeout=5)
+        await self.db.close()
+        shutil.rmtree(self._dir, ignore_errors=True)
@@ -0,0 +1,239 @@
+import asyncio
+
+from dataclasses import dataclass, field
+from time        import monotonic, time
+from typing      import Callable, Dict, List, Optional, Set, Tuple
+
+from irctokens import tokenise, Line
+
+SERVER   = "ircd.bench"
+CHANSERV = "ChanServ!ChanServ@services.bench"
+
+ISUPPORT = [
+    "CASEMAPPING=rfc1459", "CHANTYPES=#", "CHANMODES=bq,k,l,imnpst",
+    "PREFIX=(ov)@+", "MODES=4", "NETWORK=Bench", "WHOX",
+    "TARGMAX=JOIN:20,PRIVMSG:4"
+]
+JOIN_TARGETS = 20
+CAPS = ["sasl=PLAIN", "extended-join", "account-notify", "account-tag", "multi-prefix"]
+
+@dataclass
+class FakeChannel(object):
+    name:  str
+    # mode -> mask -> (setter, set at)
+    lists: Dict[str, Dict[str, Tuple[str, int]]] = field(
+        default_factory=lambda: {"b": {}, "q": {}}
+    )
+    ops:   Set[str] = field(default_factory=set)
+
+# just enough of an ircd to drive the real bot: registration with CAP and
+# SASL PLAIN, JOIN, list mode queries, MODE echoes and ChanServ OP
+class FakeIRCd(object):
+    def __init__(self):
+        self.channels: Dict[str, FakeChannel] = {}
+        self.nickname  = "*"
+
+        # when each line the bot sent arrived, and hooks to watch for them
+        self.watchers: List[Callable[[Line, float], None]] = []
+        # (wall clock, mode, mask) for every list mode removed by the bot
+        self.removed:  List[Tuple[float, str, str]] = []
+        # (joins, per seconds): past this, joins are refused with
+        # ERR_THROTTLE
+        self.join_limit: Optional[Tuple[int, float]] = None
+        self.throttled = 0
+        self._joins: List[float] = []
+
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.ready = asyncio.Event()
+        self._registered = False
+        self._cap_end    = True
+        self._user       = False
+
+    def channel(self, name: str) -> FakeChannel:
+        if (channel := self.channels.get(name.lower())) is None:
+            channel = self.channels[name.lower()] = FakeChannel(name)
+        return channel
+
+    @property
+    def hostmask(self) -> str:
+        return f"{self.nickname}!bot@bench"
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self._server = await asyncio.start_server(self._client, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def send(self, line: Line):
+        self._writer.write(f"{line.format()}\r\n".encode("utf8"))
+
+    def send_raw(self, raw: str):
+        self._writer.write(f"{raw}\r\n".encode("utf8"))
+
+    def numeric(self, numeric: str, *params: str):
+        self.send_raw(f":{SERVER} {numeric} {self.nickname} " + " ".join(
+            params[:-1] + (f":{params[-1]}",) if params else ()
+        ))
+
+    async def drain(self):
+        await self._writer.drain()
+
+    async def _client(self,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter):
+        self._writer = writer
+        buffer = b""
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            buffer += data
+            *lines, buffer = buffer.split(b"\r\n")
+            now = monotonic()
+            for raw in lines:
+                if raw:
+                    line = tokenise(raw.decode("utf8"))
+                    self._handle(line)
+                    for watcher in self.watchers:
+                        watcher(line, now)
+            await writer.drain()
+
+    def _welcome(self):
+        if self._registered or not self._user or not self._cap_end:
+            return
+        self._registered = True
+        self.numeric("001", "welcome to the benchmark")
+        self.numeric("005", *ISUPPORT, "are supported by this server")
+        self.numeric("376", "End of MOTD")
+        self.ready.set()
+
+    def _handle(self, line: Line):
+        command = line.command
+        if   command == "CAP":
+            sub = line.params[0].upper()
+            if sub == "LS":
+                self._cap_end = False
+                self.send_raw(f":{SERVER} CAP * LS :{' '.join(CAPS)}")
+            elif sub == "REQ":
+                self.send_raw(f":{SERVER} CAP * ACK :{line.params[1]}")
+            elif sub == "END":
+                self._cap_end = True
+                self._welcome()
+        elif command == "AUTHENTICATE":
+            if line.params[0] == "PLAIN":
+                self.send_raw("AUTHENTICATE +")
+            else:
+                self.numeric("900", self.hostmask, "bans", "You are now logged in")
+                self.numeric("903", "SASL authentication successful")
+        elif command == "NICK":
+            self.nickname = line.params[0]
+        elif command == "USER":
+            self._user = True
+            self._welcome()
+        elif command == "PING":
+            self.send_raw(f":{SERVER} PONG {SERVER} :{line.params[0]}")
+        elif command == "JOIN":
+            names = line.params[0].split(",")
+            for name in names[JOIN_TARGETS:]:
+                self.numeric("407", name, "Too many targets")
+            for name in names[:JOIN_TARGETS]:
+                self._join(name)
+        elif command == "WHO":
+            self.numeric("315", line.params[0], "End of /WHO list")
+        elif command == "MODE" and line.params[0].startswith("#"):
+            self._mode(line)
+        elif (command == "CS" or
+                (command == "PRIVMSG" and line.params[0].lower() == "chanserv")):
+            args = line.params[-1].split() if command == "PRIVMSG" else line.params
+            if len(args) > 1 and args[0].upper() == "OP":
+                channel = self.channel(args[1])
+                channel.ops.add(self.nickname)
+                self.send_raw(f":{CHANSERV} MODE {channel.name} +o {self.nickname}")
+
+    def _join(self, name: str):
+        if self.join_limit is not None:
+            count, per = self.join_limit
+            now = monotonic()
+            self._joins = [t for t in self._joins if t > now-per]
+            if len(self._joins) >= count:
+                self.throttled += 1
+                self.numeric("480", name, "Cannot join channel (throttled)")
+                return
+            self._joins.append(now)
+
+        channel = self.channel(name)
+        self.send_raw(f":{self.hostmask} JOIN {channel.name} bans :bench bot")
+        self.numeric("353", "=", channel.name, self.nickname)
+        self.numeric("366", channel.name, "End of /NAMES list")
+
+    def _mode(self, line: Line):
+        channel = self.channel(line.params[0])
+        if len(line.params) == 1:
+            self.numeric("324", channel.name, "+nt")
+            return
+
+        modes = line.params[1]
+        args  = list(line.params[2:])
+        if not args:
+            # list queries, one listing per list mode asked for
+            for mode in modes.lstrip("+"):
+                self._list(channel, mode)
+            return
+
+        sign = "+"
+        for char in modes:
+            if char in "+-":
+                sign = char
+            elif char in "bqov" and args:
+                arg = args.pop(0)
+                if char in channel.lists:
+                    if sign == "+":
+                        channel.lists[char][arg] = (self.hostmask, 0)
+                    elif channel.lists[char].pop(arg, None) is not None:
+                        self.removed.append((time(), char, arg))
+                elif char == "o":
+                    (channel.ops.add if sign == "+" else channel.ops.discard)(arg)
+        # echoed back as it was sent, like a real server would
+        self.send_raw(f":{self.hostmask} {line.format()}")
+
+    def _list(self, channel: FakeChannel, mode: str):
+        if mode == "b":
+            for mask, (setter, ts) in channel.lists["b"].items():
+                self.numeric("367", channel.name, mask, setter, str(ts))
+            self.numeric("368", channel.name, "End of channel ban list")
+        elif mode == "q":
+            for mask, (setter, ts) in channel.lists["q"].items():
+                self.numeric("728", channel.name, "q", mask, setter, str(ts))
+            self.numeric("729", channel.name, "q", "End of channel quiet list")
+
+    # what other users do
+    def user_mode(self,
+            source:  str,
+            channel: str,
+            modes:   str,
+            args:    List[str],
+            account: Optional[str] = None):
+        fake = self.channel(channel)
+        sign = "+"
+        queue = list(args)
+        for char in modes:
+            if char in "+-":
+                sign = char
+            elif char in fake.lists and queue:
+                arg = queue.pop(0)
+                if sign == "+":
+                    fake.lists[char][arg] = (source, 0)
+                else:
+                    fake.lists[char].pop(arg, None)
+        tags = f"@account={account} " if account else ""
+        self.send_raw(f"{tags}:{source} MODE {channel} {modes} {' '.join(args)}")
+
+    def user_privmsg(self, source: str, message: str, account: Optional[str] = None):
+        tags = f"@account={account} " if account else ""
+        self.send_raw(f"{tags}:{source} PRIVMSG {self.nickname} :{message}")
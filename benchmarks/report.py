@@ -0,0 +1,80 @@
+import json
+
+from typing import Dict, List, Optional
+
+# metrics where bigger is better; everything else is a latency, a duration
+# or a size
+HIGHER_BETTER = {"throughput"}
+# what a run is failed on. other notes are informational
+JUDGED = {"throughput", "p50", "p99", "rss_mb_per_100k"}
+
+class Result(object):
+    def __init__(self, name: str, unit: str = "ops"):
+        self.name    = name
+        self.unit    = unit
+        self.count   = 0
+        self.elapsed = 0.0
+        self.samples: List[float] = []
+        self.notes:   Dict[str, float] = {}
+
+    def percentile(self, pct: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered)-1, int(len(ordered)*pct/100))]
+
+    def metrics(self) -> Dict[str, float]:
+        out = {
+            "throughput": self.count/self.elapsed if self.elapsed else 0.0,
+            "elapsed":    self.elapsed,
+            "p50":        self.percentile(50),
+            "p90":        self.percentile(90),
+            "p99":        self.percentile(99),
+            "max":        max(self.samples, default=0.0)
+        }
+        out.update(self.notes)
+        return out
+
+def _format(key: str, value: float, unit: str) -> str:
+    if key == "throughput":
+        return f"{value:.1f} {unit}/s"
+    elif key in {"p50", "p90", "p99", "max"}:
+        return f"{value*1000:.2f}ms"
+    elif key == "elapsed":
+        return f"{value:.2f}s"
+    elif key.startswith("rss_mb"):
+        return f"{value:.1f}MB"
+    return f"{value:g}"
+
+def load(path: str) -> Optional[Dict[str, Dict[str, float]]]:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+def save(path: str, results: List[Result]):
+    with open(path, "w") as file:
+        json.dump({r.name: r.metrics() for r in results}, file, indent=2, sort_keys=True)
+        file.write("\n")
+
+def compare(
+        results:   List[Result],
+        baseline:  Optional[Dict[str, Dict[str, float]]],
+        tolerance: float) -> List[str]:
+    # returns the regressions, having printed everything
+    regressions: List[str] = []
+    for result in results:
+        print(f"{result.name} ({result.count} {result.unit}):")
+        base = (baseline or {}).get(result.name, {})
+        for key, value in result.metrics().items():
+            line = f"  {key:<12} {_format(key, value, result.unit):>16}"
+            if (old := base.get(key)):
+                change = (value-old)/old
+                worse  = -change if key in HIGHER_BETTER else change
+                line  += f"  (baseline {_format(key, old, result.unit)}, {change*100:+.1f}%)"
+                if key in JUDGED and worse > tolerance:
+                    line += "  REGRESSION"
+                    regressions.append(f"{result.name} {key}")
+            print(line)
+    return regressions
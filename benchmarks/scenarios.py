@@ -0,0 +1,282 @@
+import asyncio, gc, resource
+
+from time   import monotonic, time
+from typing import Dict, List, Tuple
+
+from irctokens import Line
+
+from .harness import Harness, NETWORK
+from .report  import Result
+
+OP      = "op!op@op.bench"
+OP_ACCT = "op"
+
+def _mask(channel: int, i: int) -> str:
+    return f"*!*@host{i}.c{channel}.bench"
+
+def _channels(count: int) -> List[str]:
+    return [f"#bench{i}" for i in range(count)]
+
+async def _joined(harness: Harness, channels: List[str], timeout: float):
+    await harness.until(lambda: len(harness.bot.synced) >= len(channels), timeout)
+
+async def join(scale: float) -> Result:
+    # cold start: every channel's ban list is new to the database
+    channels = _channels(max(1, int(100*scale)))
+    per_chan = max(1, int(500*scale))
+    result   = Result("join", "bans")
+
+    harness = Harness()
+    try:
+        await harness.setup()
+        for c, name in enumerate(channels):
+            await harness.db.channels.add(NETWORK, name)
+            fake = harness.ircd.channel(name)
+            for i in range(per_chan):
+                # one in ten is a quiet
+                mode = "q" if i % 10 == 0 else "b"
+                fake.lists[mode][_mask(c, i)] = (OP, 1600000000+i)
+
+        joins: Dict[str, float] = {}
+        def _watch(line: Line, now: float):
+            if line.command == "JOIN":
+                for name in line.params[0].split(","):
+                    joins.setdefault(name, now)
+        harness.ircd.watchers.append(_watch)
+
+        start = monotonic()
+        await harness.connect()
+        await _joined(harness, channels, 300)
+
+        for name in channels:
+            result.samples.append(harness.bot.synced[name]-joins[name])
+        result.elapsed = max(harness.bot.synced.values())-start
+        result.count   = len(channels)*per_chan
+    finally:
+        await harness.close()
+    return result
+
+async def startup(scale: float) -> Result:
+    # time-to-ready for a lot of channels, on a server that throttles joins
+    channels = _channels(max(1, int(300*scale)))
+    per_chan = max(1, int(50*scale))
+    result   = Result("startup", "channels")
+
+    harness = Harness()
+    try:
+        await harness.setup()
+        for c, name in enumerate(channels):
+            await harness.db.channels.add(NETWORK, name)
+            fake = harness.ircd.channel(name)
+            for i in range(per_chan):
+                fake.lists["b"][_mask(c, i)] = (OP, 1600000000+i)
+        harness.ircd.join_limit = (100, 1.0)
+
+        start = monotonic()
+        await harness.connect()
+        await _joined(harness, channels, 300)
+
+        for name in channels:
+            result.samples.append(harness.bot.synced[name]-start)
+        result.elapsed = max(harness.bot.synced.values())-start
+        result.count   = len(channels)
+        result.notes["throttled"] = harness.ircd.throttled
+    finally:
+        await harness.close()
+    return result
+
+async def mode_flood(scale: float) -> Result:
+    # chanops setting bans faster than the bot can comfortably keep up
+    channels = _channels(10)
+    count    = max(1, int(2000*scale))
+    result   = Result("mode_flood", "lines")
+
+    harness = Harness()
+    try:
+        await harness.setup()
+        for name in channels:
+            await harness.db.channels.add(NETWORK, name)
+        await harness.connect()
+        await _joined(harness, channels, 60)
+
+        sent: Dict[str, float] = {}
+        start = monotonic()
+        for i in range(count):
+            channel = channels[i % len(channels)]
+            masks   = [f"*!*@flood{i}-{j}.bench" for j in range(4)]
+            sent[masks[0]] = monotonic()
+            harness.ircd.user_mode(OP, channel, "+bbbb", masks, OP_ACCT)
+            if i % 100 == 0:
+                await harness.ircd.drain()
+        await harness.ircd.drain()
+
+        def _flooded() -> List[Tuple[float, float]]:
+            return [
+                (t, sent[l.params[2]]) for t, l in harness.bot.moded
+                if len(l.params) > 2 and l.params[2] in sent
+            ]
+        await harness.until(lambda: len(_flooded()) >= count, 300, 0.01)
+
+        flooded = _flooded()
+        result.samples = [t-queued for t, queued in flooded]
+        result.elapsed = max(t for t, _ in flooded)-start
+        result.count   = count
+    finally:
+        await harness.close()
+    return result
+
+async def expiry(scale: float, window: float = 5.0) -> Result:
+    # a pile of bans that all come due at about the same time
+    channels = _channels(10)
+    count    = max(1, int(10000*scale))
+    result   = Result("expiry", "bans")
+
+    harness = Harness()
+    try:
+        await harness.setup()
+        bans: List[Tuple[int, str]] = []
+        for c, name in enumerate(channels):
+            channel = await harness.db.channels.add(NETWORK, name)
+            fake    = harness.ircd.channel(name)
+            masks   = [_mask(c, i) for i in range(c, count, len(channels))]
+            await harness.db.bans.sync(channel, [], [
+                (OP, "b", mask, 1600000000) for mask in masks
+            ])
+            for mask in masks:
+                fake.lists["b"][mask] = (OP, 1600000000)
+                bans.append((await harness.db.bans.get_id(channel, "b", mask), mask))
+
+        # far enough out that we've joined everything by then
+        due = time()+3.0
+        expiries: Dict[str, float] = {}
+        for n, (id, mask) in enumerate(bans):
+            expiries[mask] = int(due + window*n/len(bans))
+        # all at once, so they share a flush of the write queue
+        await asyncio.gather(*[
+            harness.db.bans.set_expiry(id, expiries[mask]) for id, mask in bans
+        ])
+
+        await harness.connect()
+        await _joined(harness, channels, 60)
+        await harness.until(lambda: len(harness.ircd.removed) >= count, window+300, 0.01)
+
+        for removed, mode, mask in harness.ircd.removed:
+            result.samples.append(max(0.0, removed-expiries[mask]))
+        result.elapsed = max(r for r, _, _ in harness.ircd.removed)-min(expiries.values())
+        result.count   = count
+    finally:
+        await harness.close()
+    return result
+
+async def commands(scale: float) -> Result:
+    # lots of different people asking the bot things at once
+    users  = max(1, int(1000*scale))
+    result = Result("commands", "commands")
+
+    harness = Harness()
+    try:
+        await harness.setup()
+        channel = await harness.db.channels.add(NETWORK, "#bench")
+        fake    = harness.ircd.channel("#bench")
+        masks   = [_mask(0, i) for i in range(500)]
+        await harness.db.bans.sync(channel, [], [
+            (OP, "b", mask, 1600000000) for mask in masks
+        ])
+        for mask in masks:
+            fake.lists["b"][mask] = (OP, 1600000000)
+        first = await harness.db.bans.get_id(channel, "b", masks[0])
+
+        replies: Dict[str, float] = {}
+        def _watch(line: Line, now: float):
+            if line.command == "NOTICE":
+                replies.setdefault(line.params[0], now)
+        harness.ircd.watchers.append(_watch)
+
+        await harness.connect()
+        await _joined(harness, ["#bench"], 60)
+
+        sent: Dict[str, float] = {}
+        start = monotonic()
+        for i in range(users):
+            nick = f"user{i}"
+            if i % 2:
+                message = f"info {first + i % len(masks)}"
+            else:
+                message = f"check nick!user@host{i % len(masks)}.c0.bench #bench"
+            sent[nick] = monotonic()
+            harness.ircd.user_privmsg(f"{nick}!user@admin.bench", message)
+            if i % 100 == 0:
+                await harness.ircd.drain()
+        await harness.ircd.drain()
+        await harness.until(lambda: all(n in replies for n in sent), 300, 0.01)
+
+        for nick, queued in sent.items():
+            result.samples.append(replies[nick]-queued)
+        result.elapsed = max(replies[n] for n in sent)-start
+        result.count   = users
+    finally:
+        await harness.close()
+    return result
+
+def _rss() -> int:
+    # anonymous memory only: the database is mmapped, and pages of it
+    # being read in would otherwise count too
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1])*1024
+    except FileNotFoundError:
+        pass
+    # peak, not current, but it only goes up while loading
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+async def memory(scale: float) -> Result:
+    # what holding every active ban in memory costs, per 100k bans
+    channels = 100
+    count    = max(channels, int(100000*scale))
+    result   = Result("memory", "bans")
+
+    harness = Harness()
+    try:
+        await harness.setup()
+        ids = [await harness.db.channels.add(NETWORK, n) for n in _channels(channels)]
+        # a few chanops set most of the bans, and reasons come from a
+        # short list, as on a real network
+        setters = [f"op{i}!op{i}@staff.bench" for i in range(50)]
+        reasons = [None, "spam", "flood", "ban evasion", "trolling"]
+        async with harness.db._pool.connection() as db:
+            await db.executemany("""
+                INSERT INTO bans (channel_id, setter, mode, ts, mask, reason)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [
+                [ids[i % channels], setters[i % len(setters)],
+                    "q" if i % 10 == 0 else "b", 1600000000+i,
+                    _mask(i % channels, i), reasons[i % len(reasons)]]
+                for i in range(count)
+            ])
+            await db.commit()
+
+        gc.collect()
+        before = _rss()
+        start  = monotonic()
+        await harness.db.bans.load()
+        result.elapsed = monotonic()-start
+        gc.collect()
+        after  = _rss()
+
+        result.samples.append(result.elapsed)
+        result.count = count
+        result.notes["rss_mb_per_100k"] = (after-before)/count*100000/(1024*1024)
+    finally:
+        await harness.close()
+    return result
+
+SCENARIOS = {
+    "join":       join,
+    "startup":    startup,
+    "mode_flood": mode_flood,
+    "expiry":     expiry,
+    "commands":   commands,
+    "memory":     memory
+}
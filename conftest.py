@@ -0,0 +1,2 @@
+# here so pytest puts the repository root on sys.path, for `bans` and
+# `benchmarks`. fixtures are in tests/conftest.py
@@ -1,3 +1,5 @@
+-- the bot creates and migrates its schema on startup (bans/database/migrations.py);
+-- this file is kept for creating a database by hand
 PRAGMA foreign_keys=OFF;
 BEGIN TRANSACTION;
 CREATE TABLE channels (
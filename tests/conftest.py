@@ -0,0 +1,42 @@
+import asyncio, os
+
+import pytest
+
+from bans.database     import Database
+from benchmarks.harness import Harness
+
+# no test should take anywhere near this long (seconds)
+TIMEOUT = 60.0
+
+# tests are plain functions that hand a coroutine to one of these, so
+# everything (and the database's connections) lives and dies in one loop
+
+@pytest.fixture
+def with_db(tmp_path):
+    # runs `test(db)` against a new, migrated and preloaded database
+    def _run(test, **kwargs):
+        async def _inner():
+            db = Database(os.path.join(tmp_path, "bans.db"), **kwargs)
+            try:
+                await db.migrate()
+                await db.preload()
+                await asyncio.wait_for(test(db), TIMEOUT)
+            finally:
+                await db.close()
+        asyncio.run(_inner())
+    return _run
+
+@pytest.fixture
+def with_harness():
+    # runs `test(harness)` with the bot set up against a fake ircd, but
+    # not yet connected
+    def _run(test, **kwargs):
+        async def _inner():
+            harness = Harness(**kwargs)
+            try:
+                await harness.setup()
+                await asyncio.wait_for(test(harness), TIMEOUT)
+            finally:
+                await harness.close()
+        asyncio.run(_inner())
+    return _run
@@ -0,0 +1,183 @@
+import asyncio
+from time   import time
+from typing import List
+
+from irctokens import Line
+
+import bans.database.db_bans as db_bans
+from benchmarks.harness import NETWORK
+
+OP      = "op!op@op.bench"
+OP_ACCT = "op"
+
+async def _join(harness, *names: str):
+    ids = [await harness.db.channels.add(NETWORK, name) for name in names]
+    await harness.connect()
+    await harness.until(lambda: len(harness.bot.synced) >= len(names), 30, 0.01)
+    return ids
+
+async def _mode(harness, channel: str, modes: str, *args: str):
+    count = len(harness.bot.moded)
+    harness.ircd.user_mode(OP, channel, modes, list(args), OP_ACCT)
+    await harness.until(lambda: len(harness.bot.moded) > count, 10, 0.01)
+
+def test_mode_ops_apply_in_order(with_harness):
+    async def _test(harness):
+        channel, = await _join(harness, "#c")
+
+        await _mode(harness, "#c", "+b", "*!*@x")
+        first = await harness.db.bans.get_id(channel, "b", "*!*@x")
+        assert first is not None
+
+        # unset and set again in one line: still banned, same row
+        await _mode(harness, "#c", "-b+b", "*!*@x", "*!*@X")
+        assert await harness.db.bans.get_id(channel, "b", "*!*@x") == first
+
+        # set and unset in one line: not banned
+        await _mode(harness, "#c", "+b-b", "*!*@y", "*!*@y")
+        assert await harness.db.bans.get_id(channel, "b", "*!*@y") is None
+        assert await harness.db.bans.get_id(channel, "b", "*!*@x") == first
+    with_harness(_test)
+
+async def _command(harness,
+        nick:    str,
+        message: str,
+        last:    str,
+        host:    str = "admin.bench") -> List[str]:
+    # every NOTICE to `nick` up to and including one starting with `last`
+    replies: List[str] = []
+    def _watch(line: Line, now: float):
+        if line.command == "NOTICE" and line.params[0] == nick:
+            replies.append(line.params[1])
+    harness.ircd.watchers.append(_watch)
+    harness.ircd.user_privmsg(f"{nick}!user@{host}", message)
+    try:
+        await harness.until(lambda: any(r.startswith(last) for r in replies), 10, 0.01)
+    finally:
+        harness.ircd.watchers.remove(_watch)
+    return replies
+
+def test_list_setter_is_literal(with_harness):
+    async def _test(harness):
+        channel, = await _join(harness, "#c")
+        for setter in ["a_b!u@h", "axb!u@h", "a%b!u@h", "a\\b!u@h"]:
+            await harness.db.bans.add(channel, setter, "b", f"*!*@{setter[:3]}")
+
+        async def _setters(arg: str) -> List[str]:
+            replies = await _command(harness, "asker", f"list #c setter={arg}", "end of list")
+            return [r.split("\x02")[1] for r in replies if r.startswith("#")]
+
+        # LIKE's wildcards only match themselves
+        assert await _setters("a_b")  == ["a_b!u@h"]
+        assert await _setters("a%b")  == ["a%b!u@h"]
+        assert await _setters("a\\b") == ["a\\b!u@h"]
+        # ours still work
+        assert await _setters("a?b")  == ["a_b!u@h", "axb!u@h", "a%b!u@h", "a\\b!u@h"]
+        assert await _setters("a*!u@*") == ["a_b!u@h", "axb!u@h", "a%b!u@h", "a\\b!u@h"]
+    with_harness(_test)
+
+def test_archive_after_restricted(with_harness):
+    async def _test(harness):
+        await _join(harness, "#c")
+        replies = await _command(
+            harness, "user", "config archiveAfter 1", "Error", host="user.bench"
+        )
+        assert "restricted" in replies[-1]
+        assert await harness.db.config.bot.get("archiveAfter") is None
+
+        await _command(harness, "asker", "config archiveAfter 1", "done")
+        assert await harness.server.config.runtime.get("archiveAfter") == 1
+    with_harness(_test)
+
+def test_archived_ban_still_readable(with_db):
+    async def _test(db):
+        channel = await db.channels.add("net", "#c")
+        id      = await db.bans.add(channel, "op!u@h", "b", "*!*@old", reason="spam")
+        await db.comments.add(id, "op!u@h", "op", "still spam")
+        await db.bans.remove(id, "op!u@h")
+        # the newest ban never moves, see archive()
+        await db.bans.add(channel, "op!u@h", "b", "*!*@new")
+
+        assert await db.bans.archive(int(time())+1, 100) == 1
+        ban = await db.bans.get_by_id(id)
+        assert ban is not None
+        assert (ban.mask, ban.reason) == ("*!*@old", "spam")
+        assert ban.removed is not None
+        comments = await db.comments.get(id)
+        assert [c.comment for c in comments] == ["still spam"]
+    with_db(_test)
+
+async def _search(db) -> List[int]:
+    busy  = await db.channels.add("net", "#busy")
+    quiet = await db.channels.add("net", "#quiet")
+    # a few old matches in #quiet, then lots of newer ones in #busy
+    old = await asyncio.gather(*[
+        db.bans.add(quiet, "op", "b", f"*!*@old{i}", reason="spam")
+        for i in range(3)
+    ])
+    # one that only matches through a comment
+    commented = await db.bans.add(quiet, "op", "b", "*!*@commented")
+    await db.comments.add(commented, "op", None, "more spam")
+    await asyncio.gather(*[
+        db.bans.add(busy, "op", "b", f"*!*@new{i}", reason="spam")
+        for i in range(60)
+    ])
+
+    found = [b.id for b in await db.bans.search('"spam"', [quiet], 10)]
+    assert sorted(found) == sorted(old + [commented])
+    assert len(await db.bans.search('"spam"', None, 100)) == 64
+    # pages don't overlap or miss anything
+    pages = [
+        b.id
+        for offset in range(0, 64, 10)
+        for b in await db.bans.search('"spam"', [busy, quiet], 10, offset)
+    ]
+    assert len(set(pages)) == len(pages) == 64
+    return found
+
+def test_search_scoped_ranked(with_db):
+    with_db(_search)
+
+def test_search_scoped_unranked(with_db, monkeypatch):
+    # so many matches that they're shown newest first instead of ranked
+    monkeypatch.setattr(db_bans, "SEARCH_RANK_MAX", 5)
+    async def _test(db):
+        found = await _search(db)
+        assert found == sorted(found, reverse=True)
+    with_db(_test)
+
+def test_mask_identity_matches_index(with_db):
+    # rfc1459 would make these the same mask, but the unique index on
+    # active masks (lower(mask)) only folds ascii
+    async def _test(db):
+        channel = await db.channels.add("net", "#c")
+        square  = await db.bans.add(channel, "op", "b", "a[b!*@*")
+        curly   = await db.bans.add(channel, "op", "b", "a{b!*@*")
+        assert square != curly
+        assert await db.bans.add(channel, "op", "b", "A[B!*@*") == square
+        assert await db.bans.get_id(channel, "b", "a{b!*@*") == curly
+
+        await db.bans.remove(square, "op")
+        assert await db.bans.get_id(channel, "b", "a[b!*@*") is None
+        assert await db.bans.get_id(channel, "b", "a{b!*@*") == curly
+
+        # a sync that adds back the other one gets a row of its own
+        await db.bans.sync(channel, [], [("op", "b", "a[b!*@*", 0)])
+        active = await db.bans.get_by_channel(channel, True, limit=None)
+        assert sorted(b.mask for b in active) == ["a[b!*@*", "a{b!*@*"]
+    with_db(_test)
+
+def test_sync_keeps_masks_apart(with_harness):
+    async def _test(harness):
+        fake = harness.ircd.channel("#c")
+        fake.lists["b"]["a[b!*@*"] = (OP, 0)
+        fake.lists["b"]["a{b!*@*"] = (OP, 0)
+        channel, = await _join(harness, "#c")
+
+        active = await harness.db.bans.get_by_channel(channel, True, limit=None)
+        assert sorted(b.mask for b in active) == ["a[b!*@*", "a{b!*@*"]
+        # and a MODE for one of them leaves the other alone
+        await _mode(harness, "#c", "-b", "a{b!*@*")
+        active = await harness.db.bans.get_by_channel(channel, True, limit=None)
+        assert [b.mask for b in active] == ["a[b!*@*"]
+    with_harness(_test)
@@ -0,0 +1,35 @@
+import os
+import yaml
+
+from bans.config import load as config_load
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _load(tmp_path, edit):
+    with open(os.path.join(ROOT, "config.example.yaml")) as file:
+        config_yaml = yaml.safe_load(file)
+    config_yaml["database"] = os.path.join(tmp_path, "bans.db")
+    edit(config_yaml)
+
+    path = os.path.join(tmp_path, "config.yaml")
+    with open(path, "w") as file:
+        yaml.safe_dump(config_yaml, file)
+    return config_load(path)
+
+def test_snapshots_configured(tmp_path):
+    config = _load(tmp_path, lambda c: None)
+    assert config.snapshots is not None
+    directory, interval, keep = config.snapshots
+    assert (interval, keep) == (86400, 5)
+
+def test_snapshots_defaults(tmp_path):
+    def _edit(config_yaml):
+        config_yaml["snapshots"] = None
+    directory, interval, keep = _load(tmp_path, _edit).snapshots
+    assert directory == os.path.join(tmp_path, "bans.db.snapshots")
+    assert interval == 0
+
+def test_snapshots_off(tmp_path):
+    def _edit(config_yaml):
+        del config_yaml["snapshots"]
+    assert _load(tmp_path, _edit).snapshots is None
@@ -0,0 +1,149 @@
+import asyncio
+from time   import monotonic
+from typing import Dict, List
+
+from irctokens import Line
+
+from bans.dispatch      import Dispatcher
+from benchmarks.harness import NETWORK
+
+OP      = "op!op@op.bench"
+OP_ACCT = "op"
+
+# short, so lanes are torn down before the loop is
+IDLE = 0.05
+
+def _run(test):
+    asyncio.run(asyncio.wait_for(test(), 10))
+
+def test_lane_runs_in_order():
+    async def _test():
+        dispatch = Dispatcher(idle=IDLE)
+        ran: List[int] = []
+        async def _job(i: int):
+            # later jobs would overtake if a lane ran them concurrently
+            await asyncio.sleep(0.01 * (3-i))
+            ran.append(i)
+        for i in range(3):
+            assert dispatch.submit("a", lambda i=i: _job(i))
+        while len(ran) < 3:
+            await asyncio.sleep(0.01)
+        assert ran == [0, 1, 2]
+    _run(_test)
+
+def test_lanes_run_concurrently():
+    async def _test():
+        dispatch = Dispatcher(idle=IDLE)
+        stuck    = asyncio.Event()
+        done     = asyncio.Event()
+        async def _stuck():
+            await stuck.wait()
+        async def _done():
+            done.set()
+        dispatch.submit("slow", _stuck)
+        dispatch.submit("fast", _done)
+        await asyncio.wait_for(done.wait(), 1)
+        stuck.set()
+    _run(_test)
+
+def test_full_lane_sheds():
+    async def _test():
+        dispatch = Dispatcher(size=2, idle=IDLE)
+        stuck    = asyncio.Event()
+        async def _stuck():
+            await stuck.wait()
+
+        dispatch.submit("a", _stuck)
+        await asyncio.sleep(0.01)
+        # one running, two queued, and no room for the rest
+        results = [dispatch.submit("a", _stuck) for _ in range(4)]
+        assert results == [True, True, False, False]
+        lane, = dispatch.lanes()
+        assert lane.dropped == 2
+        # other lanes are still taking jobs
+        assert dispatch.submit("b", _stuck)
+        stuck.set()
+    _run(_test)
+
+def test_full_lane_coalesces():
+    async def _test():
+        dispatch = Dispatcher(size=3, idle=IDLE)
+        stuck    = asyncio.Event()
+        ran: List[str] = []
+        async def _job(name: str):
+            await stuck.wait()
+            ran.append(name)
+
+        dispatch.submit("a", lambda: _job("running"))
+        await asyncio.sleep(0.01)
+        for i in range(3):
+            assert dispatch.submit("a", lambda i=i: _job(f"job{i}"), lambda: _job("resync"))
+        # no room: what's queued is thrown away for the overflow job
+        assert not dispatch.submit("a", lambda: _job("job3"), lambda: _job("resync"))
+        lane, = dispatch.lanes()
+        assert lane.dropped == 4
+        stuck.set()
+        while len(ran) < 2:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        assert ran == ["running", "resync"]
+    _run(_test)
+
+def test_total_cap():
+    async def _test():
+        dispatch = Dispatcher(size=10, total=4, idle=IDLE)
+        stuck    = asyncio.Event()
+        async def _stuck():
+            await stuck.wait()
+        # the cap is across lanes, not per lane
+        accepted = [dispatch.submit(f"lane{i}", _stuck) for i in range(6)]
+        assert accepted == [True]*4 + [False]*2
+        await asyncio.sleep(0.01)
+        # each lane's first job is running now, so not queued
+        assert dispatch.submit("lane9", _stuck)
+        stuck.set()
+        await asyncio.sleep(IDLE*4)
+    _run(_test)
+
+def test_idle_lanes_torn_down():
+    async def _test():
+        dispatch = Dispatcher(idle=IDLE)
+        async def _job():
+            pass
+        dispatch.submit("a", _job)
+        assert len(dispatch.lanes()) == 1
+        await asyncio.sleep(IDLE*4)
+        assert dispatch.lanes() == []
+        # and a new one is made when it's needed again
+        dispatch.submit("a", _job)
+        assert len(dispatch.lanes()) == 1
+        await asyncio.sleep(IDLE*4)
+    _run(_test)
+
+def test_flooded_channel_doesnt_block_commands(with_harness):
+    # a channel flooding us with more list changes than its lane holds,
+    # while flood control holds the bot to a couple of lines a second
+    async def _test(harness):
+        await harness.db.channels.add(NETWORK, "#flood")
+        await harness.db.channels.add(NETWORK, "#quiet")
+
+        replies: Dict[str, float] = {}
+        def _watch(line: Line, now: float):
+            if line.command == "NOTICE":
+                replies.setdefault(line.params[0], now)
+        harness.ircd.watchers.append(_watch)
+
+        await harness.connect()
+        await harness.until(lambda: len(harness.bot.synced) >= 2, 30, 0.01)
+
+        for i in range(300):
+            masks = [f"*!*@host{i}-{j}.bench" for j in range(4)]
+            harness.ircd.user_mode(OP, "#flood", "+bbbb", masks, OP_ACCT)
+        await harness.ircd.drain()
+
+        start = monotonic()
+        harness.ircd.user_privmsg("asker!user@admin.bench", "check nick!user@host #quiet")
+        await harness.ircd.drain()
+        await harness.until(lambda: "asker" in replies, 10, 0.01)
+        assert replies["asker"]-start < 10
+    with_harness(_test, throttle=(2.0, 5))
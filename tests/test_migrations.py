@@ -0,0 +1,115 @@
+import asyncio, logging, os, re, sqlite3
+from time import time
+
+from bans.database            import Database
+from bans.database.migrations import MIGRATIONS
+
+LATEST = MIGRATIONS[-1][0]
+ROOT   = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _plans(caplog) -> str:
+    # every query is "slow" with slow=0, so each is logged with its plan
+    plans = [r.getMessage() for r in caplog.records if "| plan: " in r.getMessage()]
+    caplog.clear()
+    return "\n".join(plans)
+
+def test_hot_query_plans(with_db, caplog):
+    # an index that stops being used (a dropped index, a query rewritten
+    # so it no longer fits one) fails here rather than in production
+    async def _test(db):
+        channel = await db.channels.add("net", "#c")
+        id = await db.bans.add(channel, "op!o@h", "b", "*!*@x", int(time())+60)
+        await db.comments.add(id, "op!o@h", None, "hi")
+
+        hot = [
+            ("bans_active_expiry",       db.bans.get_expired),
+            ("bans_active_expiry",       db.bans.get_expiring),
+            ("bans_active_setter",       lambda: db.bans.get_last_by_setter("op!o@h", 5)),
+            ("bans_channel_history",     lambda: db.bans.get_by_channel(channel, False)),
+            ("bans_channel_history",     lambda: db.bans.get_by_channel(channel, None, None, 10, 0)),
+            ("bans_channel_history",     lambda: db.bans.get_by_channel(channel, None, "op!%")),
+            ("bans_channel ",            lambda: db.bans._load_active(channel)),
+            ("INTEGER PRIMARY KEY",      lambda: db.bans.get_by_id(id)),
+            ("comments_ban",             lambda: db.comments.get(id)),
+            ("setter_stats_bans",        lambda: db.stats.get([channel]))
+        ]
+        caplog.set_level(logging.WARNING, "bans.database.profile")
+        for index, call in hot:
+            caplog.clear()
+            await call()
+            plans = _plans(caplog)
+            assert f"USING INDEX {index}" in plans or f"USING {index}" in plans, plans
+            assert not re.search(r"SCAN bans\b", plans), plans
+    with_db(_test, slow=0.0)
+
+# something each migration leaves behind
+SCHEMA = {
+    1: ["bans", "channels", "chanops", "comments", "bot_config", "channel_config"],
+    2: ["bans_channel", "bans_active_expiry", "bans_active_setter", "comments_ban"],
+    3: ["bans_active_mask"],
+    4: ["channels_network_name"],
+    5: ["bans_channel_history"],
+    6: ["bans_fts", "comments_fts", "bans_fts_insert", "comments_fts_insert"],
+    7: ["bans_removed"],
+    8: ["imports", "import_map"],
+    9: ["channel_stats", "mode_stats", "setter_stats", "setter_stats_bans", "bans_stats_insert"]
+}
+
+async def _schema(db) -> set:
+    async with db._pool.connection() as conn:
+        cursor = await conn.execute("SELECT name FROM sqlite_master")
+        return {row[0] for row in await cursor.fetchall()}
+
+def test_migrate_fresh_is_idempotent(with_db):
+    async def _test(db):
+        assert sorted(SCHEMA) == [v for v, _ in MIGRATIONS]
+        names = await _schema(db)
+        for version, expected in SCHEMA.items():
+            assert set(expected) <= names, version
+        # again, with nothing left to do
+        assert await db.migrate() == LATEST
+        assert await _schema(db) == names
+    with_db(_test)
+
+def test_migrate_legacy_database(tmp_path):
+    # a database made by hand from make-database.sql, as before migrations
+    path = os.path.join(tmp_path, "bans.db")
+    with open(os.path.join(ROOT, "make-database.sql")) as file:
+        legacy = sqlite3.connect(path)
+        legacy.executescript(file.read())
+    legacy.executescript("""
+        INSERT INTO channels (id, name, autojoin) VALUES (1, '#c', 1);
+        INSERT INTO bans (id, channel_id, setter, mode, ts, mask, reason)
+        VALUES
+            (1, 1, 'op!o@h', 'b', 100, '*!*@X', 'spam'),
+            -- the same mask twice, which migration 3 has to resolve
+            (2, 1, 'op!o@h', 'b', 200, '*!*@x', NULL),
+            (3, 1, 'op!o@h', 'q', 300, '*!*@y', NULL);
+        INSERT INTO comments (ban_id, by_mask, by_account, time, comment)
+        VALUES (3, 'op!o@h', NULL, 300, 'flooding');
+    """)
+    legacy.commit()
+    legacy.close()
+
+    async def _test():
+        db = Database(path)
+        try:
+            assert await db.migrate() == LATEST
+            await db.preload()
+            names = await _schema(db)
+            for version, expected in SCHEMA.items():
+                assert set(expected) <= names, version
+
+            channel = await db.channels.from_id(1)
+            assert channel.network == "default"
+            # only the newest of the duplicates is left active
+            active = await db.bans.get_by_channel(1, by_active=True, limit=None)
+            assert [b.id for b in active] == [2, 3]
+            # full text search and stats are built from what was there
+            assert [b.id for b in await db.bans.search('"spam"')] == [1]
+            assert [b.id for b in await db.bans.search('"flooding"')] == [3]
+            stats = await db.stats.get([1])
+            assert (stats.total, stats.removed) == (3, 1)
+        finally:
+            await db.close()
+    asyncio.run(_test())
@@ -0,0 +1,119 @@
+import asyncio, gc
+from time   import monotonic
+from typing import Dict, List
+
+from irctokens           import build, Line
+from ircrobots.interface import SendPriority
+
+from bans.outbound      import OutboundQueue, TokenBucket
+from bans.outbound      import THROTTLE_BURST, THROTTLE_RATE
+from benchmarks.harness import NETWORK
+
+def _run(test):
+    asyncio.run(asyncio.wait_for(test(), 10))
+
+def test_bucket_rate():
+    async def _test():
+        bucket = TokenBucket(rate=20.0, burst=5)
+        start  = monotonic()
+        for _ in range(5):
+            await bucket.take()
+        # the burst goes straight out
+        assert monotonic()-start < 0.05
+        for _ in range(4):
+            await bucket.take()
+        # then 20 a second
+        assert 0.15 < monotonic()-start < 0.5
+    _run(_test)
+
+def test_priority_order():
+    async def _test():
+        sent: List[str] = []
+        async def _send(line: Line, priority: int):
+            sent.append(line.params[0])
+
+        outbound = OutboundQueue(_send, rate=50.0, burst=1)
+        futures  = [
+            outbound.put(build("PRIVMSG", ["low1", "x"]),  SendPriority.LOW),
+            outbound.put(build("PRIVMSG", ["med1", "x"]),  SendPriority.MEDIUM),
+            outbound.put(build("MODE",    ["high1", "x"]), SendPriority.HIGH),
+            outbound.put(build("PRIVMSG", ["low2", "x"]),  SendPriority.LOW),
+            outbound.put(build("MODE",    ["high2", "x"]), SendPriority.HIGH)
+        ]
+        await asyncio.gather(*futures)
+        # highest first, and in order within a priority
+        assert sent == ["high1", "high2", "med1", "low1", "low2"]
+        assert outbound.stats[SendPriority.HIGH].sent == 2
+        assert outbound.depth() == 0
+    _run(_test)
+
+def test_failed_send():
+    async def _test():
+        async def _send(line: Line, priority: int):
+            if line.params[0] == "bad":
+                raise ConnectionError()
+
+        loop   = asyncio.get_running_loop()
+        errors: List[dict] = []
+        loop.set_exception_handler(lambda loop, context: errors.append(context))
+
+        outbound = OutboundQueue(_send, rate=100.0, burst=10)
+        # nobody waiting on a failed line isn't an error
+        outbound.put(build("PRIVMSG", ["bad", "x"]), SendPriority.LOW)
+        bad  = outbound.put(build("PRIVMSG", ["bad", "x"]), SendPriority.LOW)
+        good = outbound.put(build("PRIVMSG", ["good", "x"]), SendPriority.LOW)
+
+        await asyncio.wait([bad, good])
+        assert isinstance(bad.exception(), ConnectionError)
+        assert good.exception() is None
+
+        gc.collect()
+        await asyncio.sleep(0)
+        assert errors == []
+    _run(_test)
+
+def test_pong_skips_flood_control(with_harness):
+    async def _test(harness):
+        pongs: Dict[str, float] = {}
+        def _watch(line: Line, now: float):
+            if line.command == "PONG":
+                pongs[line.params[-1]] = now
+        harness.ircd.watchers.append(_watch)
+
+        await harness.connect()
+        await harness.until(lambda: harness.server.registered, 5, 0.01)
+        # a minute's worth of unbans waiting on flood control, as urgent
+        # as anything but keepalives gets
+        for i in range(120):
+            harness.server.send(build("MODE", ["#c", "-b", f"*!*@host{i}"]))
+        await asyncio.sleep(0.1)
+
+        start = monotonic()
+        harness.ircd.send_raw("PING :are-you-there")
+        await harness.until(lambda: "are-you-there" in pongs, 5, 0.01)
+        assert pongs["are-you-there"]-start < 1.0
+        assert harness.server.outbound.depth() > 100
+    with_harness(_test, throttle=(2.0, 5))
+
+def test_pong_while_joining(with_harness):
+    # every self-JOIN has ircrobots' read loop sending MODE and WHO for the
+    # channel; none of that should keep it from reading the next PING
+    async def _test(harness):
+        for i in range(40):
+            await harness.db.channels.add(NETWORK, f"#chan{i}")
+
+        pongs: Dict[str, float] = {}
+        def _watch(line: Line, now: float):
+            if line.command == "PONG":
+                pongs[line.params[-1]] = now
+        harness.ircd.watchers.append(_watch)
+
+        await harness.connect()
+        await harness.until(lambda: harness.server.registered, 5, 0.01)
+        await asyncio.sleep(3)
+
+        start = monotonic()
+        harness.ircd.send_raw("PING :are-you-there")
+        await harness.until(lambda: "are-you-there" in pongs, 8, 0.01)
+        assert pongs["are-you-there"]-start < 2.0
+    with_harness(_test, throttle=(THROTTLE_RATE, THROTTLE_BURST))
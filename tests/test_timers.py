@@ -0,0 +1,137 @@
+import asyncio
+from time   import monotonic, time
+from typing import Dict, List, Optional, Tuple
+
+from bans.dispatch      import Dispatcher
+from bans.timers        import Archiver, ExpiryScheduler, UNBAN_RETRY, VACUUM_STEPS
+from benchmarks.harness import NETWORK
+
+OP = "op!op@op.bench"
+
+class StubServer(object):
+    # just what the scheduler uses of a network's connection
+    def __init__(self, channels: List[str], hang: bool = False):
+        self.channels = {c: None for c in channels}
+        self.dispatch = Dispatcher()
+        self.hang     = hang
+        self.unbans: List[Tuple[float, str, List[Tuple[str, Optional[str]]]]] = []
+
+    def casefold(self, s: str) -> str:
+        return s.lower()
+
+    async def _remove_modes(self, channel: str, bans: List[Tuple[str, Optional[str]]]):
+        self.unbans.append((monotonic(), channel, bans))
+        if self.hang:
+            # a connection that's stopped taking lines
+            await asyncio.Event().wait()
+
+class StubBot(object):
+    def __init__(self, servers: Dict[str, StubServer]):
+        self.servers = servers
+
+async def _until(check, timeout: float):
+    deadline = monotonic()+timeout
+    while not check():
+        assert monotonic() < deadline
+        await asyncio.sleep(0.01)
+
+async def _running(scheduler: ExpiryScheduler):
+    task = asyncio.create_task(scheduler.run())
+    await asyncio.sleep(0.05)
+    return task
+
+def _stop(task, *servers: StubServer):
+    task.cancel()
+    for server in servers:
+        for lane in server.dispatch.lanes():
+            if lane.task is not None:
+                lane.task.cancel()
+
+def test_slow_network_doesnt_hold_up_others(with_db):
+    async def _test(db):
+        slow = StubServer(["#slow"], hang=True)
+        fast = StubServer(["#fast"])
+        scheduler = ExpiryScheduler(StubBot({"slow": slow, "fast": fast}), db)
+        db.bans.watchers.append(scheduler)
+        task = await _running(scheduler)
+
+        # the slow network's channel comes first, so it'd be unbanned first
+        slow_id = await db.channels.add("slow", "#slow")
+        fast_id = await db.channels.add("fast", "#fast")
+        expiry  = int(time())+1
+        await db.bans.add(slow_id, "op", "b", "*!*@slow", expiry)
+        await db.bans.add(fast_id, "op", "b", "*!*@fast", expiry)
+
+        await _until(lambda: fast.unbans, 5)
+        assert fast.unbans[0][1:] == ("#fast", [("b", "*!*@fast")])
+        assert len(slow.unbans) == 1
+        _stop(task, slow, fast)
+    with_db(_test)
+
+def test_unban_retried_until_removed(with_db):
+    async def _test(db):
+        server    = StubServer(["#c"])
+        scheduler = ExpiryScheduler(StubBot({"net": server}), db, retry=0.2)
+        db.bans.watchers.append(scheduler)
+
+        channel = await db.channels.add("net", "#c")
+        # overdue from before we started, as after a restart
+        id = await db.bans.add(channel, "op", "b", "*!*@x", int(time())-60)
+        task = await _running(scheduler)
+
+        # never echoed back, so asked for again
+        await _until(lambda: len(server.unbans) >= 2, 5)
+        await db.bans.remove(id, "op")
+        await asyncio.sleep(0.1)
+        count = len(server.unbans)
+        await asyncio.sleep(0.5)
+        assert len(server.unbans) == count
+        _stop(task, server)
+    with_db(_test)
+
+def test_archiver_paces_vacuum():
+    class StubBans(object):
+        def __init__(self):
+            self.batches = [500, 500, 12]
+        async def archive(self, before: int, batch: int) -> int:
+            return self.batches.pop(0) if self.batches else 0
+    class StubDB(object):
+        def __init__(self):
+            self.bans   = StubBans()
+            self.vacuum_at: List[float] = []
+        async def vacuum(self, pages: int) -> int:
+            # never runs out of free pages
+            self.vacuum_at.append(monotonic())
+            return 1000000
+    class StubRuntime(object):
+        async def get(self, key: str):
+            return 30
+
+    async def _test():
+        db       = StubDB()
+        archiver = Archiver(db, StubRuntime(), pause=0.01)
+        assert await archiver.archive() == 1012
+        # a bounded number of steps a pass, with a rest between each
+        assert len(db.vacuum_at) == VACUUM_STEPS
+        gaps = [b-a for a, b in zip(db.vacuum_at, db.vacuum_at[1:])]
+        assert min(gaps) >= 0.009
+    asyncio.run(asyncio.wait_for(_test(), 10))
+
+def test_overdue_lifted_once_synced(with_harness):
+    # bans that went overdue while we were offline are lifted as soon as
+    # we're back in the channel, not when the unban is next retried
+    async def _test(harness):
+        channel = await harness.db.channels.add(NETWORK, "#c")
+        await harness.db.bans.add(channel, OP, "b", "*!*@x", int(time())-60)
+        harness.ircd.channel("#c").lists["b"]["*!*@x"] = (OP, 0)
+
+        # keep us out of the channel until the scheduler's first pass is done
+        harness.ircd.join_limit = (0, 60.0)
+        await harness.connect()
+        await harness.until(lambda: harness.ircd.throttled, 5, 0.01)
+        await asyncio.sleep(0.5)
+        harness.ircd.join_limit = None
+
+        await harness.until(lambda: harness.ircd.removed, UNBAN_RETRY/3, 0.01)
+        assert [mask for _, _, mask in harness.ircd.removed] == ["*!*@x"]
+    with_harness(_test)
@@ -0,0 +1,145 @@
+import asyncio, io, os
+from typing import Any, Dict, Iterable, List
+
+import pytest
+
+from bans.database          import Database
+from bans.database.transfer import BATCH, Importer
+from bans.transfer          import export, _read_csv
+
+OP = "op!op@op.bench"
+
+async def _fill(db: Database):
+    # source ids start high, so a remapping slip shows
+    filler = await db.channels.add("net", "#filler")
+    ids    = [await db.bans.add(filler, OP, "b", f"*!*@filler{i}") for i in range(20)]
+    await asyncio.gather(*[db.bans.remove(id) for id in ids])
+
+    channel = await db.channels.add("net", "#c")
+    await db.chanops.add(channel, "op")
+    await db.config.bot.set("reportChannel", "#reports")
+    ids = []
+    for i in range(10):
+        ids.append(await db.bans.add(channel, OP, "b", f"*!*@host{i}", reason=f"spam {i}"))
+        await db.comments.add(ids[-1], OP, "op", f"comment on host{i}")
+    await asyncio.gather(*[db.bans.remove(id, OP) for id in ids[1::2]])
+
+async def _import(db: Database, records: Iterable[Dict[str, Any]], batch: int = BATCH):
+    # the bot only sees imported data once restarted, which preload() stands in for
+    counts = await Importer(db._pool, batch).run(records)
+    await db.preload()
+    return counts
+
+async def _records(db: Database) -> List[Dict[str, Any]]:
+    return [record async for record in db.export()]
+
+async def _history(db: Database, name: str) -> List[Any]:
+    # what's there for a channel, without the ids
+    channel = await db.channels.get("net", name)
+    bans    = await db.bans.get_by_channel(channel.id, limit=None)
+    return sorted([
+        (b.mask, b.reason, b.removed is None,
+            [c.comment for c in await db.comments.get(b.id)])
+        for b in bans
+    ])
+
+def _with_dbs(with_db, tmp_path, test):
+    # `test(source, target)`, source filled in by _fill()
+    async def _test(source):
+        await _fill(source)
+        target = Database(os.path.join(tmp_path, "target.db"))
+        try:
+            await target.migrate()
+            await target.preload()
+            await test(source, target)
+        finally:
+            await target.close()
+    with_db(_test)
+
+def test_import_remaps_ids(with_db, tmp_path):
+    async def _test(source, target):
+        # ids the source's bans already have here
+        other = await target.channels.add("net", "#other")
+        for i in range(40):
+            await target.bans.add(other, OP, "b", f"*!*@other{i}")
+
+        await _import(target, await _records(source))
+        assert await _history(target, "#c") == await _history(source, "#c")
+        assert len(await _history(target, "#other")) == 40
+        channel = await target.channels.get("net", "#c")
+        assert await target.chanops.is_chanop(channel.id, "op")
+    _with_dbs(with_db, tmp_path, _test)
+
+def test_import_onto_active_ban(with_db, tmp_path):
+    async def _test(source, target):
+        channel  = await target.channels.add("net", "#c")
+        existing = await target.bans.add(channel, "other!u@h", "b", "*!*@HOST0")
+
+        counts = await _import(target, await _records(source))
+        assert counts["ban"] == 29
+        # the imported one's comment went onto the ban that was already here
+        ban = await target.bans.get_by_id(existing)
+        assert ban.setter == "other!u@h"
+        assert [c.comment for c in await target.comments.get(existing)] == [
+            "comment on host0"
+        ]
+        active = await target.bans.get_by_channel(channel, True, limit=None)
+        assert len(active) == 5
+    _with_dbs(with_db, tmp_path, _test)
+
+def test_import_resumes(with_db, tmp_path):
+    async def _test(source, target):
+        records = await _records(source)
+
+        def _interrupted(records: Iterable[Dict[str, Any]]):
+            for i, record in enumerate(records):
+                if i == len(records)//2:
+                    raise ConnectionError()
+                yield record
+        with pytest.raises(ConnectionError):
+            await Importer(target._pool, batch=4).run(_interrupted(records))
+
+        # picks up after what the first run committed
+        counts = await _import(target, records, 4)
+        assert 0 < counts["ban"] < 30
+        assert await _history(target, "#c") == await _history(source, "#c")
+        assert await _history(target, "#filler") == await _history(source, "#filler")
+    _with_dbs(with_db, tmp_path, _test)
+
+def test_import_twice_adds_nothing(with_db, tmp_path):
+    async def _test(source, target):
+        records = await _records(source)
+        first   = await _import(target, records)
+        assert first["ban"] == 30
+        assert first["comment"] == 10
+
+        again = await _import(target, records)
+        assert sum(again.values()) == 0
+        assert await _history(target, "#c") == await _history(source, "#c")
+    _with_dbs(with_db, tmp_path, _test)
+
+def test_import_same_ban_in_two_batches(with_db, tmp_path):
+    # a ban that was being archived when exported comes out twice, once
+    # from each database, with everything else in between
+    async def _test(source, target):
+        records = await _records(source)
+        removed = next(r for r in records if r["kind"] == "ban" and r["remove_ts"])
+        at      = max(i for i, r in enumerate(records) if r["kind"] == "ban")
+        records.insert(at+1, dict(removed))
+
+        await _import(target, records, 4)
+        assert await _history(target, "#filler") == await _history(source, "#filler")
+    _with_dbs(with_db, tmp_path, _test)
+
+def test_csv_round_trip(with_db, tmp_path):
+    async def _test(source, target):
+        out = io.StringIO()
+        await export(source, out, "csv")
+        records = list(_read_csv(io.StringIO(out.getvalue())))
+        # every type comes back as it went out
+        assert records[1:] == (await _records(source))[1:]
+
+        await _import(target, records)
+        assert await _history(target, "#c") == await _history(source, "#c")
+        assert await target.config.bot.get("reportChannel") == "#reports"
+    _with_dbs(with_db, tmp_path, _test)
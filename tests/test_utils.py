@@ -0,0 +1,84 @@
+import random, string
+from typing import List, Optional, Tuple
+
+from irctokens          import build
+from ircstates.isupport import ISupport
+
+from bans.utils import pack_modes, parse_modes, pack_joins, LINE_MAX
+
+CHARS = string.ascii_letters + string.digits + "*?!@.-_[]" + "äöü€"
+
+def _isupport(modes: Optional[int]) -> ISupport:
+    isupport = ISupport()
+    tokens   = ["CHANMODES=beIq,k,fl,imnpst", "PREFIX=(ov)@+"]
+    if modes is not None:
+        tokens.append(f"MODES={modes}")
+    isupport.from_tokens(tokens)
+    return isupport
+
+def _word(rng: random.Random, longest: int) -> str:
+    return "".join(rng.choice(CHARS) for _ in range(rng.randint(1, longest)))
+
+def _ops(rng: random.Random) -> List[Tuple[str, str, Optional[str]]]:
+    ops: List[Tuple[str, str, Optional[str]]] = []
+    for _ in range(rng.randint(1, 60)):
+        sign = rng.choice("+-")
+        mode = rng.choice("beIqovkflimnt")
+        if mode in "beIq":
+            # mostly masks, the odd one nearly as long as a line
+            arg: Optional[str] = _word(rng, rng.choice([40, 40, 40, 300]))
+        elif mode in "ovk":
+            arg = _word(rng, 20)
+        elif mode in "fl":
+            # only take a parameter when they're set
+            arg = str(rng.randint(1, 100)) if sign == "+" else None
+        else:
+            arg = None
+        ops.append((sign, mode, arg))
+    return ops
+
+def test_pack_modes_roundtrip():
+    rng = random.Random(1312)
+    for _ in range(2000):
+        modes    = rng.choice([None, 1, 3, 4, 6, 20])
+        isupport = _isupport(modes)
+        channel  = "#" + _word(rng, 30)
+        source   = f"{_word(rng, 16)}!{_word(rng, 10)}@{_word(rng, 63)}"
+        ops      = _ops(rng)
+
+        batches = pack_modes(isupport, channel, ops, len(source.encode("utf8"))+2)
+        parsed: List[Tuple[str, str, Optional[str]]] = []
+        for b_modes, b_args in batches:
+            # as the server relays it back to everyone, our hostmask and all
+            line = build("MODE", [channel, b_modes]+b_args, source=source)
+            assert len(f"{line.format()}\r\n".encode("utf8")) <= LINE_MAX
+            if modes:
+                assert len(b_args) <= modes
+            parsed.extend(parse_modes(isupport, line.params[1], line.params[2:]))
+        assert parsed == ops
+
+def test_pack_modes_needs_args():
+    isupport = _isupport(4)
+    try:
+        pack_modes(isupport, "#c", [("+", "b", None)])
+    except ValueError:
+        pass
+    else:
+        assert False, "+b without a mask was packed"
+
+def test_pack_joins():
+    rng = random.Random(1312)
+    for _ in range(200):
+        isupport = ISupport()
+        targmax  = rng.choice([None, 1, 5, 20])
+        if targmax is not None:
+            isupport.from_tokens([f"TARGMAX=JOIN:{targmax},PRIVMSG:4"])
+        channels = ["#" + _word(rng, 50) for _ in range(rng.randint(1, 200))]
+
+        batches = pack_joins(isupport, channels)
+        assert [c for b in batches for c in b] == channels
+        for names in batches:
+            line = build("JOIN", [",".join(names)])
+            assert len(f"{line.format()}\r\n".encode("utf8")) <= LINE_MAX
+            if targmax:
+                assert len(names) <= targmax
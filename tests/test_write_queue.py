@@ -0,0 +1,70 @@
+import asyncio
+from sqlite3 import IntegrityError
+from time    import monotonic
+
+from bans.database.write_queue import WriteQueue
+
+async def _count(db, query: str, args=[]) -> int:
+    async with db._pool.connection() as conn:
+        cursor = await conn.execute(query, args)
+        return (await cursor.fetchone())[0]
+
+def test_flushes_when_full(with_db):
+    async def _test(db):
+        channel = await db.channels.add("net", "#c")
+        # an interval long enough that only the size can trigger a flush
+        writes  = WriteQueue(db._pool, interval=30.0, size=50)
+
+        start   = monotonic()
+        futures = [writes.add(channel, "op", "b", f"*!*@{i}") for i in range(50)]
+        ids     = await asyncio.gather(*futures)
+        assert monotonic() - start < 5.0
+        assert len(set(ids)) == 50
+        assert await _count(db, "SELECT COUNT(*) FROM bans") == 50
+        await writes.close()
+    with_db(_test)
+
+def test_flushes_after_interval(with_db):
+    async def _test(db):
+        channel = await db.channels.add("net", "#c")
+        writes  = WriteQueue(db._pool, interval=0.05, size=1000)
+
+        id = await asyncio.wait_for(writes.add(channel, "op", "b", "*!*@x"), 5.0)
+        await writes.set_reason(id, "spam")
+        await writes.remove(id, "op2")
+        assert await _count(db,
+            "SELECT COUNT(*) FROM bans WHERE id = ? AND reason = 'spam' AND remover = 'op2'",
+            [id]
+        ) == 1
+        await writes.close()
+    with_db(_test)
+
+def test_bad_row_fails_alone(with_db):
+    async def _test(db):
+        channel = await db.channels.add("net", "#c")
+        writes  = WriteQueue(db._pool, interval=30.0, size=3)
+
+        results = await asyncio.gather(
+            writes.add(channel, "op", "b", "*!*@x"),
+            # the same active mask (case-insensitively) as the one above
+            writes.add(channel, "op", "b", "*!*@X"),
+            writes.add(channel, "op", "b", "*!*@y"),
+            return_exceptions=True
+        )
+        assert isinstance(results[0], int)
+        assert isinstance(results[1], IntegrityError)
+        assert isinstance(results[2], int)
+        assert await _count(db, "SELECT COUNT(*) FROM bans") == 2
+        await writes.close()
+    with_db(_test)
+
+def test_close_drains(with_db):
+    async def _test(db):
+        channel = await db.channels.add("net", "#c")
+        writes  = WriteQueue(db._pool, interval=30.0, size=1000)
+
+        futures = [writes.add(channel, "op", "b", f"*!*@{i}") for i in range(10)]
+        await writes.close()
+        assert all(f.done() and not f.exception() for f in futures)
+        assert await _count(db, "SELECT COUNT(*) FROM bans") == 10
+    with_db(_test)